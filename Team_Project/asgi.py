@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Team_Project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# 【新增】WebSocket 连接（ws/notes/<id>/，笔记实时协作）交给 knowledge_project.realtime 处理，
+# 其余请求仍由 Django 处理。需要在 get_asgi_application() 之后导入（应用注册表已就绪）。
+from knowledge_project.realtime import websocket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        await websocket_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
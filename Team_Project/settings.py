@@ -35,11 +35,15 @@ INSTALLED_APPS = [
 
 # --- 4. 中间件和 URL 配置 ---
 MIDDLEWARE = [
+    # 【新增】请求耗时、SQL 条数和缓存命中统计（Server-Timing 头、/metrics/），放在第一位以包含其他中间件的耗时
+    'knowledge_project.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # 【新增】按 URL 名称限流（规则见 KNOWLEDGE_RATE_LIMITS），需要在认证中间件之后
+    'knowledge_project.ratelimit.RateLimitMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -97,6 +101,20 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 MEDIA_URL = '/uploads/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'uploads')
+# 【新增】资产下载交给前端代理发送：'nginx'（X-Accel-Redirect）、'apache'（X-Sendfile），留空则由 Django 流式发送
+KNOWLEDGE_ASSET_SENDFILE = os.getenv('ASSET_SENDFILE') or None
+# nginx 中映射到 MEDIA_ROOT 的 internal location 前缀
+KNOWLEDGE_ASSET_ACCEL_PREFIX = '/protected-uploads/'
+# 【新增】请求剖析（见 knowledge_project/profiling.py）：慢请求阈值和 /metrics/ 的抓取令牌
+KNOWLEDGE_PROFILING = {
+    'SLOW_REQUEST_MS': int(os.getenv('SLOW_REQUEST_MS', 500)),
+    'METRICS_TOKEN': os.getenv('METRICS_TOKEN') or None,
+}
+# 【新增】没有修改权限的第三方视图按 URL 名称限流（见 knowledge_project/ratelimit.py 的 RateLimitMiddleware）
+KNOWLEDGE_RATE_LIMITS = {
+    # CKEditor 自带的图片上传接口
+    'ck_editor_5_upload_file': [{'rate': '30/m', 'key': 'user', 'methods': ['POST']}],
+}
 
 
 # --- 8. 认证、缓存、邮件 (清理重复项) ---
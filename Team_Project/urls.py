@@ -15,9 +15,12 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+import re
+
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+
+from knowledge_project import downloads
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -29,4 +32,7 @@ urlpatterns = [
     path("ckeditor5/", include('django_ckeditor_5.urls'), name="ck_editor_5_upload_file"),
 ]
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    # 【修改】不再用 static() 提供整个 MEDIA_ROOT：资产文件 (cas/、thumbs/、user_<id>/) 必须经过下载接口的权限检查
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), downloads.serve_public_media),
+    ]
@@ -0,0 +1,137 @@
+# knowledge_project/acache.py
+"""
+异步视图使用的缓存客户端。
+
+Django 4.2 的 cache.aget()/aset() 只是用 sync_to_async 包装同步实现，每次调用仍然要占用线程池中的一个线程；
+django-redis 也没有异步客户端。默认缓存是 django-redis 时，这里直接用 redis.asyncio 连接同一个 Redis：
+
+- 键名由 django-redis 客户端的 make_key 生成，值用它的 encode/decode 编解码，
+  与同步代码读写的是同一份缓存，两边可以混用（例如信号中 bump_version，异步视图中读取版本号）；
+- redis.asyncio 的连接不能跨事件循环使用，连接池按事件循环分别创建。
+
+默认缓存不是 django-redis 时（测试环境的 locmem 等）退回 Django 的 aget/aset 等方法。
+"""
+import asyncio
+import threading
+import weakref
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from . import profiling
+
+_clients = weakref.WeakKeyDictionary()  # 事件循环 -> redis.asyncio.Redis
+_clients_lock = threading.Lock()
+
+
+def is_redis():
+    return settings.CACHES.get('default', {}).get('BACKEND', '').startswith('django_redis')
+
+
+def _connect():
+    import redis.asyncio
+
+    config = settings.CACHES['default']
+    location = config['LOCATION']
+    if isinstance(location, (list, tuple)):
+        location = location[0]
+    # 与 django-redis 相同：逗号分隔的多个地址中第一个是主节点
+    url = location.split(',')[0].strip()
+    options = config.get('OPTIONS', {})
+    kwargs = dict(options.get('CONNECTION_POOL_KWARGS', {}))
+    if options.get('PASSWORD'):
+        kwargs['password'] = options['PASSWORD']
+    if options.get('SOCKET_TIMEOUT'):
+        kwargs['socket_timeout'] = options['SOCKET_TIMEOUT']
+    if options.get('SOCKET_CONNECT_TIMEOUT'):
+        kwargs['socket_connect_timeout'] = options['SOCKET_CONNECT_TIMEOUT']
+    return redis.asyncio.Redis.from_url(url, **kwargs)
+
+
+def get_client():
+    """返回当前事件循环的 redis.asyncio 客户端；默认缓存不是 django-redis 时返回 None。"""
+    if not is_redis():
+        return None
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(loop)
+            if client is None:
+                client = _clients[loop] = _connect()
+    return client
+
+
+def _key(key):
+    return cache.client.make_key(key)
+
+
+def _timeout(timeout):
+    return cache.get_backend_timeout(timeout)
+
+
+async def aget(key, default=None):
+    client = get_client()
+    if client is None:
+        value = await cache.aget(key)
+    else:
+        value = await client.get(_key(key))
+        value = None if value is None else cache.client.decode(value)
+    profiling.record_cache(key, value is not None)
+    return default if value is None else value
+
+
+async def aget_many(keys):
+    """返回 {key: value}，只包含命中的键（与 cache.get_many 一致）。"""
+    keys = list(keys)
+    client = get_client()
+    if client is None:
+        found = await cache.aget_many(keys)
+    elif not keys:
+        return {}
+    else:
+        values = await client.mget([_key(key) for key in keys])
+        found = {key: cache.client.decode(value) for key, value in zip(keys, values) if value is not None}
+    profiling.record_cache_many(keys, found)
+    return found
+
+
+async def aset(key, value, timeout=DEFAULT_TIMEOUT):
+    client = get_client()
+    if client is None:
+        return await cache.aset(key, value, timeout)
+    timeout = _timeout(timeout)
+    if timeout is not None and timeout <= 0:
+        await client.delete(_key(key))
+        return
+    await client.set(_key(key), cache.client.encode(value), ex=None if timeout is None else int(timeout) or 1)
+
+
+async def aset_many(mapping, timeout=DEFAULT_TIMEOUT):
+    client = get_client()
+    if client is None:
+        return await cache.aset_many(mapping, timeout)
+    timeout = _timeout(timeout)
+    # 管道：多个 SET 在一次网络往返中完成
+    async with client.pipeline(transaction=False) as pipe:
+        for key, value in mapping.items():
+            pipe.set(_key(key), cache.client.encode(value), ex=None if timeout is None else int(timeout) or 1)
+        await pipe.execute()
+
+
+async def aadd(key, value, timeout=DEFAULT_TIMEOUT):
+    """键不存在时写入，返回是否写入成功。"""
+    client = get_client()
+    if client is None:
+        return await cache.aadd(key, value, timeout)
+    timeout = _timeout(timeout)
+    return bool(await client.set(_key(key), cache.client.encode(value), nx=True,
+                                 ex=None if timeout is None else int(timeout) or 1))
+
+
+async def adelete(key):
+    client = get_client()
+    if client is None:
+        return await cache.adelete(key)
+    return bool(await client.delete(_key(key)))
@@ -1,15 +1,19 @@
 # knowledge_project/admin.py
-from django.contrib import admin
+import re
+
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
+from django.http import HttpResponseRedirect
 from django.urls import reverse
 from django.utils.html import format_html
 from django.db import models
 from django_json_widget.widgets import JSONEditorWidget
 # 【修改点】从 models.py 导入更新后的模型
-from .models import Project, ProjectMembership, Note, Asset, Profile
+from .models import Project, ProjectMembership, Note, Asset, Blob, Profile, EmailJob, VersionConflict
 from django_ckeditor_5.widgets import CKEditor5Widget
 from django import forms
+from . import search
 # ---------------------------------
 #  Inlines (内联模型)
 # ---------------------------------
@@ -32,6 +36,10 @@ class NoteInline(admin.TabularInline):
     verbose_name = "知识笔记"
     verbose_name_plural = "关联的知识笔记"
 
+    def get_queryset(self, request):
+        # 【优化】Note.objects 默认不读取正文，这里只显示标题和作者；作者随查询一起 JOIN 取回
+        return super().get_queryset(request).select_related('author')
+
     def save_model(self, request, obj, form, change):
         """【新增】在内联表单中保存时，自动设置作者"""
         if not obj.author_id:  # 只有在新建时才设置
@@ -78,6 +86,10 @@ class ProjectAdmin(admin.ModelAdmin):
     # 【修改点】将成员、笔记、资产的管理以内联方式加入
     inlines = [ProjectMembershipInline, NoteInline, AssetInline]
 
+    def get_queryset(self, request):
+        # 【优化】一次性预取所有者，避免列表页每行执行两次查询
+        return super().get_queryset(request).with_owner()
+
     @admin.display(description='所有者')
     def owner(self, obj):
         # 使用在模型中定义的 owner 属性
@@ -92,10 +104,14 @@ class ProjectAdmin(admin.ModelAdmin):
 class ProjectMembershipAdmin(admin.ModelAdmin):
     """【新增】项目成员关系的独立后台管理界面"""
     list_display = ('project', 'user', 'role', 'joined_at')
+    list_select_related = ('project', 'user')
     list_filter = ('role', 'project')
     search_fields = ('project__title', 'user__username')
     autocomplete_fields = ['project', 'user']
 
+VERSION_CONFLICT_MESSAGE = "打开此页面后，这篇笔记已被其他人修改。请复制您的修改，重新加载页面后再保存。"
+
+
 class NoteAdminForm(forms.ModelForm):
     # 【核心】在这里，我们强制 content 字段使用 CKEditor5Widget
     # 并指定使用我们之前在 settings.py 中定义的 'full' 配置
@@ -104,6 +120,25 @@ class NoteAdminForm(forms.ModelForm):
         widget=CKEditor5Widget(config_name='full'),
         required=False  # 根据你的模型字段设置，如果允许为空则设为False
     )
+    # 【新增】打开编辑页时的版本号，提交时据此发现期间其他人的修改（Note.version 本身不可编辑）
+    # 不能直接叫 version：不可编辑的模型字段不允许出现在 ModelAdmin 的表单中
+    base_version = forms.IntegerField(widget=forms.HiddenInput, required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.fields['base_version'].initial = self.instance.version
+            self.fields['base_version'].required = True
+
+    def clean(self):
+        cleaned_data = super().clean()
+        version = cleaned_data.get('base_version')
+        if self.instance.pk and version is not None:
+            # 后台的保存在一个事务中进行：锁住这一行直到提交，校验之后、写入之前不会再有其他人保存
+            current = Note.objects.select_for_update().values_list('version', flat=True).get(pk=self.instance.pk)
+            if version != current:
+                raise forms.ValidationError(VERSION_CONFLICT_MESSAGE, code='version_conflict')
+        return cleaned_data
 
     class Meta:
         model = Note
@@ -122,8 +157,11 @@ class NoteAdmin(admin.ModelAdmin):
     form = NoteAdminForm
 
     list_display = ('title', 'author', 'project', 'is_public', 'display_public_link', 'created_at')
+    # 【优化】作者和项目随列表查询一起 JOIN 取回，避免每行单独查询
+    list_select_related = ('author', 'project')
     list_filter = ('is_public', 'project', 'author')
-    search_fields = ('title', 'project__title', 'author__username', 'content')
+    # 【修改】正文不再用 content LIKE 全表扫描（压缩存储的笔记也搜不到），改为在 get_search_results 中查倒排索引
+    search_fields = ('title', 'project__title', 'author__username')
     autocomplete_fields = ['project', 'author']
     readonly_fields = ('public_id',)
 
@@ -132,9 +170,29 @@ class NoteAdmin(admin.ModelAdmin):
     #     models.JSONField: {'widget': JSONEditorWidget},
     # }
 
+    def get_search_results(self, request, queryset, search_term):
+        """【新增】标题/项目/作者按 search_fields 匹配，正文通过全文检索的倒排索引匹配，两者取并集。"""
+        matched, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            matched |= queryset.filter(pk__in=search.note_ids(search_term))
+        return matched, may_have_duplicates
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        try:
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        except VersionConflict:
+            # NoteAdminForm.clean 已经锁住了这一行，正常不会走到这里；万一发生（例如不支持行锁的数据库），
+            # 事务已经回滚，提示用户重新加载，而不是返回 500
+            self.message_user(request, VERSION_CONFLICT_MESSAGE, messages.ERROR)
+            return HttpResponseRedirect(request.get_full_path())
+
     def save_model(self, request, obj, form, change):
         if not change:
             obj.author = request.user
+        else:
+            # 【新增】以表单打开时的版本号做条件更新，而不是提交时重新加载的版本号
+            obj.version = form.cleaned_data['base_version']
+        obj._revision_author = request.user  # 【新增】记录到历史版本中
         super().save_model(request, obj, form, change)
 
     @admin.display(description='公开链接')
@@ -188,20 +246,14 @@ class AssetAdmin(admin.ModelAdmin):
             obj.uploader = request.user
 
         # 2. 如果 name 字段为空，则使用文件名填充
-        #    注意：必须在 super().save_model 之前操作 obj，
-        #    但在文件真正保存后，obj.file.name 才会有值。
-        #    所以我们先调用 super().save_model 保存文件，再补充 name。
-
-        # 先执行默认的保存，这会处理文件上传
-        super().save_model(request, obj, form, change)
-
-        # 此时 obj.file.name 已经有值了
-        if not obj.name:
+        #    【修改】文件按内容哈希保存后 obj.file.name 会变成哈希路径，
+        #    所以要在 super().save_model 之前，用上传时的原始文件名填充 name。
+        if not obj.name and obj.file:
             # os.path.basename 可以去掉 Django 可能添加的路径前缀
             import os
             obj.name = os.path.basename(obj.file.name)
-            # 再次保存以更新 name 字段
-            obj.save()
+
+        super().save_model(request, obj, form, change)
 
 
 @admin.register(Profile)
@@ -210,6 +262,38 @@ class ProfileAdmin(admin.ModelAdmin):
     search_fields = ('user__username',)
     readonly_fields = ('user', 'activation_code', 'code_created_at')
 
+# 邮件正文中的验证码（连续 4 位以上的数字或大写字母+数字组合）
+_CODE_RE = re.compile(r'(?<![A-Za-z0-9])(?=[A-Z0-9]*\d)[A-Z0-9]{4,}(?![A-Za-z0-9])')
+
+
+@admin.register(EmailJob)
+class EmailJobAdmin(admin.ModelAdmin):
+    """【新增】邮件队列的投递状态，只读查看"""
+    list_display = ('subject', 'recipients', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('subject',)
+    # 【修改】正文里是仍然有效的验证码，后台只显示打码后的版本，原文不出现在页面上
+    fields = readonly_fields = ('subject', 'redacted_body', 'from_email', 'recipients', 'status', 'attempts',
+                                'max_attempts', 'next_attempt_at', 'locked_at', 'last_error', 'created_at', 'sent_at',
+                                'expires_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description='正文（已隐藏验证码）')
+    def redacted_body(self, obj):
+        return _CODE_RE.sub(lambda m: '*' * len(m.group()), obj.body)
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    """【新增】内容寻址存储中的文件，只读查看去重情况"""
+    list_display = ('sha256', 'size', 'ref_count', 'created_at')
+    search_fields = ('sha256',)
+    readonly_fields = ('sha256', 'file', 'size', 'ref_count', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
 # ---------------------------------
 #  Custom User Admin (自定义用户后台)
 # ---------------------------------
@@ -0,0 +1,122 @@
+# knowledge_project/assets.py
+"""
+Asset 与内容寻址文件 (Blob) 之间的引用计数，以及孤立文件的垃圾回收。
+
+- Asset 保存后由信号调用 attach_blob()：根据文件路径中的哈希找到（或创建）Blob，
+  文件内容变化时新 Blob +1、旧 Blob -1；
+- Asset 删除后由信号调用 release_blob()；
+- collect_garbage() 删除没有任何 Asset 引用的 Blob、磁盘上没有 Blob 记录的文件及其缩略图。
+  只处理超过宽限期的对象，避免误删正在上传、尚未写入 Asset 的文件。
+"""
+import logging
+import os
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, ProtectedError
+from django.utils import timezone
+
+from .models import Asset, Blob
+from .storage import asset_storage, digest_from_name
+from .thumbnails import THUMBS_DIR
+
+logger = logging.getLogger(__name__)
+
+GC_GRACE_PERIOD = timedelta(hours=24)
+
+
+def attach_blob(asset):
+    """让 asset.blob 指向其文件内容对应的 Blob，并维护引用计数。旧路径的文件不处理。"""
+    digest = digest_from_name(asset.file.name)
+    blob_id = None
+    if digest:
+        blob, _ = Blob.objects.get_or_create(
+            sha256=digest, defaults={'file': asset.file.name, 'size': asset.file.size},
+        )
+        blob_id = blob.pk
+    if blob_id == asset.blob_id:
+        return
+    with transaction.atomic():
+        Asset.objects.filter(pk=asset.pk).update(blob_id=blob_id)
+        if blob_id:
+            Blob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') + 1)
+        if asset.blob_id:
+            Blob.objects.filter(pk=asset.blob_id).update(ref_count=F('ref_count') - 1)
+    asset.blob_id = blob_id
+
+
+def release_blob(blob_id):
+    if blob_id:
+        Blob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+
+
+def recount():
+    """按实际引用重新计算 ref_count（修正进程崩溃等原因造成的偏差），返回修正的行数。"""
+    fixed = 0
+    for blob_id, ref_count, actual in Blob.objects.annotate(actual=Count('assets')).exclude(
+            ref_count=F('actual')).values_list('pk', 'ref_count', 'actual'):
+        Blob.objects.filter(pk=blob_id).update(ref_count=actual)
+        fixed += 1
+    return fixed
+
+
+def collect_garbage(grace_period=GC_GRACE_PERIOD, dry_run=False):
+    """
+    删除孤立的 Blob 和文件，返回 {'recounted', 'blobs', 'files', 'temp_files', 'bytes'}。
+    dry_run 时只统计，不删除。
+    """
+    stats = {'recounted': 0 if dry_run else recount(), 'blobs': 0, 'files': 0, 'temp_files': 0, 'bytes': 0}
+    cutoff = timezone.now() - grace_period
+    cutoff_ts = time.time() - grace_period.total_seconds()
+
+    # 1. 没有 Asset 引用的 Blob：先删行（on_delete=PROTECT，如果刚好被新 Asset 引用会失败并跳过），再删文件
+    orphans = Blob.objects.filter(assets__isnull=True, created_at__lt=cutoff)
+    for blob in orphans.iterator():
+        try:
+            if _is_recent(blob.file.name, cutoff_ts):
+                continue
+            if not dry_run:
+                with transaction.atomic():
+                    blob.delete()
+                asset_storage.delete(blob.file.name)
+        except ProtectedError:
+            continue
+        stats['blobs'] += 1
+        stats['bytes'] += blob.size
+
+    # 2. 磁盘上有、数据库中没有记录的文件（例如保存文件后、写入 Asset 前进程崩溃）
+    known = set(Blob.objects.values_list('sha256', flat=True))
+    for name, mtime in asset_storage.iter_blob_names():
+        digest = digest_from_name(name)
+        if mtime < cutoff_ts and (digest is None or digest not in known):
+            stats['files'] += 1
+            stats['bytes'] += asset_storage.size(name)
+            if not dry_run:
+                asset_storage.delete(name)
+
+    # 3. 内容已经被回收的缩略图（文件名以内容哈希开头）
+    for name, mtime in asset_storage.iter_blob_names(THUMBS_DIR):
+        digest = os.path.basename(name).split('_', 1)[0]
+        if mtime < cutoff_ts and digest not in known:
+            stats['files'] += 1
+            stats['bytes'] += asset_storage.size(name)
+            if not dry_run:
+                asset_storage.delete(name)
+
+    # 4. 上传中断遗留的临时文件
+    for path, mtime in asset_storage.iter_temp_files():
+        if mtime < cutoff_ts:
+            stats['temp_files'] += 1
+            stats['bytes'] += os.path.getsize(path)
+            if not dry_run:
+                os.remove(path)
+    return stats
+
+
+def _is_recent(name, cutoff_ts):
+    """文件在宽限期内被重新上传过（storage 会刷新修改时间）时不删除。"""
+    try:
+        return os.path.getmtime(asset_storage.path(name)) >= cutoff_ts
+    except OSError:
+        return False
@@ -0,0 +1,331 @@
+# knowledge_project/benchmark.py
+"""
+笔记接口的基准测试（bench_api 命令使用）。
+
+- generate()：按规模生成用户、项目、成员关系和笔记。笔记正文是 CKEditor 风格的 HTML（标题、段落、列表、表格、
+  代码块、图片、分页符），长度服从对数正态分布，另有若干篇数 MB 的超大笔记；生成后执行渲染管线并建立检索索引，
+  与通过界面保存的笔记状态一致；
+- Runner：用 Django 测试客户端按场景发出请求，记录每个请求的耗时和 SQL 查询条数；
+- summarize() / compare()：计算 p50/p95/p99 和每个请求的平均查询数，与保存的基线比较，
+  超出容差的场景作为回退返回。查询数是确定的（同一份数据、同一个种子），任何增加都算回退。
+
+场景：
+    sidebar      GET knowledge_list（侧边栏首屏）
+    sidebar_api  GET get_all_notes_api（完整笔记列表）
+    page_flip    在超大笔记中逐页翻页 GET api_note_detail?page=N
+    search       GET api_search_notes?q=<中等频率的词>
+    save         PUT api_note_detail（带 If-Match，正文追加一段）
+"""
+import itertools
+import json
+import math
+import random
+import string
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import provisioning, rendering, search, visibility
+from .models import Note, Project, ProjectMembership
+
+# 常用汉字，用来拼出中文“词语”
+COMMON_HANZI = '的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严龙飞'
+
+USERNAME_PREFIX = 'bench_'
+
+# notes：普通笔记数量；large_notes / large_size：超大笔记的数量和字符数
+SCALES = {
+    'tiny': {'users': 4, 'projects': 2, 'notes': 12, 'large_notes': 1, 'large_size': 60_000},
+    'small': {'users': 30, 'projects': 6, 'notes': 300, 'large_notes': 2, 'large_size': 1_000_000},
+    'medium': {'users': 200, 'projects': 40, 'notes': 5_000, 'large_notes': 4, 'large_size': 2_500_000},
+    'large': {'users': 2_000, 'projects': 300, 'notes': 50_000, 'large_notes': 10, 'large_size': 5_000_000},
+}
+# 普通笔记长度（字符数）的对数正态分布：中位数约 3KB，长尾到数百 KB
+SIZE_MEDIAN = 3_000
+SIZE_SIGMA = 1.2
+SIZE_LIMITS = (200, 400_000)
+
+SCENARIOS = ('sidebar', 'sidebar_api', 'page_flip', 'search', 'save')
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def vocabulary(rng):
+    english = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(3000)]
+    chinese = [''.join(rng.choices(COMMON_HANZI, k=2)) for _ in range(1000)]
+    words = english + chinese
+    rng.shuffle(words)
+    return words
+
+
+class TextSource:
+    """按近似 Zipf 分布取词：靠前的词出现得更频繁。"""
+
+    def __init__(self, rng, words):
+        self.rng = rng
+        self.words = words
+        self.cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+
+    def pick(self, k):
+        return self.rng.choices(self.words, cum_weights=self.cum_weights, k=k)
+
+    def sentence(self, low=6, high=24):
+        return ' '.join(self.pick(self.rng.randint(low, high)))
+
+
+def ckeditor_html(text, size):
+    """生成约 size 个字符的 CKEditor 风格 HTML。"""
+    rng = text.rng
+    blocks, length = [], 0
+    while length < size:
+        kind = rng.random()
+        if kind < 0.08:
+            block = f'<h2>{text.sentence(2, 6)}</h2>'
+        elif kind < 0.15:
+            block = f'<h3>{text.sentence(2, 6)}</h3>'
+        elif kind < 0.6:
+            words = text.pick(rng.randint(20, 120))
+            if rng.random() < 0.3:
+                i = rng.randrange(len(words))
+                words[i] = f'<strong>{words[i]}</strong>'
+            if rng.random() < 0.15:
+                i = rng.randrange(len(words))
+                words[i] = f'<a href="https://example.com/{words[i]}">{words[i]}</a>'
+            block = f'<p>{" ".join(words)}</p>'
+        elif kind < 0.72:
+            tag = rng.choice(('ul', 'ol'))
+            items = ''.join(f'<li>{text.sentence(3, 12)}</li>' for _ in range(rng.randint(2, 6)))
+            block = f'<{tag}>{items}</{tag}>'
+        elif kind < 0.8:
+            rows = ''.join('<tr>' + ''.join(f'<td>{text.sentence(1, 4)}</td>' for _ in range(4)) + '</tr>'
+                           for _ in range(rng.randint(2, 6)))
+            block = f'<figure class="table"><table><tbody>{rows}</tbody></table></figure>'
+        elif kind < 0.88:
+            lines = '\n'.join(f'{text.pick(1)[0]} = {text.pick(1)[0]}({rng.randint(0, 99)})'
+                              for _ in range(rng.randint(3, 12)))
+            block = f'<pre><code class="language-python">{lines}</code></pre>'
+        elif kind < 0.94:
+            block = (f'<figure class="image"><img src="/uploads/bench/{rng.randint(1, 999)}.png" '
+                     f'width="{rng.randint(200, 1200)}" height="{rng.randint(100, 800)}">'
+                     f'<figcaption>{text.sentence(2, 6)}</figcaption></figure>')
+        elif kind < 0.98:
+            block = f'<blockquote><p>{text.sentence()}</p></blockquote>'
+        else:
+            block = '<div class="page-break" style="page-break-after:always;"><span style="display:none;">&nbsp;</span></div>'
+        blocks.append(block)
+        length += len(block)
+    return ''.join(blocks)
+
+
+def note_size(rng):
+    size = int(rng.lognormvariate(math.log(SIZE_MEDIAN), SIZE_SIGMA))
+    return max(SIZE_LIMITS[0], min(size, SIZE_LIMITS[1]))
+
+
+# ---------------------------------
+#  数据生成
+# ---------------------------------
+
+def _marker(scale, seed):
+    return f'__bench__ {scale} {seed}'
+
+
+def has_dataset(scale, seed):
+    return Project.objects.filter(title=_marker(scale, seed)).exists()
+
+
+def generate(scale='small', seed=42, progress=None):
+    """生成一份基准数据。progress(message) 可选，用于输出进度。"""
+    config = SCALES[scale]
+    rng = random.Random(seed)
+    text = TextSource(rng, vocabulary(rng))
+    say = progress or (lambda message: None)
+
+    started = time.perf_counter()
+    provisioning.provision_users([{'username': f'{USERNAME_PREFIX}{i}', 'email': f'{USERNAME_PREFIX}{i}@example.com'}
+                                  for i in range(config['users'])])
+    users = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('pk').values_list('pk', flat=True))
+
+    # 第一个项目只作为“已生成”的标记，不放笔记
+    Project.objects.bulk_create([Project(title=_marker(scale, seed))] +
+                                [Project(title=f'bench project {i}') for i in range(config['projects'])])
+    projects = list(Project.objects.filter(title__startswith='bench project ').values_list('pk', flat=True))
+
+    # 每个用户加入 1-3 个项目；第一个成员是所有者；0 号用户加入所有项目（侧边栏最重的情况）
+    writers = {pid: [] for pid in projects}
+    memberships = []
+    for index, user_id in enumerate(users):
+        joined = projects if index == 0 else rng.sample(projects, k=min(len(projects), rng.randint(1, 3)))
+        for pid in joined:
+            role = 'owner' if not writers[pid] else rng.choices(('admin', 'editor', 'viewer'), (1, 6, 3))[0]
+            memberships.append(ProjectMembership(user_id=user_id, project_id=pid, role=role))
+            if role != 'viewer':
+                writers[pid].append(user_id)
+    ProjectMembership.objects.bulk_create(memberships, batch_size=1000)
+    say(f"用户 {len(users)}，项目 {len(projects)}，成员关系 {len(memberships)}，耗时 {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    sizes = [note_size(rng) for _ in range(config['notes'])] + [config['large_size']] * config['large_notes']
+    total_chars = 0
+    for offset in range(0, len(sizes), 200):
+        batch = []
+        for size in sizes[offset:offset + 200]:
+            project_id = rng.choice(projects) if rng.random() < 0.9 else None
+            # 作者总是有写权限的成员，save 场景以作者身份保存
+            author_id = rng.choice(writers[project_id]) if project_id else rng.choice(users)
+            batch.append(Note(title=text.sentence(2, 8)[:255], content=ckeditor_html(text, size),
+                              author_id=author_id, project_id=project_id))
+            total_chars += size
+        # bulk_create 不触发信号，渲染、索引和可见性表在这里统一维护；
+        # MySQL 的 bulk_create 不回填主键，按插入前的最大主键重新读取这一批
+        last_pk = Note.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        Note.objects.bulk_create(batch)
+        created = list(Note.objects.with_content().filter(pk__gt=last_pk).order_by('pk'))
+        for note in created:
+            rendering.render_note(note)
+        search.get_backend().index_notes(created)
+        visibility.index_notes(created)
+        say(f"笔记 {min(offset + 200, len(sizes))}/{len(sizes)}")
+    say(f"笔记 {len(sizes)} 篇，共约 {total_chars / 1e6:.1f}M 字符，耗时 {time.perf_counter() - started:.1f}s")
+
+
+def load_context(seed=42):
+    """读取已生成的数据中场景需要的对象。"""
+    rng = random.Random(seed)
+    words = vocabulary(rng)
+    users = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('pk').values_list('pk', flat=True))
+    notes = list(Note.objects.filter(author_id__in=users).values('pk', 'author_id', 'page_count', 'project_id'))
+    editable = [row for row in notes if row['page_count'] <= 5]
+    return {
+        'users': users,
+        'heavy_user': users[0],
+        'large_notes': [row for row in sorted(notes, key=lambda row: -row['page_count'])[:3]],
+        'editable_notes': editable or notes,
+        # 中等频率的词：既不是几乎每篇都有的高频词，也不是不存在的词
+        'queries': words[50:1000],
+    }
+
+
+# ---------------------------------
+#  场景
+# ---------------------------------
+
+class Runner:
+    """按场景发出请求并记录 (耗时毫秒, 查询条数)。"""
+
+    def __init__(self, context, seed=42, client_class=Client):
+        self.context = context
+        self.rng = random.Random(seed)
+        self.client_class = client_class
+        self.clients = {}
+        self.samples = {}
+        self.versions = {}
+
+    def client(self, user_id):
+        if user_id not in self.clients:
+            client = self.client_class()
+            client.force_login(User.objects.get(pk=user_id))
+            self.clients[user_id] = client
+        return self.clients[user_id]
+
+    def request(self, scenario, user_id, method, path, record=True, **kwargs):
+        client = self.client(user_id)
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            response = getattr(client, method)(path, **kwargs)
+            elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code >= 400:
+            raise RuntimeError(f'{scenario}: {method.upper()} {path} 返回 {response.status_code}')
+        if record:
+            self.samples.setdefault(scenario, []).append((elapsed, len(ctx.captured_queries)))
+        return response
+
+    def sidebar(self, record=True):
+        user = self.rng.choice(self.context['users'][:5])
+        self.request('sidebar', user, 'get', reverse('knowledge_list'), record)
+
+    def sidebar_api(self, record=True):
+        self.request('sidebar_api', self.context['heavy_user'], 'get', reverse('get_all_notes_api'), record)
+
+    def page_flip(self, record=True):
+        note = self.rng.choice(self.context['large_notes'])
+        page = self.rng.randint(1, max(note['page_count'], 1))
+        self.request('page_flip', note['author_id'], 'get',
+                     reverse('api_note_detail', args=[note['pk']]), record, data={'page': page})
+
+    def search(self, record=True):
+        query = self.rng.choice(self.context['queries'])
+        self.request('search', self.context['heavy_user'], 'get', reverse('api_search_notes'), record,
+                     data={'q': query})
+
+    def save(self, record=True):
+        note = self.rng.choice(self.context['editable_notes'])
+        url = reverse('api_note_detail', args=[note['pk']])
+        if note['pk'] not in self.versions:
+            data = self.request('save', note['author_id'], 'get', url, record=False, data={'full_content': 'true'}).json()
+            self.versions[note['pk']] = (data['version'], data['content'])
+        version, content = self.versions[note['pk']]
+        content += f'<p>{self.rng.random()}</p>'
+        response = self.request('save', note['author_id'], 'put', url, record,
+                                data=json.dumps({'content': content}), content_type='application/json',
+                                HTTP_IF_MATCH=f'"{version}"')
+        self.versions[note['pk']] = (response.json()['version'], content)
+
+    def run(self, scenarios=SCENARIOS, iterations=50, warmup=5):
+        for name in scenarios:
+            step = getattr(self, name)
+            for _ in range(warmup):
+                step(record=False)
+            for _ in range(iterations):
+                step()
+        return self.samples
+
+
+# ---------------------------------
+#  统计与基线
+# ---------------------------------
+
+def summarize(samples):
+    summary = {}
+    for name, rows in samples.items():
+        latencies = [ms for ms, _ in rows]
+        queries = [count for _, count in rows]
+        summary[name] = {
+            'n': len(rows),
+            'p50': round(_percentile(latencies, 50), 3),
+            'p95': round(_percentile(latencies, 95), 3),
+            'p99': round(_percentile(latencies, 99), 3),
+            'mean': round(sum(latencies) / len(latencies), 3),
+            'queries': round(sum(queries) / len(queries), 2),
+            'max_queries': max(queries),
+        }
+    return summary
+
+
+def compare(summary, baseline, tolerance=0.25, min_delta_ms=2.0):
+    """
+    返回回退列表（空列表表示通过）。
+    耗时：p50 或 p95 比基线慢 tolerance 以上，并且绝对差值超过 min_delta_ms（避免毫秒以下的抖动误报）；
+    查询：平均查询数比基线多 0.5 条以上，或最大查询数增加。
+    """
+    regressions = []
+    for name, current in summary.items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None:
+            continue
+        for stat in ('p50', 'p95'):
+            if current[stat] > base[stat] * (1 + tolerance) and current[stat] - base[stat] > min_delta_ms:
+                regressions.append(f'{name} {stat}: {base[stat]:.1f}ms -> {current[stat]:.1f}ms '
+                                   f'(+{(current[stat] / base[stat] - 1) * 100:.0f}%)')
+        if current['queries'] > base['queries'] + 0.5 or current['max_queries'] > base['max_queries']:
+            regressions.append(f"{name} 查询数: {base['queries']} (最多 {base['max_queries']}) -> "
+                               f"{current['queries']} (最多 {current['max_queries']})")
+    return regressions
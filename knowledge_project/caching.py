@@ -0,0 +1,200 @@
+# knowledge_project/caching.py
+"""
+侧边栏笔记列表的版本化缓存。
+
+原来的做法是按用户缓存整份列表 (sidebar_notes_user_{id})，笔记修改时只能删除编辑者自己的缓存，
+同项目的其他成员最长要等 15 分钟才能看到新标题。现在改为：
+
+- 每个项目（以及每个用户的“未分配项目”笔记）各有一个版本号计数器；
+- 笔记列表按 “范围 + 版本号” 缓存，例如 project_notes_3_v1718000000123；
+- 用户的侧边栏由其所在各项目的列表在读取时合并而成。
+
+笔记写入时只需对所属项目的版本号做一次 INCR，旧版本的列表自然失效（随 TTL 过期），
+失效成本与项目成员数无关，也不会再出现成员之间的数据不一致。
+"""
+import time
+
+from django.core.cache import cache
+
+from .models import Note, ProjectMembership
+from . import acache, profiling
+
+# 列表缓存靠版本号失效，TTL 只用于回收不再被引用的旧版本
+LIST_TIMEOUT = 60 * 60 * 24
+# 用户所属项目列表在成员关系变化时被直接删除
+MEMBERSHIP_TIMEOUT = 60 * 60 * 24
+
+
+def _version_key(scope, scope_id):
+    return f"notes_version_{scope}_{scope_id}"
+
+
+def _list_key(scope, scope_id, version):
+    return f"{scope}_notes_{scope_id}_v{version}"
+
+
+def _user_projects_key(user_id):
+    return f"user_projects_{user_id}"
+
+
+def _initial_version():
+    # 计数器被淘汰后重新初始化时，用毫秒时间戳作为起点，保证不会与仍在缓存中的旧版本号重复
+    return int(time.time() * 1000)
+
+
+def bump_version(scope, scope_id):
+    """使某个范围（'project' 或 'inbox'）的笔记列表失效。"""
+    key = _version_key(scope, scope_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_version(), timeout=None)
+
+
+def bump_note_scope(project_id, author_id):
+    """笔记所在的范围：有项目时是项目，否则是作者的“未分配项目”笔记。"""
+    if project_id:
+        bump_version('project', project_id)
+    elif author_id:
+        bump_version('inbox', author_id)
+
+
+def forget_user_projects(user_id):
+    """成员关系变化后，删除该用户所属项目列表的缓存。"""
+    cache.delete(_user_projects_key(user_id))
+
+
+def forget_user_projects_many(user_ids):
+    """批量版本，一次缓存往返（批量开通用户时使用）。"""
+    if user_ids:
+        cache.delete_many([_user_projects_key(user_id) for user_id in user_ids])
+
+
+def get_user_project_ids(user):
+    key = _user_projects_key(user.id)
+    project_ids = cache.get(key)
+    profiling.record_cache(key, project_ids is not None)
+    if project_ids is None:
+        project_ids = list(_membership_query(user))
+        cache.set(key, project_ids, timeout=MEMBERSHIP_TIMEOUT)
+    return project_ids
+
+
+def _membership_query(user):
+    return ProjectMembership.objects.filter(user=user).values_list('project_id', flat=True)
+
+
+def _get_versions(scopes):
+    """批量读取版本号，缺失的计数器在这里初始化。"""
+    keys = {scope: _version_key(*scope) for scope in scopes}
+    found = cache.get_many(keys.values())
+    profiling.record_cache_many(keys.values(), found)
+    versions = {}
+    for scope, key in keys.items():
+        if key in found:
+            versions[scope] = found[key]
+        else:
+            initial = _initial_version()
+            # add 失败说明并发请求刚刚初始化过，以实际写入的值为准
+            versions[scope] = initial if cache.add(key, initial, timeout=None) else cache.get(key, initial)
+    return versions
+
+
+def _scopes(user, project_ids):
+    return [('project', pid) for pid in project_ids] + [('inbox', user.id)]
+
+
+def _list_keys(scopes, versions):
+    return {scope: _list_key(scope[0], scope[1], versions[scope]) for scope in scopes}
+
+
+def _missing_queries(user, missing):
+    """未命中缓存的范围需要执行的查询：(各项目的笔记, 未分配项目的笔记)，不需要的为 None。"""
+    missing_projects = [scope_id for scope, scope_id in missing if scope == 'project']
+    project_rows = inbox_rows = None
+    if missing_projects:
+        project_rows = (Note.objects.filter(project_id__in=missing_projects)
+                        .values_list('project_id', 'created_at', 'id', 'title'))
+    if ('inbox', user.id) in missing:
+        inbox_rows = Note.objects.filter(project__isnull=True, author=user).values_list('created_at', 'id', 'title')
+    return project_rows, inbox_rows
+
+
+def _group_rows(user, missing, project_rows, inbox_rows):
+    fresh = {scope: [] for scope in missing}
+    for project_id, created_at, note_id, title in project_rows or ():
+        fresh[('project', project_id)].append((created_at, note_id, title))
+    if inbox_rows is not None:
+        fresh[('inbox', user.id)] = list(inbox_rows)
+    return fresh
+
+
+def _merge(entries):
+    merged = sorted((note for notes in entries.values() for note in notes), reverse=True)
+    return [{'id': note_id, 'title': title, 'created_at': created_at.isoformat()}
+            for created_at, note_id, title in merged]
+
+
+def get_sidebar_notes(user):
+    """
+    返回用户可见的全部笔记 [{'id', 'title', 'created_at'}]，按创建时间倒序。
+    正常情况下只需 3 次缓存往返（所属项目、版本号、列表），未命中的范围才会查询数据库。
+    """
+    scopes = _scopes(user, get_user_project_ids(user))
+    list_keys = _list_keys(scopes, _get_versions(scopes))
+    cached = cache.get_many(list_keys.values())
+    profiling.record_cache_many(list_keys.values(), cached)
+
+    entries = {scope: cached[key] for scope, key in list_keys.items() if key in cached}
+    missing = [scope for scope in scopes if scope not in entries]
+    if missing:
+        fresh = _group_rows(user, missing, *_missing_queries(user, missing))
+        cache.set_many({list_keys[scope]: notes for scope, notes in fresh.items()}, timeout=LIST_TIMEOUT)
+        entries.update(fresh)
+    return _merge(entries)
+
+
+# ---------------------------------
+#  异步版本（异步视图使用，见 acache.py）
+# ---------------------------------
+
+async def aget_user_project_ids(user):
+    key = _user_projects_key(user.id)
+    project_ids = await acache.aget(key)
+    if project_ids is None:
+        project_ids = [pid async for pid in _membership_query(user)]
+        await acache.aset(key, project_ids, timeout=MEMBERSHIP_TIMEOUT)
+    return project_ids
+
+
+async def _aget_versions(scopes):
+    keys = {scope: _version_key(*scope) for scope in scopes}
+    found = await acache.aget_many(keys.values())
+    versions = {}
+    for scope, key in keys.items():
+        if key in found:
+            versions[scope] = found[key]
+        else:
+            initial = _initial_version()
+            added = await acache.aadd(key, initial, timeout=None)
+            versions[scope] = initial if added else await acache.aget(key, initial)
+    return versions
+
+
+async def aget_sidebar_notes(user):
+    scopes = _scopes(user, await aget_user_project_ids(user))
+    list_keys = _list_keys(scopes, await _aget_versions(scopes))
+    cached = await acache.aget_many(list_keys.values())
+
+    entries = {scope: cached[key] for scope, key in list_keys.items() if key in cached}
+    missing = [scope for scope in scopes if scope not in entries]
+    if missing:
+        project_rows, inbox_rows = _missing_queries(user, missing)
+        if project_rows is not None:
+            project_rows = [row async for row in project_rows]
+        if inbox_rows is not None:
+            inbox_rows = [row async for row in inbox_rows]
+        fresh = _group_rows(user, missing, project_rows, inbox_rows)
+        await acache.aset_many({list_keys[scope]: notes for scope, notes in fresh.items()}, timeout=LIST_TIMEOUT)
+        entries.update(fresh)
+    return _merge(entries)
@@ -0,0 +1,172 @@
+# knowledge_project/captcha.py
+"""
+预渲染验证码池。
+
+captcha_image 原来每次请求都要加载字体、绘制、仿射变换、锐化/模糊并编码 PNG，
+是匿名访问中 CPU 开销最大的接口。现在由后台线程提前生成一批 (PNG 字节, 答案)，
+请求到来时只需从池中弹出一个：
+
+- 池存放在 Redis 列表中（多个进程共享，RPOP 保证每个验证码只被取走一次），
+  默认缓存不是 django-redis 时存放在进程内存中；
+- 池中数量低于低水位时自动启动补充线程；池空时退回到同步生成，保证接口始终可用；
+- stats() 提供池大小、命中/未命中次数和生成速率等指标。
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from .utils.code import render_png
+
+logger = logging.getLogger(__name__)
+
+_DEFAULTS = {
+    'SIZE': 200,        # 补充到的目标数量
+    'LOW_WATER': 50,    # 低于这个数量时开始补充
+    'REDIS_KEY': 'captcha_pool',
+}
+
+
+class MemoryStore:
+    def __init__(self):
+        self._items = deque()
+
+    def push_many(self, items):
+        self._items.extend(items)
+
+    def pop(self):
+        try:
+            return self._items.popleft()
+        except IndexError:
+            return None
+
+    def size(self):
+        return len(self._items)
+
+
+class RedisStore:
+    """每个条目存为 b'答案:PNG字节'，答案只包含大写字母，不会出现分隔符。"""
+
+    def __init__(self, key):
+        from django_redis import get_redis_connection
+        self.client = get_redis_connection('default')
+        self.key = key
+
+    def push_many(self, items):
+        self.client.lpush(self.key, *[code.encode() + b':' + png for png, code in items])
+
+    def pop(self):
+        raw = self.client.rpop(self.key)
+        if raw is None:
+            return None
+        code, png = raw.split(b':', 1)
+        return png, code.decode()
+
+    def size(self):
+        return self.client.llen(self.key)
+
+
+class CaptchaPool:
+    def __init__(self, store, size=_DEFAULTS['SIZE'], low_water=_DEFAULTS['LOW_WATER']):
+        self.store = store
+        self.size = size
+        self.low_water = low_water
+        self._refill_lock = threading.Lock()
+        self._refilling = False
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.generation_seconds = 0.0
+
+    def _generate(self):
+        started = time.perf_counter()
+        item = render_png()
+        with self._stats_lock:
+            self.generated += 1
+            self.generation_seconds += time.perf_counter() - started
+        return item
+
+    def pop(self):
+        """取出一个 (PNG 字节, 答案)。"""
+        try:
+            item = self.store.pop()
+            remaining = self.store.size() if item is not None else 0
+        except Exception as e:
+            logger.warning("验证码池读取失败，改为同步生成: %s", e)
+            item, remaining = None, self.size
+
+        with self._stats_lock:
+            if item is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if remaining < self.low_water:
+            self.start_refill()
+        return item if item is not None else self._generate()
+
+    def refill(self, batch_size=20):
+        """同步补充到目标数量，返回本次生成的数量。"""
+        produced = 0
+        while True:
+            missing = self.size - self.store.size()
+            if missing <= 0:
+                return produced
+            batch = [self._generate() for _ in range(min(batch_size, missing))]
+            self.store.push_many(batch)
+            produced += len(batch)
+
+    def start_refill(self):
+        """在后台线程中补充；同一进程内同时只会有一个补充线程。"""
+        with self._refill_lock:
+            if self._refilling:
+                return
+            self._refilling = True
+        threading.Thread(target=self._refill_in_background, name='captcha-pool-refill', daemon=True).start()
+
+    def _refill_in_background(self):
+        try:
+            self.refill()
+        except Exception as e:
+            logger.warning("验证码池补充失败: %s", e)
+        finally:
+            with self._refill_lock:
+                self._refilling = False
+
+    def stats(self):
+        try:
+            pool_size = self.store.size()
+        except Exception:
+            pool_size = -1
+        with self._stats_lock:
+            rate = self.generated / self.generation_seconds if self.generation_seconds else 0.0
+            return {
+                'pool_size': pool_size,
+                'target_size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'generated': self.generated,
+                'generation_rate': round(rate, 2),  # 单线程每秒可生成的验证码数量
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                options = {**_DEFAULTS, **getattr(settings, 'KNOWLEDGE_CAPTCHA_POOL', {})}
+                store = None
+                if settings.CACHES.get('default', {}).get('BACKEND', '').startswith('django_redis'):
+                    try:
+                        store = RedisStore(options['REDIS_KEY'])
+                    except Exception as e:
+                        logger.warning("无法连接 Redis，验证码池改为进程内存: %s", e)
+                _pool = CaptchaPool(store or MemoryStore(), size=options['SIZE'], low_water=options['LOW_WATER'])
+    return _pool
@@ -0,0 +1,375 @@
+# knowledge_project/compression.py
+"""
+笔记正文的压缩存储。
+
+粘贴进来的表格、带大量内联样式的 HTML 重复度很高，原来都以明文存放在 Note.content (LONGTEXT) 中，
+占用 InnoDB 缓冲池，读行时也要搬运整段正文。现在：
+
+- 超过 THRESHOLD 个字符的正文压缩后写入 Note.content_blob，content 列存 NULL；短正文仍然存明文；
+- 压缩使用 zstd（安装了 zstandard 时）或 zlib，并可以使用一份由现有笔记训练出的共享字典
+  (CompressionDictionary)，CKEditor 的标签和样式片段不必在每篇笔记里重复出现；
+- 读取时只有真正访问 note.content 才解压（CompressedTextField 的描述符），
+  values('id', 'title') 之类的查询不会读取也不会解压正文；
+- 已有的数据用 compress_note_content 命令分批转换，train_content_dictionary 命令训练字典。
+
+压缩数据的开头是 5 字节的头：1 字节编码方式 + 4 字节字典 ID（0 表示不使用字典），
+所以字典一旦被使用就不能再删除或修改，新训练的字典只影响之后写入的数据。
+
+直接对 content 列做 LIKE 查询（例如 content__icontains）只能匹配到未压缩的笔记，全文检索请使用倒排索引 (search.py)。
+QuerySet.update(content=...) 不经过字段的 pre_save，写入的正文不会被压缩，可以之后再运行 compress_note_content。
+
+配置见 _DEFAULTS，可以通过 settings.KNOWLEDGE_COMPRESSION 覆盖。
+"""
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models.query_utils import DeferredAttribute
+from django_ckeditor_5.fields import CKEditor5Field
+
+_DEFAULTS = {
+    'THRESHOLD': 4096,          # 正文超过这么多字符才压缩
+    'CODEC': None,              # 'zstd' 或 'zlib'；默认安装了 zstandard 时使用 zstd
+    'ZLIB_LEVEL': 6,
+    'ZSTD_LEVEL': 9,
+    'USE_DICTIONARY': True,     # 使用最新训练的字典（与当前编码方式相同的）
+    'DICTIONARY_REFRESH': 300,  # 进程内缓存“当前字典”的秒数，新训练的字典最迟这么久之后生效
+}
+
+ZLIB, ZSTD = 'zlib', 'zstd'
+_CODEC_IDS = {ZLIB: 1, ZSTD: 2}
+_CODEC_NAMES = {code: name for name, code in _CODEC_IDS.items()}
+_HEADER = struct.Struct('>BI')  # 编码方式, 字典 ID
+
+# zlib 的窗口是 32KB，更大的预设字典只有最后 32KB 起作用
+ZLIB_DICT_SIZE = 32 * 1024
+ZSTD_DICT_SIZE = 112 * 1024
+# 训练 zlib 字典时统计的片段：HTML 标签（连同属性和内联样式）和字符实体
+_FRAGMENT_RE = re.compile(r'<[^<>]{1,512}>|&[a-zA-Z]+;')
+
+
+class CompressionError(ValueError):
+    pass
+
+
+def get_options():
+    return {**_DEFAULTS, **getattr(settings, 'KNOWLEDGE_COMPRESSION', {})}
+
+
+def _zstd():
+    """zstandard 是可选依赖，没有安装时返回 None。"""
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def _require_zstd():
+    zstd = _zstd()
+    if zstd is None:
+        raise CompressionError('需要安装 zstandard 才能使用 zstd 压缩')
+    return zstd
+
+
+def default_codec():
+    codec = get_options()['CODEC']
+    if codec is None:
+        return ZSTD if _zstd() is not None else ZLIB
+    if codec not in _CODEC_IDS:
+        raise ImproperlyConfigured(f"KNOWLEDGE_COMPRESSION['CODEC'] 只能是 {ZLIB!r} 或 {ZSTD!r}")
+    if codec == ZSTD and _zstd() is None:
+        raise ImproperlyConfigured("KNOWLEDGE_COMPRESSION['CODEC'] 为 'zstd'，但没有安装 zstandard")
+    return codec
+
+
+# ---------------------------------
+#  共享字典
+# ---------------------------------
+
+# 字典内容按 ID 缓存：字典不可修改，缓存永不过期
+_dictionaries = {}
+_current = {}
+_lock = threading.Lock()
+
+
+def _get_dictionary(dictionary_id):
+    """返回 (编码方式, 字典数据)。"""
+    if dictionary_id not in _dictionaries:
+        from .models import CompressionDictionary
+        row = CompressionDictionary.objects.filter(pk=dictionary_id).values_list('codec', 'data').first()
+        if row is None:
+            raise CompressionError(f'压缩字典 {dictionary_id} 不存在')
+        with _lock:
+            _dictionaries[dictionary_id] = (row[0], bytes(row[1]))
+    return _dictionaries[dictionary_id]
+
+
+def current_dictionary(codec):
+    """返回该编码方式最新的字典 ID，没有时返回 None。结果在进程内缓存 DICTIONARY_REFRESH 秒。"""
+    options = get_options()
+    if not options['USE_DICTIONARY']:
+        return None
+    cached = _current.get(codec)
+    now = time.monotonic()
+    if cached is None or cached[1] < now:
+        from .models import CompressionDictionary
+        dictionary_id = (CompressionDictionary.objects.filter(codec=codec).order_by('-pk')
+                         .values_list('pk', flat=True).first())
+        cached = _current[codec] = (dictionary_id, now + options['DICTIONARY_REFRESH'])
+    return cached[0]
+
+
+def forget_current_dictionary():
+    _current.clear()
+
+
+# ---------------------------------
+#  压缩与解压
+# ---------------------------------
+
+def compress(text, codec=None, dictionary_id=None):
+    """
+    压缩正文，返回带头部的字节串。
+    codec 默认为 default_codec()；dictionary_id 为 None 时使用该编码方式当前的字典。
+    """
+    codec = codec or default_codec()
+    if dictionary_id is None:
+        dictionary_id = current_dictionary(codec)
+    zdict = None
+    if dictionary_id:
+        dict_codec, zdict = _get_dictionary(dictionary_id)
+        if dict_codec != codec:
+            raise CompressionError(f'压缩字典 {dictionary_id} 属于 {dict_codec}，不能用于 {codec}')
+    body = _compress_raw((text or '').encode('utf-8'), codec, zdict)
+    return _HEADER.pack(_CODEC_IDS[codec], dictionary_id or 0) + body
+
+
+def _compress_raw(raw, codec, zdict):
+    options = get_options()
+    if codec == ZSTD:
+        zstd = _require_zstd()
+        dict_data = zstd.ZstdCompressionDict(zdict) if zdict else None
+        return zstd.ZstdCompressor(level=options['ZSTD_LEVEL'], dict_data=dict_data).compress(raw)
+    compressor = zlib.compressobj(options['ZLIB_LEVEL'], zdict=zdict) if zdict else \
+        zlib.compressobj(options['ZLIB_LEVEL'])
+    return compressor.compress(raw) + compressor.flush()
+
+
+def decompress(blob):
+    blob = bytes(blob)
+    try:
+        code, dictionary_id = _HEADER.unpack_from(blob)
+    except struct.error as e:
+        raise CompressionError('压缩数据的头部不完整') from e
+    codec = _CODEC_NAMES.get(code)
+    if codec is None:
+        raise CompressionError(f'未知的编码方式 {code}')
+    zdict = _get_dictionary(dictionary_id)[1] if dictionary_id else None
+    body = blob[_HEADER.size:]
+    if codec == ZSTD:
+        zstd = _require_zstd()
+        dict_data = zstd.ZstdCompressionDict(zdict) if zdict else None
+        raw = zstd.ZstdDecompressor(dict_data=dict_data).decompress(body)
+    else:
+        decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+        raw = decompressor.decompress(body) + decompressor.flush()
+    return raw.decode('utf-8')
+
+
+def pack(text):
+    """返回正文存储时使用的压缩数据；太短或者压缩后没有变小时返回 None，正文按明文存储。"""
+    if not text or len(text) < get_options()['THRESHOLD']:
+        return None
+    blob = compress(text)
+    return blob if len(blob) < len(text.encode('utf-8')) else None
+
+
+def load(content, blob):
+    """由数据库中的 (content, content_blob) 两列还原正文，用于 values() / values_list() 查询的结果。"""
+    if content is None and blob is not None:
+        return decompress(blob)
+    return content
+
+
+# ---------------------------------
+#  字典训练
+# ---------------------------------
+
+def _train_zlib(samples, size):
+    """
+    zlib 的预设字典就是一段“之前出现过的文本”。统计在多篇样本中都出现过的标签和实体，
+    按 出现篇数 * 长度 选取收益最大的片段；zlib 匹配距离越近编码越短，收益最大的片段放在最后。
+    """
+    counter = Counter()
+    for text in samples:
+        counter.update(set(_FRAGMENT_RE.findall(text)))
+    ranked = sorted((fragment for fragment, count in counter.items() if count > 1),
+                    key=lambda fragment: counter[fragment] * len(fragment), reverse=True)
+    chosen, used = [], 0
+    for fragment in ranked:
+        length = len(fragment.encode('utf-8'))
+        if used + length > size:
+            continue
+        chosen.append(fragment)
+        used += length
+    return ''.join(reversed(chosen)).encode('utf-8')
+
+
+def train(samples, codec=None, size=None):
+    """用一批正文训练字典，返回字典数据（尚未保存）。"""
+    codec = codec or default_codec()
+    if codec == ZSTD:
+        zstd = _require_zstd()
+        try:
+            trained = zstd.train_dictionary(size or ZSTD_DICT_SIZE, [text.encode('utf-8') for text in samples])
+        except zstd.ZstdError as e:
+            raise CompressionError(f'zstd 字典训练失败（样本可能太少）: {e}') from e
+        return trained.as_bytes()
+    return _train_zlib(samples, min(size or ZLIB_DICT_SIZE, ZLIB_DICT_SIZE))
+
+
+def evaluate(samples, codec, data):
+    """返回 (原始字节数, 不用字典压缩后的字节数, 使用字典压缩后的字节数)，用于判断字典是否值得使用。"""
+    raw = plain = with_dict = 0
+    for text in samples:
+        encoded = text.encode('utf-8')
+        raw += len(encoded)
+        plain += len(_compress_raw(encoded, codec, None))
+        with_dict += len(_compress_raw(encoded, codec, data))
+    return raw, plain, with_dict
+
+
+def sample_contents(count):
+    """取最近的 count 篇非空正文作为训练样本。"""
+    from .models import Note
+    rows = (Note.objects.exclude(content__isnull=True, content_blob__isnull=True).exclude(content='')
+            .order_by('-pk').values_list('content', 'content_blob')[:count])
+    return [load(content, blob) for content, blob in rows]
+
+
+def save_dictionary(codec, data, sample_count):
+    """保存新字典，本进程之后写入的正文立即开始使用它。"""
+    from .models import CompressionDictionary
+    dictionary = CompressionDictionary.objects.create(codec=codec, data=data, sample_count=sample_count)
+    forget_current_dictionary()
+    return dictionary
+
+
+# ---------------------------------
+#  已有数据的转换
+# ---------------------------------
+
+def convert(batch_size=200, recompress=False, inline=False, progress=None):
+    """
+    把已有笔记的正文转换为当前的存储方式，按主键分批处理，每批一个事务。
+    - 默认：压缩达到阈值但还以明文存储的正文；
+    - recompress=True：所有正文按当前的编码方式和字典重新决定存储方式（例如训练了新字典之后）；
+    - inline=True：全部还原为明文（回退时使用）。
+    直接 UPDATE 两列，不触发信号，也不修改 version 和 updated_at；只在版本号未变时写入，不会覆盖并发的保存。
+    返回统计 {'scanned', 'compressed', 'inlined', 'bytes_before', 'bytes_after'}。
+    """
+    from django.db.models.functions import Length
+    from .models import Note
+
+    say = progress or (lambda message: None)
+    stats = dict.fromkeys(('scanned', 'compressed', 'inlined', 'bytes_before', 'bytes_after'), 0)
+    notes = Note.objects.all()
+    if inline:
+        notes = notes.filter(content_blob__isnull=False)
+    elif not recompress:
+        notes = (notes.filter(content_blob__isnull=True).annotate(content_length=Length('content'))
+                 .filter(content_length__gte=get_options()['THRESHOLD']))
+    last_pk = 0
+    while True:
+        rows = list(notes.filter(pk__gt=last_pk).order_by('pk')
+                    .values_list('pk', 'version', 'content', 'content_blob')[:batch_size])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+        with transaction.atomic():
+            for pk, version, content, blob in rows:
+                stats['scanned'] += 1
+                text = load(content, blob)
+                new_blob = None if inline else pack(text)
+                if new_blob is None and blob is None:
+                    continue  # 仍然是明文，不需要改写
+                before = len(blob) if blob is not None else len(text.encode('utf-8'))
+                after = len(new_blob) if new_blob is not None else len(text.encode('utf-8'))
+                updated = Note.objects.filter(pk=pk, version=version).update(
+                    content=None if new_blob is not None else text, content_blob=new_blob)
+                if updated:
+                    stats['compressed' if new_blob is not None else 'inlined'] += 1
+                    stats['bytes_before'] += before
+                    stats['bytes_after'] += after
+        say(f"已处理到笔记 {last_pk}，压缩 {stats['compressed']} 篇，还原 {stats['inlined']} 篇")
+    return stats
+
+
+# ---------------------------------
+#  模型字段
+# ---------------------------------
+
+class CompressedTextDescriptor(DeferredAttribute):
+    """读取正文时才解压；延迟加载时把两列一起取回，只需一次查询。"""
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        data = instance.__dict__
+        field = self.field
+        missing = [name for name in (field.attname, field.blob_field) if name not in data]
+        if field.attname in missing:
+            instance.refresh_from_db(fields=missing)
+        value = data[field.attname]
+        if value is None:
+            if field.blob_field not in data:
+                instance.refresh_from_db(fields=[field.blob_field])
+            blob = data[field.blob_field]
+            if blob is not None:
+                value = data[field.attname] = decompress(blob)
+                data[field.packed_cache_name] = (value, blob)
+        return value
+
+    def __set__(self, instance, value):
+        # 定义 __set__ 使其成为数据描述符：值仍然存放在 instance.__dict__ 中，但读取总是经过 __get__
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(CKEditor5Field):
+    """
+    CKEditor 富文本字段，超过阈值的内容压缩后写入 blob_field 指向的 BinaryField，本列存 NULL。
+    blob_field 必须声明在本字段之后：保存时由本字段的 pre_save 先算出压缩数据。
+    """
+    descriptor_class = CompressedTextDescriptor
+
+    def __init__(self, *args, blob_field, **kwargs):
+        self.blob_field = blob_field
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['blob_field'] = self.blob_field
+        return name, path, args, kwargs
+
+    @property
+    def packed_cache_name(self):
+        # 记录 (正文, 压缩数据)：正文没有被修改时再次保存不需要重新压缩
+        return f'_{self.attname}_packed'
+
+    def pre_save(self, model_instance, add):
+        value = getattr(model_instance, self.attname)
+        cached = model_instance.__dict__.get(self.packed_cache_name)
+        if cached is not None and cached[0] is value:
+            blob = cached[1]
+        else:
+            blob = pack(value)
+            model_instance.__dict__[self.packed_cache_name] = (value, blob)
+        setattr(model_instance, self.blob_field, blob)
+        return None if blob is not None else value
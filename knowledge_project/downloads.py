@@ -0,0 +1,198 @@
+# knowledge_project/downloads.py
+"""
+资产文件下载。
+
+资产原来只能通过 DEBUG 模式下的 static(MEDIA_URL) 访问：生产环境不可用，也没有任何权限检查。
+asset_download 视图在检查项目成员身份之后调用 serve_asset()：
+
+- 开发/默认模式：FileResponse 按固定大小分块流式发送，不会把文件读入内存；
+  支持单段 Range（视频、PDF 阅读器可以跳转）、If-Range、ETag / If-None-Match；
+- 生产模式：设置 KNOWLEDGE_ASSET_SENDFILE 后只返回 X-Accel-Redirect（nginx）或 X-Sendfile（Apache）头，
+  由前端代理直接发送文件并处理 Range，Django 工作进程立即释放。
+
+内容寻址的文件以 SHA-256 作为强 ETag；旧路径的文件退回到 (修改时间, 大小)。
+DEBUG 模式下 MEDIA_URL 的静态路由由 serve_public_media() 提供，不会直接暴露资产文件。
+
+资产与页面同源，文件名由上传者决定：HTML、SVG 等可以执行脚本的类型如果在浏览器中直接打开，
+脚本会带着访问者的会话运行。只有 INLINE_TYPES 中的类型可以内联打开，其他一律作为
+application/octet-stream 附件下载；所有响应都带 CSP sandbox 和 nosniff。
+"""
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import content_disposition_header, http_date, parse_etags
+from django.views.static import serve
+
+from .storage import CAS_PREFIX, asset_storage, digest_from_name
+from .thumbnails import THUMBS_DIR
+
+CHUNK_SIZE = 64 * 1024
+
+# 可以在浏览器中直接打开的类型（不会执行脚本）；audio/*、video/* 也可以
+INLINE_TYPES = {
+    'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'image/avif', 'image/bmp',
+    'application/pdf', 'text/plain',
+}
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# MEDIA_ROOT 下只能经过权限检查访问的目录：内容寻址的资产文件、缩略图，以及旧版按上传者存放的资产文件
+_PRIVATE_MEDIA_RE = re.compile(rf'^({re.escape(CAS_PREFIX)}|{re.escape(THUMBS_DIR)}|user_\d+|unknown_user)(/|$)',
+                               re.IGNORECASE)
+
+
+def file_etag(name, stat):
+    digest = digest_from_name(name)
+    if digest:
+        return f'"{digest}"'
+    return f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    解析单段 Range 头，返回 (start, end)（包含 end）；
+    没有 Range 或是多段范围时返回 None（按完整文件响应）；范围无法满足时返回 'unsatisfiable'。
+    """
+    match = _RANGE_RE.match((header or '').replace(' ', ''))
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N：最后 N 个字节
+        length = int(last)
+        if length == 0:
+            return 'unsatisfiable'
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return 'unsatisfiable'
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _sendfile_response(name, path):
+    mode = getattr(settings, 'KNOWLEDGE_ASSET_SENDFILE', None)
+    if mode == 'nginx':
+        response = HttpResponse()
+        # nginx 中需要一个 internal 的 location 把这个前缀映射到 MEDIA_ROOT
+        response['X-Accel-Redirect'] = getattr(settings, 'KNOWLEDGE_ASSET_ACCEL_PREFIX', '/protected-uploads/') + name
+        return response
+    if mode == 'apache':
+        response = HttpResponse()
+        response['X-Sendfile'] = path
+        return response
+    return None
+
+
+def serve_asset(request, asset, as_attachment=False):
+    """把资产文件作为响应发送。调用方负责权限检查。"""
+    if not asset.file:
+        raise Http404("资产没有关联文件。")
+    return serve_file(request, asset.file.name, asset.name or os.path.basename(asset.file.name),
+                      as_attachment=as_attachment)
+
+
+def serve_file(request, name, filename, as_attachment=False, etag=None,
+               cache_control='private, max-age=0, must-revalidate'):
+    """
+    发送 MEDIA_ROOT 下的文件 name，filename 为浏览器看到的文件名。
+    默认只允许浏览器缓存并每次重新验证：共享缓存不能缓存需要权限的文件。
+    """
+    path = asset_storage.path(name)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise Http404("文件不存在。")
+
+    etag = etag or file_etag(name, stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': cache_control,
+        'Accept-Ranges': 'bytes',
+        # 即使被当作页面打开，也不能运行脚本、访问本站的 Cookie 和存储
+        'Content-Security-Policy': 'sandbox',
+        'X-Content-Type-Options': 'nosniff',
+    }
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+        response = HttpResponseNotModified()
+        for key, value in headers.items():
+            response[key] = value
+        return response
+
+    content_type, as_attachment = safe_content_type(filename, as_attachment)
+    disposition = content_disposition_header(as_attachment, filename)
+
+    response = _sendfile_response(name, path)
+    if response is None:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), stat.st_size)
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if byte_range and if_range and if_range.strip() != etag:
+            # 文件已经变化（或 If-Range 是日期），按完整文件响应
+            byte_range = None
+
+        if byte_range == 'unsatisfiable':
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+        if byte_range:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(
+                _read_range(path, start, length) if request.method != 'HEAD' else (),
+                status=206, content_type=content_type,
+            )
+            response['Content-Length'] = str(length)
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+            response.block_size = CHUNK_SIZE
+    response['Content-Type'] = content_type
+    if disposition:
+        response['Content-Disposition'] = disposition
+    for key, value in headers.items():
+        response[key] = value
+    return response
+
+
+def safe_content_type(filename, as_attachment=False):
+    """按文件名推断 Content-Type，返回 (类型, 是否作为附件)；不能安全内联打开的类型改为附件下载。"""
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if content_type in INLINE_TYPES or content_type.startswith(('audio/', 'video/')):
+        if content_type == 'text/plain':
+            content_type = 'text/plain; charset=utf-8'
+        return content_type, as_attachment
+    return 'application/octet-stream', True
+
+
+def is_private_media(path):
+    """MEDIA_ROOT 下的相对路径是否属于资产文件（只能通过 asset_download / asset_thumbnail 访问）。"""
+    return bool(_PRIVATE_MEDIA_RE.match(posixpath.normpath(path).lstrip('/')))
+
+
+def serve_public_media(request, path):
+    """
+    【新增】DEBUG 模式下 MEDIA_URL 的路由，代替 static()：编辑器上传的图片等公开文件照常提供，
+    资产文件一律 404，否则知道 SHA-256（下载接口的 ETag 就是它）就能绕过项目成员检查。
+    """
+    if is_private_media(path):
+        raise Http404("文件不存在。")
+    return serve(request, path, document_root=settings.MEDIA_ROOT)
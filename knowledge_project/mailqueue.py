@@ -0,0 +1,135 @@
+# knowledge_project/mailqueue.py
+"""
+数据库持久化的异步邮件队列。
+
+SendEmailCodeView 原来在请求线程中同步调用 send_mail，邮件服务器慢时注册请求会整体堆积。
+现在视图只调用 enqueue() 写入一行 EmailJob 就立即返回，
+由 `python manage.py process_email_queue` 工作进程：
+- 每次领取一批到期任务（支持 SKIP LOCKED 的数据库上多个工作进程互不冲突）；
+- 通过同一个 SMTP 连接发送整批邮件；
+- 失败时按指数退避重新排队，超过最大次数后标记为 failed；
+- 带有效期的邮件（如验证码）过期后不再发送，标记为 expired，下一次重试会晚于有效期时也直接标记为 expired。
+
+测试中可使用 locmem 邮件后端，或把 EMAIL_HOST/EMAIL_PORT 指向本地 SMTP 桩服务。
+"""
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection as db_connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import EmailJob
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 50
+RETRY_BASE_DELAY = 30           # 第一次重试前等待的秒数，之后每次翻倍
+RETRY_MAX_DELAY = 60 * 60
+# 工作进程领取任务后崩溃时，超过这个时间的 sending 任务会被重新领取
+LOCK_TIMEOUT = timedelta(minutes=10)
+
+
+def enqueue(subject, body, recipients, from_email=None, max_attempts=5, ttl=None):
+    """写入一封待发送邮件，立即返回 EmailJob。ttl（秒）为邮件的有效期，过期后不再发送。"""
+    return EmailJob.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL or '',
+        recipients=list(recipients),
+        max_attempts=max_attempts,
+        expires_at=timezone.now() + timedelta(seconds=ttl) if ttl else None,
+    )
+
+
+def retry_delay(attempts):
+    """第 attempts 次失败后的等待秒数：指数退避并加入随机抖动，避免大量任务同时重试。"""
+    delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim_batch(batch_size=DEFAULT_BATCH_SIZE):
+    """领取一批到期的任务并标记为 sending，返回任务列表。已过有效期的任务先标记为 expired，不会被领取。"""
+    now = timezone.now()
+    due = (Q(status='pending', next_attempt_at__lte=now)
+           | Q(status='sending', locked_at__lt=now - LOCK_TIMEOUT))
+    EmailJob.objects.filter(due, expires_at__lte=now).update(status='expired', locked_at=None)
+    with transaction.atomic():
+        queryset = EmailJob.objects.filter(due).order_by('next_attempt_at')
+        if db_connection.features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True)
+        jobs = list(queryset[:batch_size])
+        EmailJob.objects.filter(pk__in=[job.pk for job in jobs]).update(status='sending', locked_at=now)
+    return jobs
+
+
+def _deliver(job, mail_connection):
+    message = EmailMessage(job.subject, job.body, job.from_email or None, job.recipients,
+                           connection=mail_connection)
+    message.send(fail_silently=False)
+
+
+def process_batch(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    发送一批邮件，返回 {'sent': n, 'retried': n, 'failed': n, 'expired': n}。
+    整批共用一个 SMTP 连接；单封失败不影响同批的其他邮件。
+    """
+    jobs = claim_batch(batch_size)
+    stats = {'sent': 0, 'retried': 0, 'failed': 0, 'expired': 0}
+    if not jobs:
+        return stats
+
+    mail_connection = get_connection(fail_silently=False)
+    try:
+        mail_connection.open()
+    except Exception as e:
+        # 连不上邮件服务器时整批退回队列，按失败处理
+        logger.warning("无法连接邮件服务器: %s", e)
+        for job in jobs:
+            stats[_mark_failed(job, e)] += 1
+        return stats
+
+    try:
+        for job in jobs:
+            try:
+                _deliver(job, mail_connection)
+            except Exception as e:
+                logger.warning("邮件发送失败 (job=%s, to=%s): %s", job.pk, job.recipients, e)
+                stats[_mark_failed(job, e)] += 1
+            else:
+                job.status, job.sent_at, job.locked_at = 'sent', timezone.now(), None
+                job.attempts += 1
+                job.save(update_fields=['status', 'sent_at', 'locked_at', 'attempts'])
+                stats['sent'] += 1
+    finally:
+        mail_connection.close()
+    return stats
+
+
+def _mark_failed(job, error):
+    job.attempts += 1
+    job.last_error = str(error)[:2000]
+    job.locked_at = None
+    next_attempt_at = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+    if job.attempts >= job.max_attempts:
+        job.status = 'failed'
+        outcome = 'failed'
+    elif job.expires_at and next_attempt_at >= job.expires_at:
+        # 重试时邮件内容已经失效（例如验证码过期），不再发送
+        job.status = 'expired'
+        outcome = 'expired'
+    else:
+        job.status = 'pending'
+        job.next_attempt_at = next_attempt_at
+        outcome = 'retried'
+    job.save(update_fields=['attempts', 'last_error', 'locked_at', 'status', 'next_attempt_at'])
+    return outcome
+
+
+def queue_status():
+    """各状态的任务数量，用于监控和命令行输出。"""
+    counts = dict(EmailJob.objects.values_list('status').annotate(n=Count('pk')))
+    return {status: counts.get(status, 0) for status, _ in EmailJob.STATUS_CHOICES}
@@ -0,0 +1,111 @@
+# knowledge_project/management/commands/bench_api.py
+"""
+笔记接口的基准测试：在一个独立的测试数据库中生成数据，用 Django 测试客户端执行各个场景，
+输出 p50/p95/p99 延迟和每个请求的查询数，并与基线比较，出现回退时以非零状态退出。
+
+数据库引擎与 settings 一致（MySQL 时创建 test_<库名>，SQLite 时使用内存数据库），不会碰到正式数据；
+缓存使用独立的键前缀，结束时删除。
+
+示例:
+    python manage.py bench_api --scale small --save-baseline bench_baseline.json
+    python manage.py bench_api --scale small --baseline bench_baseline.json      # 回退时退出码非零
+    python manage.py bench_api --scale medium --keepdb --scenarios search,page_flip
+"""
+import json
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from knowledge_project import benchmark
+
+
+class Command(BaseCommand):
+    help = "生成基准数据并测量笔记接口各场景的延迟和查询数，可以与基线比较。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(benchmark.SCALES), default='small')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--iterations', type=int, default=50, help="每个场景计入统计的请求数")
+        parser.add_argument('--warmup', type=int, default=5, help="每个场景开始前不计入统计的请求数")
+        parser.add_argument('--scenarios', default=','.join(benchmark.SCENARIOS),
+                            help=f"逗号分隔，可选: {', '.join(benchmark.SCENARIOS)}")
+        parser.add_argument('--baseline', help="与这个基线文件比较，出现回退时失败")
+        parser.add_argument('--save-baseline', help="把本次结果保存为基线文件")
+        parser.add_argument('--tolerance', type=float, default=0.25, help="允许的延迟增长比例")
+        parser.add_argument('--min-delta-ms', type=float, default=2.0, help="小于这个绝对差值的延迟变化不算回退")
+        parser.add_argument('--keepdb', action='store_true', help="保留测试数据库和数据，下次直接复用")
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(benchmark.SCENARIOS)
+        if unknown:
+            raise CommandError(f"未知的场景: {', '.join(sorted(unknown))}")
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False,
+                                                      keepdb=options['keepdb'])
+        cache_settings = {alias: {**config, 'KEY_PREFIX': f'bench_{uuid.uuid4().hex[:8]}'}
+                          for alias, config in settings.CACHES.items()}
+        try:
+            with override_settings(CACHES=cache_settings):
+                try:
+                    summary = self._run(scenarios, options)
+                finally:
+                    if hasattr(cache, 'delete_pattern'):
+                        cache.delete_pattern('*')  # 只匹配本次的键前缀
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        self._report(summary)
+        result = {
+            'meta': {'scale': options['scale'], 'seed': options['seed'], 'iterations': options['iterations'],
+                     'database': connection.vendor},
+            'scenarios': summary,
+        }
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"基线已保存到 {options['save_baseline']}")
+        if baseline is not None:
+            self._check(result, baseline, options)
+
+    def _run(self, scenarios, options):
+        if benchmark.has_dataset(options['scale'], options['seed']):
+            self.stdout.write("复用已有的基准数据")
+        else:
+            benchmark.generate(options['scale'], options['seed'], progress=lambda message: self.stdout.write(message))
+        runner = benchmark.Runner(benchmark.load_context(options['seed']), seed=options['seed'])
+        try:
+            samples = runner.run(scenarios, iterations=options['iterations'], warmup=options['warmup'])
+        except RuntimeError as e:
+            raise CommandError(f"场景执行失败: {e}")
+        return benchmark.summarize(samples)
+
+    def _report(self, summary):
+        self.stdout.write(f"{'场景':<12}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'mean':>10}{'查询/请求':>10}{'最多':>6}")
+        for name, row in summary.items():
+            self.stdout.write(f"{name:<12}{row['n']:>6}{row['p50']:>8.1f}ms{row['p95']:>8.1f}ms{row['p99']:>8.1f}ms"
+                              f"{row['mean']:>8.1f}ms{row['queries']:>10}{row['max_queries']:>6}")
+
+    def _check(self, result, baseline, options):
+        meta, base_meta = result['meta'], baseline.get('meta', {})
+        for key in ('scale', 'seed', 'database'):
+            if base_meta.get(key) != meta[key]:
+                self.stderr.write(self.style.WARNING(
+                    f"基线的 {key} 为 {base_meta.get(key)!r}，本次为 {meta[key]!r}，结果可能不可比"))
+        regressions = benchmark.compare(result['scenarios'], baseline, tolerance=options['tolerance'],
+                                        min_delta_ms=options['min_delta_ms'])
+        if regressions:
+            for line in regressions:
+                self.stderr.write(self.style.ERROR(f"回退: {line}"))
+            raise CommandError(f"与基线相比有 {len(regressions)} 项回退")
+        self.stdout.write(self.style.SUCCESS("与基线相比没有回退"))
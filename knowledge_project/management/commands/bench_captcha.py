@@ -0,0 +1,60 @@
+# knowledge_project/management/commands/bench_captcha.py
+"""
+验证码生成基准测试：对比每次请求现场生成（旧路径）与从预渲染池中弹出的耗时。
+示例: python manage.py bench_captcha --requests 500
+"""
+import statistics
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+
+from knowledge_project.captcha import CaptchaPool, MemoryStore
+from knowledge_project.utils import code
+
+
+def _legacy_request():
+    # 旧实现：每次都重新加载字体文件
+    code.load_font.cache_clear()
+    img, answer = code.check_code()
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue(), answer
+
+
+class Command(BaseCommand):
+    help = "对比现场生成验证码与从预渲染池中取出验证码的延迟。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+
+    def _report(self, label, samples):
+        ordered = sorted(samples)
+        p95 = ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+        self.stdout.write(f"{label:>8}: mean={statistics.mean(samples):.3f}ms "
+                          f"p50={statistics.median(samples):.3f}ms p95={p95:.3f}ms "
+                          f"≈{1000 / statistics.mean(samples):.0f} 次/秒/线程")
+
+    def handle(self, *args, **options):
+        n = options['requests']
+
+        legacy = []
+        for _ in range(n):
+            started = time.perf_counter()
+            _legacy_request()
+            legacy.append((time.perf_counter() - started) * 1000)
+        self._report('现场生成', legacy)
+
+        # 预先填满池子，只测量请求线程上的开销
+        pool = CaptchaPool(MemoryStore(), size=n, low_water=0)
+        started = time.perf_counter()
+        pool.refill()
+        fill_seconds = time.perf_counter() - started
+        pooled = []
+        for _ in range(n):
+            started = time.perf_counter()
+            pool.pop()
+            pooled.append((time.perf_counter() - started) * 1000)
+        self._report('预渲染池', pooled)
+        stats = pool.stats()
+        self.stdout.write(f"后台补充 {n} 个耗时 {fill_seconds:.2f}s，生成速率 {stats['generation_rate']} 个/秒")
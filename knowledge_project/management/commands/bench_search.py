@@ -0,0 +1,102 @@
+# knowledge_project/management/commands/bench_search.py
+"""
+全文检索基准测试。
+
+在一个最终会回滚的事务中生成 N 篇合成笔记并建立索引，
+然后分别用旧的 icontains 查询和倒排索引查询执行同一组关键词，输出延迟分位数。
+示例: python manage.py bench_search --notes 100000
+"""
+import itertools
+import random
+import statistics
+import string
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from knowledge_project import search, visibility
+from knowledge_project.benchmark import COMMON_HANZI
+from knowledge_project.models import Note, Project, ProjectMembership
+
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = "对比 icontains 扫描与倒排索引在大量笔记下的查询延迟（数据在事务中生成并回滚）。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes', type=int, default=100000, help="生成的笔记数量")
+        parser.add_argument('--words', type=int, default=60, help="每篇笔记的词数")
+        parser.add_argument('--queries', type=int, default=30, help="执行的查询次数")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        english = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(5000)]
+        chinese = [''.join(rng.choices(COMMON_HANZI, k=2)) for _ in range(2000)]
+        vocabulary = english + chinese
+        rng.shuffle(vocabulary)
+        # 近似 Zipf 分布：靠前的词出现得更频繁
+        cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+
+        with transaction.atomic():
+            User.objects.bulk_create([User(username='__bench_search__')])
+            user = User.objects.get(username='__bench_search__')
+            project = Project.objects.create(title='bench search')
+            ProjectMembership.objects.create(user=user, project=project, role='owner')
+
+            started = time.perf_counter()
+            total, batch_size = options['notes'], options['batch_size']
+            for offset in range(0, total, batch_size):
+                Note.objects.bulk_create([
+                    Note(title=' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=4)),
+                         content='<p>' + ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=options['words'])) + '</p>',
+                         author=user, project=project)
+                    for _ in range(min(batch_size, total - offset))
+                ])
+            self.stdout.write(f"生成 {total} 篇笔记耗时 {time.perf_counter() - started:.1f}s")
+
+            started = time.perf_counter()
+            backend = search.get_backend()
+            batch = []
+            for note in Note.objects.with_content().filter(project=project).iterator(chunk_size=batch_size):
+                batch.append(note)
+                if len(batch) >= batch_size:
+                    backend.index_notes(batch)
+                    visibility.index_notes(batch)
+                    batch = []
+            if batch:
+                backend.index_notes(batch)
+                visibility.index_notes(batch)
+            self.stdout.write(f"建立索引耗时 {time.perf_counter() - started:.1f}s")
+
+            # 选取中等频率的词作为查询，避免全部命中高频词或不存在的词
+            queries = [rng.choice(vocabulary[50:1000]) for _ in range(options['queries'])]
+            visible = Q(project__in=Project.objects.filter(members=user)) | Q(project__isnull=True, author=user)
+
+            legacy, indexed = [], []
+            for query in queries:
+                started = time.perf_counter()
+                list(Note.objects.filter((Q(title__icontains=query) | Q(content__icontains=query)) & visible)
+                     .order_by('-created_at').values('id', 'title').distinct())
+                legacy.append((time.perf_counter() - started) * 1000)
+
+                started = time.perf_counter()
+                search.search_notes(user, query, limit=search.DEFAULT_LIMIT)
+                indexed.append((time.perf_counter() - started) * 1000)
+
+            for label, samples in (('icontains', legacy), ('倒排索引', indexed)):
+                self.stdout.write(
+                    f"{label:>10}: p50={_percentile(samples, 50):.1f}ms "
+                    f"p95={_percentile(samples, 95):.1f}ms mean={statistics.mean(samples):.1f}ms"
+                )
+            transaction.set_rollback(True)
@@ -0,0 +1,29 @@
+# knowledge_project/management/commands/compact_revisions.py
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+
+from knowledge_project import revisions
+from knowledge_project.models import NoteRevision
+
+
+class Command(BaseCommand):
+    help = "对旧的笔记历史版本抽稀：超过保留期的版本每天只保留最后一个，并重新编码保留下来的版本链。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help="最近多少天内的版本全部保留（默认 30）")
+        parser.add_argument('--dry-run', action='store_true', help="只统计会删除多少个版本，不实际修改")
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        note_ids = list(
+            NoteRevision.objects.filter(created_at__lt=before).values('note_id')
+            .annotate(old=Count('id')).filter(old__gt=1).values_list('note_id', flat=True)
+        )
+        removed = 0
+        for note_id in note_ids:
+            removed += revisions.compact(note_id, before, dry_run=options['dry_run'])
+        verb = "将删除" if options['dry_run'] else "已删除"
+        self.stdout.write(self.style.SUCCESS(f"检查了 {len(note_ids)} 篇笔记，{verb} {removed} 个历史版本。"))
@@ -0,0 +1,24 @@
+# knowledge_project/management/commands/compress_note_content.py
+from django.core.management.base import BaseCommand, CommandError
+
+from knowledge_project import compression
+
+
+class Command(BaseCommand):
+    help = "把已有笔记的正文转换为压缩存储（超过阈值的正文压缩后写入 content_blob）。可以中断后重新运行。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help="每批处理的笔记数量")
+        parser.add_argument('--recompress', action='store_true',
+                            help="已经压缩的正文也按当前的编码方式和字典重新压缩（训练了新字典之后使用）")
+        parser.add_argument('--decompress', action='store_true', help="把全部正文还原为明文")
+
+    def handle(self, *args, **options):
+        if options['recompress'] and options['decompress']:
+            raise CommandError("--recompress 和 --decompress 不能同时使用")
+        stats = compression.convert(batch_size=options['batch_size'], recompress=options['recompress'],
+                                    inline=options['decompress'], progress=self.stdout.write)
+        before, after = stats['bytes_before'], stats['bytes_after']
+        ratio = f"，{before / 1024:.0f}KB -> {after / 1024:.0f}KB" if before else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"完成：检查 {stats['scanned']} 篇，压缩 {stats['compressed']} 篇，还原为明文 {stats['inlined']} 篇{ratio}。"))
@@ -0,0 +1,28 @@
+# knowledge_project/management/commands/gc_blobs.py
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from knowledge_project import assets, uploads
+
+
+class Command(BaseCommand):
+    help = "回收内容寻址存储中不再被任何资产引用的文件，以及过期的分片上传（建议每天定时执行）。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float,
+                            default=assets.GC_GRACE_PERIOD.total_seconds() / 3600,
+                            help="只回收超过这么多小时未被使用的文件，避免误删正在上传的文件")
+        parser.add_argument('--dry-run', action='store_true', help="只统计，不删除")
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            purged = uploads.purge_expired()
+            self.stdout.write(f"已清理 {purged} 个过期或已取消的分片上传会话。")
+        stats = assets.collect_garbage(timedelta(hours=options['grace_hours']), dry_run=options['dry_run'])
+        prefix = "[dry-run] 可回收" if options['dry_run'] else "已回收"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}：孤立 Blob {stats['blobs']} 个，无记录文件 {stats['files']} 个，"
+            f"临时文件 {stats['temp_files']} 个，共 {stats['bytes'] / 1024 / 1024:.1f} MB"
+            f"（修正引用计数 {stats['recounted']} 条）"
+        ))
@@ -0,0 +1,36 @@
+# knowledge_project/management/commands/generate_thumbnails.py
+from django.core.management.base import BaseCommand
+
+from knowledge_project import thumbnails
+from knowledge_project.models import Asset
+
+
+class Command(BaseCommand):
+    help = "为已有的图片资产补齐缩略图（在进程池中并行生成，已存在的缩略图会跳过）。"
+
+    def handle(self, *args, **options):
+        options_ = thumbnails.get_options()
+        futures = []
+        seen = set()
+        for asset in Asset.objects.filter(asset_type='image').only('id', 'file', 'asset_type').iterator():
+            if not thumbnails.is_image(asset) or asset.file.name in seen:
+                continue
+            seen.add(asset.file.name)
+            for size in options_['SIZES']:
+                for fmt in options_['FORMATS']:
+                    future = thumbnails.submit(thumbnails.digest_from_name(asset.file.name), asset.file.name, size, fmt)
+                    if future is not None:
+                        futures.append(future)
+
+        failed = 0
+        for done, future in enumerate(futures, start=1):
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"  生成失败: {e}")
+            if done % 100 == 0:
+                self.stdout.write(f"  已完成 {done}/{len(futures)}")
+        self.stdout.write(self.style.SUCCESS(
+            f"处理了 {len(seen)} 张图片，生成缩略图 {len(futures) - failed} 张，失败 {failed} 张。"
+        ))
@@ -0,0 +1,31 @@
+# knowledge_project/management/commands/migrate_assets_to_cas.py
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from knowledge_project.models import Asset
+from knowledge_project.storage import asset_storage, digest_from_name
+
+
+class Command(BaseCommand):
+    help = "把旧的 uploads/user_<id>/ 资产文件迁入内容寻址存储，重复的文件只保留一份。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete-old', action='store_true', help="迁移成功后删除旧文件")
+
+    def handle(self, *args, **options):
+        migrated = missing = 0
+        for asset in Asset.objects.exclude(file='').iterator():
+            old_name = asset.file.name
+            if digest_from_name(old_name):
+                continue
+            if not default_storage.exists(old_name):
+                missing += 1
+                self.stderr.write(f"  文件不存在，跳过: {old_name} (asset={asset.pk})")
+                continue
+            with default_storage.open(old_name, 'rb') as f:
+                asset.file.name = asset_storage.save(old_name, f)
+            asset.save(update_fields=['file'])  # post_save 信号负责关联 Blob
+            if options['delete_old']:
+                default_storage.delete(old_name)
+            migrated += 1
+        self.stdout.write(self.style.SUCCESS(f"已迁移 {migrated} 个资产，缺失文件 {missing} 个。"))
@@ -0,0 +1,38 @@
+# knowledge_project/management/commands/process_email_queue.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from knowledge_project import mailqueue
+
+
+class Command(BaseCommand):
+    help = "发送邮件队列中的待发送邮件。默认持续运行，--once 只处理一轮（适合 cron）。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=mailqueue.DEFAULT_BATCH_SIZE,
+                            help="每批领取的邮件数量，同一批共用一个 SMTP 连接")
+        parser.add_argument('--interval', type=float, default=2.0, help="队列为空时的轮询间隔（秒）")
+        parser.add_argument('--once', action='store_true', help="处理完当前到期的邮件后退出")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        while True:
+            stats = mailqueue.process_batch(batch_size)
+            if any(stats.values()):
+                self.stdout.write(
+                    f"已发送 {stats['sent']}，等待重试 {stats['retried']}，最终失败 {stats['failed']}，"
+                    f"过期 {stats['expired']}"
+                )
+            processed = sum(stats.values())
+            if options['once'] and processed < batch_size:
+                break
+            if not processed:
+                time.sleep(options['interval'])
+
+        status = mailqueue.queue_status()
+        self.stdout.write(self.style.SUCCESS(
+            "队列状态: " + "，".join(f"{label} {status[key]}" for key, label in
+                                      (('pending', '等待'), ('sending', '发送中'), ('sent', '已发送'), ('failed', '失败'),
+                                       ('expired', '过期')))
+        ))
@@ -0,0 +1,36 @@
+# knowledge_project/management/commands/provision_users.py
+from django.core.management.base import BaseCommand, CommandError
+
+from knowledge_project import provisioning
+
+
+class Command(BaseCommand):
+    help = (
+        "从 CSV 或 JSON 文件批量开通用户（同时创建 Profile、个人项目空间和 owner 成员关系）。"
+        "字段：username（必填）、email、password、first_name、last_name。可重复运行，已存在的用户会被跳过。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV（首行为表头）或 JSON（对象数组）文件路径")
+        parser.add_argument('--format', choices=['csv', 'json'], help="文件格式，默认按扩展名判断")
+        parser.add_argument('--batch-size', type=int, default=provisioning.DEFAULT_BATCH_SIZE,
+                            help="每个事务处理的用户数")
+
+    def handle(self, *args, **options):
+        try:
+            rows = provisioning.read_rows(options['path'], options['format'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"无法读取 {options['path']}: {e}")
+
+        def progress(done, total):
+            self.stdout.write(f"  已处理 {done}/{total}")
+
+        self.stdout.write(f"读取到 {len(rows)} 行，开始导入...")
+        stats = provisioning.provision_users(rows, batch_size=options['batch_size'], progress=progress)
+
+        for line, username, reason in stats['errors']:
+            self.stderr.write(f"  第 {line} 行 ({username or '-'}): {reason}")
+        self.stdout.write(self.style.SUCCESS(
+            f"完成：新建用户 {stats['created']}，已存在 {stats['existing']}，"
+            f"创建资料 {stats['profiles']}，创建个人空间 {stats['spaces']}，跳过 {len(stats['errors'])} 行"
+        ))
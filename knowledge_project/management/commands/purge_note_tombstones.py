@@ -0,0 +1,12 @@
+# knowledge_project/management/commands/purge_note_tombstones.py
+from django.core.management.base import BaseCommand
+
+from knowledge_project import sync
+
+
+class Command(BaseCommand):
+    help = "删除超过保留期的笔记墓碑记录（建议每天定时执行）。"
+
+    def handle(self, *args, **options):
+        deleted = sync.purge_tombstones()
+        self.stdout.write(self.style.SUCCESS(f"已删除 {deleted} 条过期的墓碑记录。"))
@@ -0,0 +1,16 @@
+# knowledge_project/management/commands/rebuild_note_visibility.py
+from django.core.management.base import BaseCommand
+
+from knowledge_project import visibility
+
+
+class Command(BaseCommand):
+    help = "重建笔记可见性表 NoteVisibility（首次部署、loaddata 或绕过信号批量写入数据后执行）。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=visibility.DEFAULT_BATCH_SIZE,
+                            help="每批处理的笔记数量")
+
+    def handle(self, *args, **options):
+        total = visibility.rebuild(batch_size=options['batch_size'], progress=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f"可见性表重建完成，共 {total} 行。"))
@@ -0,0 +1,30 @@
+# knowledge_project/management/commands/rebuild_search_index.py
+from django.core.management.base import BaseCommand
+
+from knowledge_project import search
+from knowledge_project.models import Note
+
+
+class Command(BaseCommand):
+    help = "重建全部笔记的全文检索倒排索引（首次部署或修改分词规则后执行）。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help="每批处理的笔记数量")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        backend = search.get_backend()
+        total = Note.objects.count()
+        done = 0
+        batch = []
+        for note in Note.objects.with_content().order_by('pk').iterator(chunk_size=batch_size):
+            batch.append(note)
+            if len(batch) >= batch_size:
+                backend.index_notes(batch)
+                done += len(batch)
+                batch = []
+                self.stdout.write(f"已索引 {done}/{total}")
+        if batch:
+            backend.index_notes(batch)
+            done += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"索引重建完成，共 {done} 篇笔记。"))
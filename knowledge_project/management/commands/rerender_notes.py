@@ -0,0 +1,23 @@
+# knowledge_project/management/commands/rerender_notes.py
+from django.core.management.base import BaseCommand
+
+from knowledge_project import rendering
+from knowledge_project.models import Note
+
+
+class Command(BaseCommand):
+    help = "重新渲染笔记（清洗 HTML、目录、分页块）。默认只处理没有渲染结果或渲染器版本过旧的笔记。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="重新渲染全部笔记")
+
+    def handle(self, *args, **options):
+        notes = Note.objects.with_content().order_by('pk')
+        if not options['all']:
+            notes = notes.exclude(render__version=rendering.RENDERER_VERSION)
+        total = notes.count()
+        for done, note in enumerate(notes.iterator(chunk_size=200), start=1):
+            rendering.render_note(note, force=True)
+            if done % 200 == 0:
+                self.stdout.write(f"已渲染 {done}/{total}")
+        self.stdout.write(self.style.SUCCESS(f"渲染完成，共 {total} 篇笔记。"))
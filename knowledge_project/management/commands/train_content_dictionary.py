@@ -0,0 +1,34 @@
+# knowledge_project/management/commands/train_content_dictionary.py
+from django.core.management.base import BaseCommand, CommandError
+
+from knowledge_project import compression
+
+
+class Command(BaseCommand):
+    help = "用最近的笔记正文训练压缩字典。之后写入的正文使用新字典，已有数据可以用 compress_note_content --recompress 转换。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=2000, help="训练使用的笔记数量")
+        parser.add_argument('--size', type=int, help="字典大小（字节），zlib 最多 32KB")
+        parser.add_argument('--codec', choices=(compression.ZLIB, compression.ZSTD),
+                            help="默认与当前写入使用的编码方式相同")
+        parser.add_argument('--dry-run', action='store_true', help="只报告压缩效果，不保存字典")
+
+    def handle(self, *args, **options):
+        codec = options['codec'] or compression.default_codec()
+        samples = compression.sample_contents(options['samples'])
+        if not samples:
+            raise CommandError("没有可用于训练的笔记")
+        try:
+            data = compression.train(samples, codec=codec, size=options['size'])
+        except compression.CompressionError as e:
+            raise CommandError(str(e))
+        raw, plain, with_dict = compression.evaluate(samples, codec, data)
+        self.stdout.write(f"{len(samples)} 篇样本，原始 {raw / 1024:.0f}KB，{codec} 压缩后 {plain / 1024:.0f}KB，"
+                          f"使用 {len(data) / 1024:.1f}KB 字典后 {with_dict / 1024:.0f}KB")
+        if options['dry_run']:
+            return
+        if with_dict >= plain:
+            raise CommandError("字典没有带来收益，未保存")
+        dictionary = compression.save_dictionary(codec, data, len(samples))
+        self.stdout.write(self.style.SUCCESS(f"已保存字典 {dictionary.pk}。"))
@@ -1,18 +1,33 @@
 # Create your models here.
 # knowledge_project/models.py
 
-from django.db import models
+from django.db import DatabaseError, models
+from django.utils import timezone
 import uuid
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
-from django_ckeditor_5.fields import CKEditor5Field
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.db.models import Case, When
+from django.db.models.functions import Length, Substr
 
-from django_ckeditor_5.fields import CKEditor5Field
+from . import compression
+from .compression import CompressedTextField
+from .storage import asset_storage
 # 架构已重构：移除了 Team 和 TeamMembership 模型。
 # 权限和成员管理现在直接在 Project 层级进行。
 
+class ProjectQuerySet(models.QuerySet):
+    def with_owner(self):
+        """
+        【新增】批量预取每个项目的所有者，配合 Project.owner 使用。
+        无论项目有多少个，都只额外执行一次查询（所有者成员关系 JOIN 用户表）。
+        """
+        return self.prefetch_related(models.Prefetch(
+            'memberships',
+            queryset=ProjectMembership.objects.filter(role='owner').select_related('user'),
+            to_attr='owner_memberships',
+        ))
+
+
 class Project(models.Model):
     """
     重构后的核心模型。每个项目都是一个独立的协作空间。
@@ -34,12 +49,17 @@ class Project(models.Model):
     # 【新增】用于区分普通项目和用户注册时创建的个人项目
     is_personal_space = models.BooleanField(default=False, verbose_name="是否为个人空间")
 
+    objects = ProjectQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
     @property
     def owner(self):
         """提供一个便捷的方式来获取项目所有者"""
+        # 通过 Project.objects.with_owner() 查询时，所有者已经被预取，不再产生额外查询
+        if hasattr(self, 'owner_memberships'):
+            return self.owner_memberships[0].user if self.owner_memberships else None
         try:
             # membership关系在ProjectMembership模型中定义
             return self.memberships.get(role='owner').user
@@ -101,9 +121,89 @@ class ProjectMembership(models.Model):
             models.Index(fields=['role']),
         ]
 
+class _ContentSliceIterable(models.query.ModelIterable):
+    """压缩存储的正文无法在数据库中截取，对这些行解压后在 Python 中截取。"""
+
+    def __iter__(self):
+        start, length = self.queryset._content_slice_args
+        for note in super().__iter__():
+            packed = note.__dict__.pop('content_packed', None)
+            if packed is not None:
+                text = compression.decompress(packed)
+                note.content_slice, note.content_length = text[start:start + length], len(text)
+            yield note
+
+
+class NoteQuerySet(models.QuerySet):
+    """
+    【新增】笔记查询默认不读取正文（content 和压缩后的 content_blob），权限检查、列表等只需要元数据。
+    需要完整正文时调用 with_content()；只需要开头一段（例如摘要）时调用 content_slice()，由数据库截取。
+    注意：在默认延迟加载的基础上调用 only('content', ...) 不会加载正文，请使用 with_content()。
+    """
+    CONTENT_FIELDS = frozenset({'content', 'content_blob'})
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._content_slice_args = None
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._content_slice_args = self._content_slice_args
+        return clone
+
+    def with_content(self):
+        """取消正文的延迟加载，保留其他 defer() / only() 设置。"""
+        clone = self._chain()
+        field_names, defer = clone.query.deferred_loading
+        if defer:
+            clone.query.deferred_loading = (frozenset(field_names) - self.CONTENT_FIELDS, True)
+        else:
+            clone.query.deferred_loading = (frozenset(field_names) | self.CONTENT_FIELDS, False)
+        return clone
+
+    def content_slice(self, start=0, length=200):
+        """
+        用 SUBSTRING / CHAR_LENGTH 在数据库中截取正文的第 start 个字符起的 length 个字符，
+        结果放在 note.content_slice，正文总长度放在 note.content_length，不会读取完整正文。
+        压缩存储的行只能取回压缩数据再截取；values() 查询中这些行的 content_slice 为 None。
+        """
+        clone = self.annotate(
+            content_slice=Substr('content', start + 1, length),
+            content_length=Length('content'),
+            content_packed=Case(When(content__isnull=True, then='content_blob'), default=None,
+                                output_field=models.BinaryField()),
+        )
+        clone._content_slice_args = (start, length)
+        if clone._iterable_class is models.query.ModelIterable:
+            clone._iterable_class = _ContentSliceIterable
+        return clone
+
+    def content_of(self, pk):
+        """只读取一篇笔记的正文（不加载模型实例），笔记不存在时返回 None。"""
+        row = self.filter(pk=pk).values_list('content', 'content_blob').first()
+        return compression.load(*row) if row else None
+
+    async def acontent_of(self, pk):
+        row = await self.filter(pk=pk).values_list('content', 'content_blob').afirst()
+        return compression.load(*row) if row else None
+
+
+class NoteManager(models.Manager.from_queryset(NoteQuerySet)):
+    def get_queryset(self):
+        return super().get_queryset().defer(*NoteQuerySet.CONTENT_FIELDS)
+
+
+class VersionConflict(DatabaseError):
+    """【新增】保存笔记时数据库中的版本号已经不是加载时的版本：其他人在此期间保存过这篇笔记。"""
+
+
 class Note(models.Model):
     title = models.CharField(max_length=255, verbose_name="笔记标题")
-    content = CKEditor5Field(verbose_name="笔记内容", null=True, blank=True, config_name='full')
+    # 【修改】超过阈值的正文压缩后存入 content_blob，本列为 NULL；访问 note.content 时才解压（见 compression.py）
+    content = CompressedTextField(verbose_name="笔记内容", null=True, blank=True, config_name='full',
+                                  blob_field='content_blob')
+    # 必须声明在 content 之后：保存时由 content 字段先算出压缩数据
+    content_blob = models.BinaryField(null=True, blank=True, editable=False, verbose_name="压缩后的正文")
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notes', verbose_name="作者")
     project = models.ForeignKey(
         Project,
@@ -114,12 +214,60 @@ class Note(models.Model):
         blank=True  # 允许在表单中（如Django Admin）提交时该字段为空
     )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    # 【新增】最后修改时间，供侧边栏增量同步使用
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
     is_public = models.BooleanField(default=False, verbose_name="是否公开")
     public_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    # 【新增】由 NoteChunk 分页时预先计算的总页数，读取分页时无需加载完整内容
+    page_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="页数")
+    # 【新增】乐观并发控制：每次保存递增，保存时以 WHERE version=加载时的版本 条件更新
+    version = models.PositiveIntegerField(default=1, editable=False, verbose_name="版本号")
+
+    # 【新增】默认延迟加载正文，见 NoteQuerySet
+    objects = NoteManager()
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        """
+        【修改】更新已有笔记时执行 UPDATE ... WHERE id=%s AND version=%s 并递增版本号；
+        期间有其他人保存过（版本号不一致）时抛出 VersionConflict，不会覆盖对方的修改。
+        传入 update_fields 时只写这些列（以及 version 和 updated_at；写 content 时连同 content_blob）。
+        """
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+        self._expected_version = self.version
+        self.version += 1
+        update_fields = kwargs.get('update_fields')
+        deferred = self.get_deferred_fields()
+        if update_fields is None and deferred:
+            # 与 Django 一样只写已加载的列，但 content 和 content_blob 需要一起写入
+            update_fields = [f.name for f in self._meta.concrete_fields
+                             if not f.primary_key and f.attname not in deferred]
+        if update_fields is not None:
+            update_fields = {*update_fields, 'version', 'updated_at'}
+            if 'content' in update_fields:
+                update_fields.add('content_blob')
+            kwargs['update_fields'] = update_fields
+        try:
+            super().save(*args, **kwargs)
+        except VersionConflict:
+            self.version = self._expected_version
+            raise
+        finally:
+            self._expected_version = None
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        expected = getattr(self, '_expected_version', None)
+        if expected is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        if not super()._do_update(base_qs.filter(version=expected), using, pk_val, values, update_fields,
+                                  forced_update):
+            # 没有更新到任何行时 Django 会改为 INSERT，这里直接报告冲突
+            raise VersionConflict(f'笔记 {pk_val} 已被修改（期望版本 {expected}）')
+        return True
+
     class Meta:
         verbose_name, verbose_name_plural = "知识笔记", "知识笔记"
         ordering = ['-created_at']
@@ -127,6 +275,156 @@ class Note(models.Model):
             models.Index(fields=['created_at']),
             models.Index(fields=['project']),
             models.Index(fields=['author']),  # 为新字段添加索引
+            models.Index(fields=['updated_at']),
+        ]
+
+
+
+class CompressionDictionary(models.Model):
+    """
+    【新增】笔记正文压缩使用的共享字典，由 train_content_dictionary 命令从现有笔记训练得到。
+    压缩数据的头部记录了字典 ID，字典被使用后不能再删除或修改。
+    """
+    CODEC_CHOICES = (('zlib', 'zlib'), ('zstd', 'zstd'))
+
+    codec = models.CharField(max_length=8, choices=CODEC_CHOICES, verbose_name="编码方式")
+    data = models.BinaryField(verbose_name="字典数据")
+    sample_count = models.PositiveIntegerField(default=0, verbose_name="训练样本数")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+
+    class Meta:
+        verbose_name, verbose_name_plural = "压缩字典", "压缩字典"
+
+
+class NoteVisibility(models.Model):
+    """
+    【新增】反规范化的笔记可见性表：用户能看到的每篇笔记一行，created_at 从笔记冗余过来。
+    “用户可见的笔记按创建时间倒序”只需在 (user, created_at, note) 索引上做一次范围扫描，
+    不再需要 JOIN 成员关系表再 DISTINCT。由 visibility.py 通过信号维护，rebuild_note_visibility 命令可整体重建。
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', verbose_name="用户")
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='visibility', verbose_name="笔记")
+    created_at = models.DateTimeField(verbose_name="笔记创建时间")
+
+    class Meta:
+        verbose_name, verbose_name_plural = "笔记可见性", "笔记可见性"
+        unique_together = ('user', 'note')
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'note']),
+        ]
+
+
+class NoteTombstone(models.Model):
+    """
+    【新增】笔记删除（或移出项目）的墓碑记录。
+    侧边栏增量同步时据此告诉客户端哪些笔记需要从本地列表中移除。
+    只保存 ID 而不是外键，因为对应的笔记已经不存在或已不属于原项目。
+    """
+    note_id = models.BigIntegerField(verbose_name="笔记ID")
+    project_id = models.BigIntegerField(null=True, blank=True, verbose_name="原所属项目ID")
+    author_id = models.BigIntegerField(verbose_name="作者ID")
+    deleted_at = models.DateTimeField(auto_now_add=True, verbose_name="删除时间")
+
+    class Meta:
+        verbose_name, verbose_name_plural = "笔记删除记录", "笔记删除记录"
+        indexes = [
+            models.Index(fields=['deleted_at']),
+            models.Index(fields=['project_id', 'deleted_at']),
+        ]
+
+
+class NoteChunk(models.Model):
+    """
+    【新增】笔记内容的分页块。
+    笔记保存时按 HTML 结构切分并存储，分页接口每次只读取一个块，而不是整篇内容。
+    """
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='chunks', verbose_name="笔记")
+    index = models.PositiveIntegerField(verbose_name="页序号")  # 从 0 开始
+    content = models.TextField(blank=True, verbose_name="分页内容")
+
+    class Meta:
+        verbose_name, verbose_name_plural = "笔记分页", "笔记分页"
+        unique_together = ('note', 'index')
+        ordering = ['note', 'index']
+
+
+class NoteRender(models.Model):
+    """
+    【新增】笔记内容的渲染结果：清洗后的 HTML、纯文本、目录和字数。
+    在保存时生成一次，读取时直接使用；version 是渲染器版本，渲染规则变化时据此重新生成。
+    """
+    note = models.OneToOneField(Note, on_delete=models.CASCADE, primary_key=True, related_name='render')
+    version = models.PositiveIntegerField(default=0, verbose_name="渲染器版本")
+    source_hash = models.CharField(max_length=64, verbose_name="原始内容 SHA-256")
+    html = models.TextField(blank=True, verbose_name="清洗后的 HTML")
+    text = models.TextField(blank=True, verbose_name="纯文本")
+    toc = models.JSONField(default=list, verbose_name="目录")
+    word_count = models.PositiveIntegerField(default=0, verbose_name="字数")
+    rendered_at = models.DateTimeField(auto_now=True, verbose_name="渲染时间")
+
+    class Meta:
+        verbose_name = "笔记渲染结果"
+        verbose_name_plural = "笔记渲染结果"
+
+
+class NoteRevision(models.Model):
+    """
+    【新增】笔记的历史版本。
+    每隔若干个版本保存一次完整快照，其余版本只保存相对于上一个版本的压缩差异（见 revisions.py），
+    每次编辑增加的存储与改动的大小成正比，而不是与笔记的大小成正比。
+    """
+    SNAPSHOT, DELTA = 'snapshot', 'delta'
+    KIND_CHOICES = ((SNAPSHOT, '完整快照'), (DELTA, '差异'))
+
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='revisions', verbose_name="笔记")
+    number = models.PositiveIntegerField(verbose_name="版本号")  # 每篇笔记从 1 开始递增，压缩后可能不连续
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES, verbose_name="存储方式")
+    title = models.CharField(max_length=255, verbose_name="标题")
+    data = models.BinaryField(verbose_name="压缩数据")
+    content_hash = models.CharField(max_length=64, verbose_name="内容 SHA-256")
+    content_length = models.PositiveIntegerField(default=0, verbose_name="内容长度")
+    author = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+                               verbose_name="修改者")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+
+    class Meta:
+        verbose_name, verbose_name_plural = "笔记历史版本", "笔记历史版本"
+        unique_together = ('note', 'number')
+        ordering = ['note', '-number']
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
+
+class NoteSearchDocument(models.Model):
+    """
+    【新增】笔记的全文检索文档。
+    保存从标题和 CKEditor HTML 中抽取出的纯文本，用于生成搜索摘要和计算文档长度。
+    """
+    note = models.OneToOneField(Note, on_delete=models.CASCADE, primary_key=True, related_name='search_document',
+                                verbose_name="笔记")
+    text = models.TextField(blank=True, verbose_name="纯文本内容")
+    length = models.PositiveIntegerField(default=0, verbose_name="词项数量")
+    indexed_at = models.DateTimeField(auto_now=True, verbose_name="索引时间")
+
+    class Meta:
+        verbose_name, verbose_name_plural = "笔记检索文档", "笔记检索文档"
+
+
+class NoteSearchToken(models.Model):
+    """
+    【新增】倒排索引的一条记录：某个词项在某篇笔记中的加权词频。
+    weight = 标题词频 * 标题权重 + 正文词频。
+    """
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='search_tokens', verbose_name="笔记")
+    term = models.CharField(max_length=64, verbose_name="词项")
+    weight = models.PositiveIntegerField(default=1, verbose_name="权重")
+
+    class Meta:
+        verbose_name, verbose_name_plural = "笔记索引词项", "笔记索引词项"
+        unique_together = ('term', 'note')
+        indexes = [
+            models.Index(fields=['note']),
         ]
 
 
@@ -146,6 +444,25 @@ def user_directory_path(instance, filename):
     return f'unknown_user/{filename}'
 
 
+class Blob(models.Model):
+    """
+    【新增】内容寻址存储中的一个文件（按 SHA-256 去重），可以被多个 Asset 共享。
+    ref_count 由信号维护，gc_blobs 命令会删除不再被引用的 Blob 及其文件。
+    """
+    sha256 = models.CharField(max_length=64, unique=True, verbose_name="SHA-256")
+    file = models.FileField(storage=asset_storage, max_length=255, verbose_name="存储路径")
+    size = models.BigIntegerField(default=0, verbose_name="大小（字节）")
+    ref_count = models.IntegerField(default=0, verbose_name="引用次数")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+
+    def __str__(self):
+        return self.sha256
+
+    class Meta:
+        verbose_name = "文件内容"
+        verbose_name_plural = "文件内容"
+
+
 class Asset(models.Model):
     ASSET_TYPE_CHOICES = [
         ('file', '普通文件'), ('image', '图片'), ('code', '代码片段'), ('doc', '文档'),
@@ -158,7 +475,11 @@ class Asset(models.Model):
     # 【修改点】在这里添加 blank=True，使其变为非必填字段
     name = models.CharField(max_length=255, verbose_name="文件名/资源名", blank=True)
 
-    file = models.FileField(upload_to=user_directory_path, verbose_name="上传文件")
+    # 【重构】文件按内容哈希保存在 cas/ 下，相同内容只存一份；upload_to 只用于保留扩展名
+    file = models.FileField(upload_to=user_directory_path, storage=asset_storage, max_length=255,
+                            verbose_name="上传文件")
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, editable=False,
+                             related_name="assets", verbose_name="文件内容")
     asset_type = models.CharField(max_length=10, choices=ASSET_TYPE_CHOICES, default='file', verbose_name="资源类型")
     description = models.TextField(blank=True, verbose_name="描述")
     uploaded_at = models.DateTimeField(auto_now_add=True, verbose_name="上传时间")
@@ -172,6 +493,58 @@ class Asset(models.Model):
         verbose_name_plural = "项目资产"
         ordering = ['-uploaded_at']
 
+class UploadSession(models.Model):
+    """
+    【新增】一次分片上传：客户端按 chunk_size 把文件切成若干分片分别 PUT，
+    全部到齐后合并为一个 Asset。中断后可以查询已收到的分片继续上传。
+    """
+    STATUS_CHOICES = [
+        ('uploading', '上传中'), ('assembling', '合并中'), ('complete', '已完成'), ('aborted', '已取消'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="upload_sessions", verbose_name="上传者")
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name="upload_sessions",
+                                verbose_name="所属项目")
+    filename = models.CharField(max_length=255, verbose_name="文件名")
+    asset_type = models.CharField(max_length=10, choices=Asset.ASSET_TYPE_CHOICES, default='file',
+                                  verbose_name="资源类型")
+    size = models.BigIntegerField(verbose_name="文件大小（字节）")
+    chunk_size = models.PositiveIntegerField(verbose_name="分片大小（字节）")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='uploading', verbose_name="状态")
+    asset = models.ForeignKey(Asset, on_delete=models.SET_NULL, null=True, blank=True, related_name="+",
+                              verbose_name="生成的资产")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    expires_at = models.DateTimeField(db_index=True, verbose_name="过期时间")
+
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def __str__(self):
+        return f"{self.filename} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name = "分片上传"
+        verbose_name_plural = "分片上传"
+
+
+class UploadChunk(models.Model):
+    """【新增】分片上传中已经收到并通过校验的一个分片。"""
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name="chunks",
+                                verbose_name="上传会话")
+    index = models.PositiveIntegerField(verbose_name="分片序号")
+    size = models.PositiveIntegerField(verbose_name="大小（字节）")
+    sha256 = models.CharField(max_length=64, verbose_name="SHA-256")
+    received_at = models.DateTimeField(auto_now=True, verbose_name="接收时间")
+
+    class Meta:
+        verbose_name = "上传分片"
+        verbose_name_plural = "上传分片"
+        unique_together = ('session', 'index')
+        ordering = ['session', 'index']
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, verbose_name="关联用户")
     activation_code = models.CharField(max_length=8, blank=True, verbose_name="激活码")
@@ -185,29 +558,40 @@ class Profile(models.Model):
         verbose_name_plural = "用户资料"
 
 
-# --- Django Signals ---
-
-@receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    """当新用户创建时，自动为其创建 Profile。"""
-    if created:
-        Profile.objects.create(user=instance)
-
-@receiver(post_save, sender=User)
-def create_personal_project_for_new_user(sender, instance, created, **kwargs):
+class EmailJob(models.Model):
     """
-    【新增信号】当新用户创建时，自动为其创建一个个人项目空间。
+    【新增】待发送邮件队列中的一项任务。
+    视图只负责写入队列，由 process_email_queue 命令在后台批量发送、失败重试。
     """
-    if created:
-        # 1. 创建个人项目
-        personal_project = Project.objects.create(
-            title=f"{instance.username}的个人空间",
-            description="这是您的个人项目空间，用于存放您的私人笔记和资产。",
-            is_personal_space=True
-        )
-        # 2. 将该用户设为项目的所有者
-        ProjectMembership.objects.create(
-            user=instance,
-            project=personal_project,
-            role='owner'
-        )
\ No newline at end of file
+    STATUS_CHOICES = [
+        ('pending', '等待发送'),
+        ('sending', '发送中'),
+        ('sent', '已发送'),
+        ('failed', '发送失败'),
+        ('expired', '已过期'),
+    ]
+
+    subject = models.CharField(max_length=255, verbose_name="主题")
+    body = models.TextField(verbose_name="正文")
+    from_email = models.CharField(max_length=255, blank=True, verbose_name="发件人")
+    recipients = models.JSONField(default=list, verbose_name="收件人")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', verbose_name="状态")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="已尝试次数")
+    max_attempts = models.PositiveSmallIntegerField(default=5, verbose_name="最大尝试次数")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="下次尝试时间")
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name="领取时间")
+    last_error = models.TextField(blank=True, verbose_name="最近一次错误")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="发送时间")
+    # 验证码等有时效的邮件：过了这个时间还没发出去就不再发送
+    expires_at = models.DateTimeField(null=True, blank=True, verbose_name="过期时间")
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name, verbose_name_plural = "邮件任务", "邮件任务"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
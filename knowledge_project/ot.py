@@ -0,0 +1,161 @@
+# knowledge_project/ot.py
+"""
+纯文本的操作变换 (Operational Transformation)，实时协作编辑 (realtime.py) 使用。
+
+一个操作是覆盖整篇文档的组件列表，与 ot.js 的 TextOperation 格式相同：
+- 正整数 n：保留（跳过）n 个字符；
+- 字符串 s：在当前位置插入 s；
+- 负整数 -n：删除 n 个字符。
+例如在 "hello" 的末尾追加 "!" 是 [5, "!"]，删除开头的 "h" 是 [-1, 4]。
+
+位置按 Unicode 码点计数（Python 字符串的下标），浏览器端需要用 Array.from(text) 而不是 UTF-16 下标。
+不依赖 Django。
+"""
+
+
+class OTError(ValueError):
+    pass
+
+
+def _is_retain(c):
+    return isinstance(c, int) and c > 0
+
+
+def _is_delete(c):
+    return isinstance(c, int) and c < 0
+
+
+def _is_insert(c):
+    return isinstance(c, str)
+
+
+class _Builder:
+    """逐个追加组件，合并相邻的同类组件，并让插入总在删除之前（规范形式，便于比较和变换）。"""
+
+    def __init__(self):
+        self.ops = []
+
+    def retain(self, n):
+        if n:
+            if self.ops and _is_retain(self.ops[-1]):
+                self.ops[-1] += n
+            else:
+                self.ops.append(n)
+        return self
+
+    def insert(self, s):
+        if not s:
+            return self
+        ops = self.ops
+        if ops and _is_insert(ops[-1]):
+            ops[-1] += s
+        elif ops and _is_delete(ops[-1]):
+            if len(ops) > 1 and _is_insert(ops[-2]):
+                ops[-2] += s
+            else:
+                ops.insert(len(ops) - 1, s)
+        else:
+            ops.append(s)
+        return self
+
+    def delete(self, n):
+        if n:
+            if self.ops and _is_delete(self.ops[-1]):
+                self.ops[-1] -= n
+            else:
+                self.ops.append(-n)
+        return self
+
+
+def normalize(op):
+    """校验来自客户端的操作并转换为规范形式，格式错误时抛出 OTError。"""
+    if not isinstance(op, list):
+        raise OTError('操作必须是列表')
+    builder = _Builder()
+    for c in op:
+        if isinstance(c, bool) or not isinstance(c, (int, str)) or c == 0:
+            raise OTError(f'无效的操作组件: {c!r}')
+        if _is_retain(c):
+            builder.retain(c)
+        elif _is_delete(c):
+            builder.delete(-c)
+        else:
+            builder.insert(c)
+    return builder.ops
+
+
+def base_length(op):
+    """操作要求的文档长度。"""
+    return sum(abs(c) for c in op if not _is_insert(c))
+
+
+def target_length(op):
+    """应用操作之后的文档长度。"""
+    return sum(c if _is_retain(c) else len(c) for c in op if not _is_delete(c))
+
+
+def is_noop(op):
+    return all(_is_retain(c) for c in op)
+
+
+def apply(doc, op):
+    if base_length(op) != len(doc):
+        raise OTError(f'操作的基准长度 {base_length(op)} 与文档长度 {len(doc)} 不一致')
+    parts, pos = [], 0
+    for c in op:
+        if _is_retain(c):
+            parts.append(doc[pos:pos + c])
+            pos += c
+        elif _is_insert(c):
+            parts.append(c)
+        else:
+            pos -= c
+    return ''.join(parts)
+
+
+def transform(a, b):
+    """
+    a、b 是基于同一文档的并发操作，返回 (a', b')，使 apply(apply(doc, a), b') == apply(apply(doc, b), a')。
+    同一位置同时插入时 a 的内容在前。
+    """
+    if base_length(a) != base_length(b):
+        raise OTError('并发操作的基准长度不一致')
+    a_prime, b_prime = _Builder(), _Builder()
+    ops1, ops2 = iter(a), iter(b)
+    op1, op2 = next(ops1, None), next(ops2, None)
+    while op1 is not None or op2 is not None:
+        if op1 is not None and _is_insert(op1):
+            a_prime.insert(op1)
+            b_prime.retain(len(op1))
+            op1 = next(ops1, None)
+            continue
+        if op2 is not None and _is_insert(op2):
+            a_prime.retain(len(op2))
+            b_prime.insert(op2)
+            op2 = next(ops2, None)
+            continue
+        if op1 is None or op2 is None:
+            raise OTError('操作长度不匹配')
+
+        if _is_retain(op1) and _is_retain(op2):
+            n = min(op1, op2)
+            a_prime.retain(n)
+            b_prime.retain(n)
+        elif _is_delete(op1) and _is_delete(op2):
+            # 双方删除了同一段文字，变换后都不需要再删除
+            n = min(-op1, -op2)
+            op1, op2 = op1 + n, op2 + n
+            op1 = op1 or next(ops1, None)
+            op2 = op2 or next(ops2, None)
+            continue
+        elif _is_delete(op1):
+            n = min(-op1, op2)
+            a_prime.delete(n)
+        else:
+            n = min(op1, -op2)
+            b_prime.delete(n)
+
+        # 消耗两边各 n 个字符
+        op1 = (op1 - n if op1 > 0 else op1 + n) or next(ops1, None)
+        op2 = (op2 - n if op2 > 0 else op2 + n) or next(ops2, None)
+    return a_prime.ops, b_prime.ops
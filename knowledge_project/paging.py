@@ -0,0 +1,60 @@
+# knowledge_project/paging.py
+"""
+笔记分页存储。
+
+笔记内容在保存时按 HTML 结构切分为若干页存入 NoteChunk，并把总页数写入 Note.page_count。
+分页接口只需按 (note, index) 读取一行，不再把整篇（可能数 MB 的）内容读入内存再切片。
+【重构】切分在渲染管线 (rendering.py) 中对清洗后的 HTML 进行，并会在分页符处强制断页。
+"""
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+from .models import Note, NoteChunk
+from . import rendering
+
+CHARS_PER_PAGE = 2000
+
+
+def rebuild_chunks(note):
+    """重新渲染并切分一篇笔记，返回总页数。"""
+    rendering.render_note(note, force=True)
+    return note.page_count
+
+
+def save_pages(note, pages):
+    """保存一篇笔记的全部分页块（由 rendering.render_note 调用），返回总页数。"""
+    with transaction.atomic():
+        NoteChunk.objects.filter(note_id=note.pk).delete()
+        NoteChunk.objects.bulk_create(
+            [NoteChunk(note_id=note.pk, index=i, content=page) for i, page in enumerate(pages)]
+        )
+        # 使用 update 而不是 save，避免再次触发 post_save 信号
+        Note.objects.filter(pk=note.pk).update(page_count=len(pages))
+    note.page_count = len(pages)
+    return len(pages)
+
+
+def get_page(note, page):
+    """
+    读取第 page 页（从 1 开始）的内容，页码超出范围时自动收敛到首页/末页。
+    返回 (实际页码, 总页数, 页面内容)。
+    """
+    if not note.page_count:
+        # 分页功能上线前保存的旧笔记还没有分页块，第一次访问时补建
+        rebuild_chunks(note)
+    total_pages = note.page_count
+    page = min(max(page, 1), total_pages)
+    content = (NoteChunk.objects.filter(note_id=note.pk, index=page - 1)
+               .values_list('content', flat=True).first())
+    return page, total_pages, content or ''
+
+
+async def aget_page(note, page):
+    """get_page 的异步版本。补建分页块（需要渲染）很少发生，在线程中执行。"""
+    if not note.page_count:
+        await sync_to_async(rebuild_chunks)(note)
+    total_pages = note.page_count
+    page = min(max(page, 1), total_pages)
+    content = await (NoteChunk.objects.filter(note_id=note.pk, index=page - 1)
+                     .values_list('content', flat=True).afirst())
+    return page, total_pages, content or ''
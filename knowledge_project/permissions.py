@@ -0,0 +1,116 @@
+# knowledge_project/permissions.py
+"""
+项目成员角色解析。
+
+note_detail_api 原来在每次 GET/PUT 时都执行 `note.project.members.filter(pk=...).exists()`，
+而且只知道“是不是成员”，不知道角色。这里把 (用户, 项目) -> 角色 的解析结果缓存在两级：
+
+1. 进程内字典，有效期很短（默认 5 秒），同一进程内的连续翻页不需要任何网络往返；
+2. Redis（Django 默认缓存），在 ProjectMembership 保存/删除时由信号直接删除。
+
+非成员的结果同样会被缓存，避免无权限的请求反复查询数据库。
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import ProjectMembership
+from . import acache, profiling
+
+ROLE_CACHE_TIMEOUT = 60 * 60
+# 进程内缓存无法被其他进程的信号清除，所以有效期要短：撤销权限最多延迟这么多秒生效
+LOCAL_TTL = getattr(settings, 'KNOWLEDGE_ROLE_CACHE_LOCAL_TTL', 5)
+LOCAL_MAX_ENTRIES = 10000
+
+OWNER, ADMIN, EDITOR, VIEWER = 'owner', 'admin', 'editor', 'viewer'
+WRITE_ROLES = {OWNER, ADMIN, EDITOR}
+
+_NOT_MEMBER = ''  # 缓存中表示“不是成员”，与缓存未命中 (None) 区分开
+_local = {}
+_local_lock = threading.Lock()
+
+
+def _cache_key(user_id, project_id):
+    return f"project_role_{project_id}_{user_id}"
+
+
+def _local_get(key):
+    entry = _local.get(key)
+    if entry and entry[1] > time.monotonic():
+        return entry[0]
+    return None
+
+
+def _local_set(key, role):
+    with _local_lock:
+        if len(_local) >= LOCAL_MAX_ENTRIES:
+            _local.clear()
+        _local[key] = (role, time.monotonic() + LOCAL_TTL)
+
+
+def get_role(user, project_id):
+    """返回用户在项目中的角色（'owner'/'admin'/'editor'/'viewer'），不是成员时返回 None。"""
+    if not user.is_authenticated or not project_id:
+        return None
+    key = _cache_key(user.pk, project_id)
+    role = _local_get(key)
+    if role is None:
+        role = cache.get(key)
+        profiling.record_cache(key, role is not None)
+        if role is None:
+            role = (ProjectMembership.objects.filter(user_id=user.pk, project_id=project_id)
+                    .values_list('role', flat=True).first()) or _NOT_MEMBER
+            cache.set(key, role, timeout=ROLE_CACHE_TIMEOUT)
+        _local_set(key, role)
+    return role or None
+
+
+async def aget_role(user, project_id):
+    """get_role 的异步版本（异步视图使用），user 必须是已经解析过的用户对象。"""
+    if not user.is_authenticated or not project_id:
+        return None
+    key = _cache_key(user.pk, project_id)
+    role = _local_get(key)
+    if role is None:
+        role = await acache.aget(key)
+        if role is None:
+            role = (await ProjectMembership.objects.filter(user_id=user.pk, project_id=project_id)
+                    .values_list('role', flat=True).afirst()) or _NOT_MEMBER
+            await acache.aset(key, role, timeout=ROLE_CACHE_TIMEOUT)
+        _local_set(key, role)
+    return role or None
+
+
+def invalidate(user_id, project_id):
+    """成员关系变化后清除缓存（由 signals.py 调用）。"""
+    key = _cache_key(user_id, project_id)
+    cache.delete(key)
+    with _local_lock:
+        _local.pop(key, None)
+
+
+def note_role(user, note):
+    """
+    用户对笔记的有效角色：
+    - 笔记属于项目时，取用户在该项目中的角色；
+    - 未分配项目的笔记只有作者本人可以访问，视为 owner。
+    """
+    if note.project_id:
+        return get_role(user, note.project_id)
+    if note.author_id == user.pk:
+        return OWNER
+    return None
+
+
+async def anote_role(user, note):
+    if note.project_id:
+        return await aget_role(user, note.project_id)
+    if note.author_id == user.pk:
+        return OWNER
+    return None
+
+
+def can_write(role):
+    return role in WRITE_ROLES
@@ -0,0 +1,418 @@
+# knowledge_project/profiling.py
+"""
+请求级的性能剖析与指标。
+
+knowledge_list、note_detail_api、search_notes_api 等视图的耗时分布原来完全不可见：
+数据库、缓存命中情况、模板渲染、JSON 编码各占多少无从得知。ProfilingMiddleware 为每个请求记录：
+
+- SQL 查询的条数和耗时：每个数据库连接创建时由 signals.py 安装 execute_wrapper (_record_query)，
+  当前请求的剖析对象保存在 contextvar 中，异步视图经 sync_to_async 执行的查询同样会被记录；
+- 缓存命中/未命中：caching.py、permissions.py、publishing.py 和 acache.py 读缓存时调用 record_cache，
+  按键名族统计（数字替换为 *，例如 project_notes_*_v*）；
+- 代码段耗时：span('render') / json_response() 分别记录模板渲染和 JSON 编码；
+- 总耗时。
+
+结果通过三种方式输出：
+- 响应头 Server-Timing（浏览器开发者工具的 Timing 面板可以直接查看）；
+- 按视图聚合的直方图和计数器，/metrics/ 以 Prometheus 文本格式输出；默认缓存是 django-redis 时
+  各进程每隔 FLUSH_INTERVAL 秒把增量合并到 Redis，/metrics/ 返回所有进程的汇总；
+- 超过 SLOW_REQUEST_MS 的请求按 SLOW_SAMPLE_RATE 抽样写入日志，附带查询列表（重复的 SQL 会被合并计数）。
+
+配置见 _DEFAULTS，可以通过 settings.KNOWLEDGE_PROFILING 覆盖。
+"""
+import contextlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+
+logger = logging.getLogger(__name__)
+
+_DEFAULTS = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    'SLOW_REQUEST_MS': 500,
+    'SLOW_SAMPLE_RATE': 1.0,
+    'SLOW_MAX_QUERIES': 50,     # 每个请求最多保留多少条 SQL 文本（用于慢请求日志），条数和耗时始终完整统计
+    'LATENCY_BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'QUERY_BUCKETS': (0, 1, 2, 5, 10, 20, 50, 100),
+    'FLUSH_INTERVAL': 10,
+    'REDIS_KEY': 'profiling_metrics',
+    'METRICS_TOKEN': None,      # 抓取 /metrics/ 使用的 Bearer 令牌；不设置时只有管理员可以访问
+}
+
+# 指标名 -> (类型, 说明)
+METRICS = {
+    'knowledge_request_duration_seconds': ('histogram', '请求总耗时'),
+    'knowledge_request_queries': ('histogram', '每个请求的 SQL 查询条数'),
+    'knowledge_requests_total': ('counter', '请求数'),
+    'knowledge_db_duration_seconds_total': ('counter', 'SQL 查询累计耗时'),
+    'knowledge_span_duration_seconds_total': ('counter', '代码段（模板渲染、JSON 编码等）累计耗时'),
+    'knowledge_cache_requests_total': ('counter', '缓存读取次数'),
+    'knowledge_slow_requests_total': ('counter', '超过阈值的慢请求数'),
+    'knowledge_captcha_pool': ('gauge', '验证码池状态'),
+}
+
+_current = ContextVar('knowledge_profile', default=None)
+_DIGITS_RE = re.compile(r'\d+')
+
+
+def get_options():
+    return {**_DEFAULTS, **getattr(settings, 'KNOWLEDGE_PROFILING', {})}
+
+
+class RequestProfile:
+    """一个请求的剖析数据。异步视图中 sync_to_async 复制的是 contextvar 的上下文，指向的是同一个对象。"""
+
+    def __init__(self, max_queries):
+        self.started = time.perf_counter()
+        self.max_queries = max_queries
+        self.queries = []           # [(sql, 秒)]，最多 max_queries 条
+        self.query_count = 0
+        self.db_time = 0.0
+        self.cache = Counter()      # (键名族, 'hit' | 'miss') -> 次数
+        self.spans = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def add_query(self, sql, duration):
+        with self._lock:
+            self.query_count += 1
+            self.db_time += duration
+            if len(self.queries) < self.max_queries:
+                self.queries.append((sql, duration))
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def current():
+    return _current.get()
+
+
+# ---------------------------------
+#  采集
+# ---------------------------------
+
+def _record_query(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, time.perf_counter() - start)
+
+
+def install(connection):
+    """为数据库连接安装查询记录器（connection_created 信号调用，重复调用无副作用）。"""
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def key_family(key):
+    return _DIGITS_RE.sub('*', str(key))
+
+
+def record_cache(key, hit):
+    profile = _current.get()
+    if profile is not None:
+        profile.cache[(key_family(key), 'hit' if hit else 'miss')] += 1
+
+
+def record_cache_many(keys, found):
+    """get_many 之后调用：keys 是请求的键，found 是返回的字典。"""
+    profile = _current.get()
+    if profile is not None:
+        for key in keys:
+            profile.cache[(key_family(key), 'hit' if key in found else 'miss')] += 1
+
+
+@contextlib.contextmanager
+def span(name):
+    """记录一段代码的耗时，例如 with profiling.span('render'): return render(...)"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.spans[name] += time.perf_counter() - start
+
+
+def json_response(data, **kwargs):
+    """与 JsonResponse 相同，JSON 编码的耗时记为 json。"""
+    with span('json'):
+        return JsonResponse(data, **kwargs)
+
+
+# ---------------------------------
+#  聚合
+# ---------------------------------
+
+class Registry:
+    """
+    进程内的指标。直方图展开为 _bucket/_sum/_count 三组计数器，所以全部数据都是“序列 -> 累加值”，
+    合并到 Redis 时每个序列一次 HINCRBYFLOAT。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = defaultdict(float)   # (序列名, 标签) -> 值
+        self._pending = defaultdict(float)  # 尚未合并到 Redis 的增量
+        self._last_flush = time.monotonic()
+
+    def _add(self, series, labels, value):
+        self._totals[(series, labels)] += value
+        self._pending[(series, labels)] += value
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            self._add(name, tuple(labels), value)
+
+    def observe(self, name, labels, value, buckets):
+        labels = tuple(labels)
+        with self._lock:
+            for bound in buckets:
+                # 没有落入的桶也写入 0，输出中每个直方图的桶都是完整的
+                self._add(f'{name}_bucket', labels + (('le', _format(bound)),), 1 if value <= bound else 0)
+            self._add(f'{name}_bucket', labels + (('le', '+Inf'),), 1)
+            self._add(f'{name}_sum', labels, value)
+            self._add(f'{name}_count', labels, 1)
+
+    def flush_due(self, interval):
+        return time.monotonic() - self._last_flush >= interval
+
+    def flush(self, client, key):
+        """把增量合并到 Redis 哈希；失败时保留增量，下次再试。"""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for (series, labels), value in pending.items():
+                pipe.hincrbyfloat(key, json.dumps([series, labels], ensure_ascii=False), value)
+            pipe.execute()
+        except Exception as e:
+            logger.warning("指标合并到 Redis 失败: %s", e)
+            with self._lock:
+                for item, value in pending.items():
+                    self._pending[item] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._totals)
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+            self._pending.clear()
+
+
+registry = Registry()
+
+
+def _format(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _redis():
+    from . import acache
+    if not acache.is_redis():
+        return None
+    from django.core.cache import cache
+    return cache.client.get_client(write=True)
+
+
+def flush(force=False):
+    options = get_options()
+    if not force and not registry.flush_due(options['FLUSH_INTERVAL']):
+        return
+    client = _redis()
+    if client is not None:
+        registry.flush(client, options['REDIS_KEY'])
+
+
+def collect(profile, view, method, status, options):
+    total = profile.elapsed
+    registry.observe('knowledge_request_duration_seconds', (('view', view),), total, options['LATENCY_BUCKETS'])
+    registry.observe('knowledge_request_queries', (('view', view),), profile.query_count, options['QUERY_BUCKETS'])
+    registry.inc('knowledge_requests_total', (('view', view), ('method', method), ('status', str(status))))
+    if profile.query_count:
+        registry.inc('knowledge_db_duration_seconds_total', (('view', view),), profile.db_time)
+    for name, duration in profile.spans.items():
+        registry.inc('knowledge_span_duration_seconds_total', (('view', view), ('span', name)), duration)
+    for (family, result), count in profile.cache.items():
+        registry.inc('knowledge_cache_requests_total', (('view', view), ('key', family), ('result', result)), count)
+    return total
+
+
+# ---------------------------------
+#  输出
+# ---------------------------------
+
+def server_timing(profile, total):
+    parts = [f'db;dur={profile.db_time * 1000:.1f};desc="{profile.query_count} queries"']
+    if profile.cache:
+        hits = sum(n for (_, result), n in profile.cache.items() if result == 'hit')
+        misses = sum(n for (_, result), n in profile.cache.items() if result == 'miss')
+        parts.append(f'cache;desc="{hits} hit, {misses} miss"')
+    parts.extend(f'{name};dur={duration * 1000:.1f}' for name, duration in profile.spans.items())
+    parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
+
+
+def log_slow_request(request, view, profile, total):
+    repeated = Counter(sql for sql, _ in profile.queries)
+    lines = [f'  {duration * 1000:8.1f}ms  {sql}' for sql, duration in profile.queries]
+    if profile.query_count > len(profile.queries):
+        lines.append(f'  ... 另有 {profile.query_count - len(profile.queries)} 条查询')
+    duplicates = [f'  x{count}  {sql}' for sql, count in repeated.most_common() if count > 1]
+    logger.warning(
+        "慢请求 %s %s (%s): %.1fms，%d 条查询共 %.1fms，缓存 %s\n%s%s",
+        request.method, request.get_full_path(), view, total * 1000, profile.query_count, profile.db_time * 1000,
+        dict(profile.cache) or '-', '\n'.join(lines),
+        ('\n重复的查询:\n' + '\n'.join(duplicates)) if duplicates else '',
+    )
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _merged_series():
+    """本进程的数据；使用 Redis 时是所有进程合并后的数据（先把本进程的增量写入）。"""
+    client = _redis()
+    if client is None:
+        return registry.snapshot()
+    flush(force=True)
+    series = {}
+    for field, value in client.hgetall(get_options()['REDIS_KEY']).items():
+        name, labels = json.loads(field)
+        series[(name, tuple(tuple(label) for label in labels))] = float(value)
+    return series
+
+
+def _captcha_series():
+    from . import captcha
+    if captcha._pool is None:  # 不为了输出指标而创建验证码池
+        return {}
+    stats = captcha._pool.stats()
+    return {('knowledge_captcha_pool', (('stat', name),)): float(value) for name, value in stats.items()}
+
+
+def _family(series):
+    for suffix in ('_bucket', '_sum', '_count'):
+        if series.endswith(suffix) and series[:-len(suffix)] in METRICS:
+            return series[:-len(suffix)]
+    return series
+
+
+def render_metrics():
+    """Prometheus 文本格式 (text/plain; version=0.0.4)。"""
+    series = {**_merged_series(), **_captcha_series()}
+    families = defaultdict(list)
+    for (name, labels), value in series.items():
+        families[_family(name)].append((name, labels, value))
+
+    lines = []
+    for family in sorted(families):
+        kind, help_text = METRICS.get(family, ('untyped', ''))
+        lines.append(f'# HELP {family} {help_text}')
+        lines.append(f'# TYPE {family} {kind}')
+        for name, labels, value in sorted(families[family], key=_sort_key):
+            lines.append(f'{name}{_labels(labels)} {_format(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _sort_key(sample):
+    name, labels, _ = sample
+    # 同一组标签的 bucket 按 le 的数值排序，+Inf 在最后
+    plain = tuple(label for label in labels if label[0] != 'le')
+    le = next((value for key, value in labels if key == 'le'), None)
+    return plain, name, float('inf') if le == '+Inf' else float(le) if le is not None else 0.0
+
+
+def metrics_allowed(request):
+    token = get_options()['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') == f'Bearer {token}':
+        return True
+    return request.user.is_authenticated and request.user.is_staff
+
+
+# ---------------------------------
+#  中间件
+# ---------------------------------
+
+class ProfilingMiddleware:
+    """应放在 MIDDLEWARE 的第一位，耗时包含其他中间件。同时支持同步和异步请求处理链。"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.options = get_options()
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.options['ENABLED']:
+            return self.get_response(request)
+        profile = RequestProfile(self.options['SLOW_MAX_QUERIES'])
+        token = _current.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, profile)
+        flush()
+        return response
+
+    async def __acall__(self, request):
+        if not self.options['ENABLED']:
+            return await self.get_response(request)
+        profile = RequestProfile(self.options['SLOW_MAX_QUERIES'])
+        token = _current.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, profile)
+        if registry.flush_due(self.options['FLUSH_INTERVAL']):
+            await sync_to_async(flush)()
+        return response
+
+    def _finish(self, request, response, profile):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.view_name if match else None) or 'unresolved'
+        total = collect(profile, view, request.method, response.status_code, self.options)
+        if self.options['SERVER_TIMING']:
+            response.headers['Server-Timing'] = server_timing(profile, total)
+        if total * 1000 >= self.options['SLOW_REQUEST_MS']:
+            registry.inc('knowledge_slow_requests_total', (('view', view),))
+            if random.random() < self.options['SLOW_SAMPLE_RATE']:
+                log_slow_request(request, view, profile, total)
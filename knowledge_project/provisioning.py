@@ -0,0 +1,162 @@
+# knowledge_project/provisioning.py
+"""
+用户开通（注册后的初始化）。
+
+每个新用户都需要：一个 Profile、一个个人项目空间、以及该用户在个人空间中的 owner 成员关系。
+单个用户（注册、后台添加）由 signals.py 中的 post_save 信号调用 provision_user()；
+批量导入则使用 provision_users()：按批次在事务中 bulk_create，不触发逐行信号，
+每批只需要固定数量的查询，与批内用户数无关。
+
+批量导入是幂等的：已存在的用户名会被跳过，但缺失的 Profile / 个人空间会被补齐，
+所以中断后可以直接用同一份数据重新运行。
+"""
+import csv
+import json
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from .models import Profile, Project, ProjectMembership
+from . import caching
+
+DEFAULT_BATCH_SIZE = 500
+USER_FIELDS = ('username', 'email', 'password', 'first_name', 'last_name')
+
+PERSONAL_SPACE_TITLE = "{username}的个人空间"
+PERSONAL_SPACE_DESCRIPTION = "这是您的个人项目空间，用于存放您的私人笔记和资产。"
+
+
+def personal_space_for(user):
+    return Project(
+        title=PERSONAL_SPACE_TITLE.format(username=user.username),
+        description=PERSONAL_SPACE_DESCRIPTION,
+        is_personal_space=True,
+    )
+
+
+def provision_user(user):
+    """为单个新用户创建 Profile 和个人项目空间（由 post_save 信号调用）。"""
+    Profile.objects.create(user=user)
+    personal_project = personal_space_for(user)
+    personal_project.save()
+    ProjectMembership.objects.create(user=user, project=personal_project, role='owner')
+
+
+# ---------------------------------
+#  批量导入
+# ---------------------------------
+
+def read_rows(path, fmt=None):
+    """
+    读取 CSV（首行为表头）或 JSON（对象数组）文件，返回字典列表。
+    fmt 为空时按文件扩展名判断。
+    """
+    fmt = fmt or ('json' if str(path).lower().endswith('.json') else 'csv')
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if fmt == 'json':
+            rows = json.load(f)
+            if not isinstance(rows, list):
+                raise ValueError("JSON 文件的顶层必须是用户对象数组")
+            return rows
+        return list(csv.DictReader(f))
+
+
+def _clean_rows(rows, errors):
+    """去掉空白、校验用户名，并按用户名去重（保留第一次出现的行）。"""
+    cleaned = {}
+    for line, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append((line, '', "不是有效的用户对象"))
+            continue
+        data = {field: str(row.get(field) or '').strip() for field in USER_FIELDS}
+        username = data['username']
+        if not username or len(username) > 150:
+            errors.append((line, username, "用户名为空或过长"))
+            continue
+        cleaned.setdefault(username, data)
+    return list(cleaned.values())
+
+
+def _insert_users(rows):
+    """bulk_create 新用户，返回 {用户名: 用户}；未提供密码的用户设置为不可用密码，需通过重置密码登录。"""
+    users = []
+    for data in rows:
+        user = User(username=data['username'], email=data['email'],
+                    first_name=data['first_name'], last_name=data['last_name'])
+        if data['password']:
+            user.password = make_password(data['password'])
+        else:
+            user.set_unusable_password()
+        users.append(user)
+    User.objects.bulk_create(users)
+    if not connection.features.can_return_rows_from_bulk_insert:
+        # MySQL 等数据库不会回填主键，按用户名查回来
+        users = User.objects.filter(username__in=[user.username for user in users])
+    return {user.username: user for user in users}
+
+
+def _insert_personal_spaces(users):
+    """为一批用户批量创建个人空间和 owner 成员关系。"""
+    projects = [personal_space_for(user) for user in users]
+    Project.objects.bulk_create(projects)
+    if not connection.features.can_return_rows_from_bulk_insert:
+        # 数据库不返回主键时按标题找回刚插入的行：尚无任何成员、标题相同的个人空间中 pk 最大的那个。
+        # 同名的孤立空间（例如 owner 成员关系被手动删除）pk 更小，按 pk 升序排列后在 dict 中被覆盖，
+        # 不会被认领，也不会被删除，其中的笔记保持原样
+        by_title = dict(
+            Project.objects.filter(is_personal_space=True, memberships__isnull=True,
+                                   title__in=[project.title for project in projects])
+            .order_by('pk').values_list('title', 'pk')
+        )
+        for project in projects:
+            project.pk = by_title[project.title]
+    ProjectMembership.objects.bulk_create([
+        ProjectMembership(user=user, project=project, role='owner')
+        for user, project in zip(users, projects)
+    ])
+
+
+def _provision_batch(rows, stats):
+    with transaction.atomic():
+        names = [data['username'] for data in rows]
+        users = User.objects.in_bulk(names, field_name='username')
+        new_rows = [data for data in rows if data['username'] not in users]
+        if new_rows:
+            users.update(_insert_users(new_rows))
+        stats['created'] += len(new_rows)
+        stats['existing'] += len(rows) - len(new_rows)
+
+        user_ids = [user.pk for user in users.values()]
+        has_profile = set(Profile.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+        Profile.objects.bulk_create([Profile(user=user) for user in users.values() if user.pk not in has_profile])
+        stats['profiles'] += len(user_ids) - len(has_profile)
+
+        has_space = set(ProjectMembership.objects.filter(
+            user_id__in=user_ids, role='owner', project__is_personal_space=True,
+        ).values_list('user_id', flat=True))
+        missing = [user for user in users.values() if user.pk not in has_space]
+        if missing:
+            _insert_personal_spaces(missing)
+        stats['spaces'] += len(missing)
+
+    # 老用户新增了成员关系，清掉他们的项目列表缓存（新用户本来就没有缓存）
+    caching.forget_user_projects_many([user.pk for user in missing])
+
+
+def provision_users(rows, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    批量开通用户。
+    :param rows: 字典序列，键为 username（必填）、email、password、first_name、last_name
+    :param batch_size: 每个事务处理的用户数
+    :param progress: 可选回调 progress(已处理数, 总数)，每批完成后调用
+    :return: {'created', 'existing', 'profiles', 'spaces', 'errors': [(行号, 用户名, 原因)]}
+    """
+    errors = []
+    rows = _clean_rows(rows, errors)
+    stats = {'created': 0, 'existing': 0, 'profiles': 0, 'spaces': 0, 'errors': errors}
+    for start in range(0, len(rows), batch_size):
+        _provision_batch(rows[start:start + batch_size], stats)
+        if progress:
+            progress(min(start + batch_size, len(rows)), len(rows))
+    return stats
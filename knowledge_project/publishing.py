@@ -0,0 +1,67 @@
+# knowledge_project/publishing.py
+"""
+公开笔记的只读访问路径。
+
+公开笔记（is_public=True）通过 /notes/public/<public_id>/ 访问，不需要登录。
+一篇被大量转发的笔记不应该每次都查询 MySQL，所以：
+
+- 整个页面（基于渲染管线清洗后的 HTML）按 public_id 缓存在 Redis 中，连同内容的 SHA-256（强 ETag）；
+- 响应带 Cache-Control: public, s-maxage，CDN / 反向代理可以直接缓存，浏览器用 If-None-Match 得到 304；
+- 不存在或未公开的 public_id 也会被短暂缓存，防止用随机 UUID 穿透到数据库；
+- 笔记保存或删除时由信号清除对应的缓存 (purge)。
+
+页面渲染不使用 request 上下文：不读取会话、不查询用户，响应中也不会出现 Vary: Cookie。
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.http import http_date
+
+from .models import Note
+from . import profiling, rendering
+
+CACHE_TIMEOUT = 60 * 60 * 24       # 依靠保存时的主动清除保持一致，TTL 只用于回收
+MISSING_TIMEOUT = 60               # 不存在/未公开的结果缓存得短一些，重新公开后最多等这么久
+BROWSER_MAX_AGE = 60
+SHARED_MAX_AGE = 10 * 60           # CDN 可以缓存得更久；撤销公开后最多延迟这么久从边缘消失
+
+_MISSING = 'missing'
+
+
+def _cache_key(public_id):
+    return f"public_note_{public_id}"
+
+
+def build_page(public_id):
+    """从数据库生成公开页面，返回 {'body', 'etag', 'last_modified'}；不存在或未公开时返回 None。"""
+    note = (Note.objects.select_related('author').only('id', 'title', 'created_at', 'updated_at', 'author__username')
+            .filter(public_id=public_id, is_public=True).first())
+    if note is None:
+        return None
+    render = rendering.get_render(note)
+    body = render_to_string('public_note.html', {'note': note, 'render': render}).encode('utf-8')
+    return {
+        'body': body,
+        'etag': '"%s"' % hashlib.sha256(body).hexdigest(),
+        'last_modified': http_date(note.updated_at.timestamp()),
+    }
+
+
+def get_page(public_id):
+    page = cache.get(_cache_key(public_id))
+    profiling.record_cache(_cache_key(public_id), page is not None)
+    if page is None:
+        page = build_page(public_id)
+        cache.set(_cache_key(public_id), page or _MISSING, timeout=CACHE_TIMEOUT if page else MISSING_TIMEOUT)
+    return None if page == _MISSING else page
+
+
+def purge(public_id):
+    """笔记内容、标题或公开状态变化后清除缓存（由 signals.py 调用）。"""
+    if public_id:
+        cache.delete(_cache_key(public_id))
+
+
+def cache_control():
+    return f'public, max-age={BROWSER_MAX_AGE}, s-maxage={SHARED_MAX_AGE}'
@@ -0,0 +1,406 @@
+# knowledge_project/ratelimit.py
+"""
+可复用的限流模块。
+
+SendEmailCodeView 原来用 cache.get + cache.set/incr 分开读写两个计数器：并发请求下存在竞态，
+而且每个请求要 4 次 Redis 往返。这里提供两种算法，每次检查都只需一次原子操作：
+
+- 滑动窗口 (sliding window)：Redis 有序集合 + Lua 脚本，可以在一次调用中同时检查多个窗口
+  （例如“每小时 3 次且每天 5 次”），全部通过才计数；
+- 令牌桶 (token bucket)：Redis 哈希 + Lua 脚本，允许短时突发、长期平均受限。
+
+默认缓存是 django-redis 时使用 Redis 后端，否则（以及 Redis 不可用时）退回进程内存后端。
+用法：
+    @ratelimit('30/m', key='ip')                 # 函数视图
+    @method_decorator(ratelimit('10/5m'), name='post')   # 类视图
+    result = hit('email', ip, ['3/h', '5/d'])     # 在视图内部手动检查
+也可以通过 RateLimitMiddleware + settings.KNOWLEDGE_RATE_LIMITS 按 URL 名称统一配置。
+"""
+import asyncio
+import logging
+import math
+import re
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import JsonResponse
+
+from . import acache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'ratelimit'
+DEFAULT_MESSAGE = '请求过于频繁，请稍后再试。'
+
+RateLimitResult = namedtuple('RateLimitResult', ['allowed', 'retry_after'])
+
+_RATE_RE = re.compile(r'^\s*(\d+)\s*/\s*(\d*)\s*([smhd])\s*$')
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'3/h' -> (3, 3600)，'10/5m' -> (10, 300)。"""
+    match = _RATE_RE.match(rate)
+    if not match:
+        raise ValueError(f'无法解析的限流速率: {rate!r}')
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * _UNITS[unit]
+
+
+# ---------------------------------
+#  后端
+# ---------------------------------
+
+class MemoryBackend:
+    """进程内存后端：单进程部署、测试环境，以及 Redis 故障时的兜底。"""
+
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._windows = {}  # key -> (deque[时间戳], 窗口秒数)
+        self._buckets = {}  # key -> (令牌数, 更新时间, 容量, 每秒补充量)
+
+    def _purge(self, now):
+        """键过多时清理已经过期的窗口和已经补满的令牌桶，防止内存无限增长。"""
+        if len(self._windows) > self.MAX_KEYS:
+            self._windows = {k: v for k, v in self._windows.items() if v[0] and v[0][-1] > now - v[1]}
+        if len(self._buckets) > self.MAX_KEYS:
+            self._buckets = {k: v for k, v in self._buckets.items() if v[0] + (now - v[1]) * v[3] < v[2]}
+
+    def sliding_window(self, keys, limits, now):
+        with self._lock:
+            self._purge(now)
+            windows = [self._windows.setdefault(key, (deque(), period))[0]
+                       for key, (_, period) in zip(keys, limits)]
+            retry_after = 0.0
+            for hits, (limit, period) in zip(windows, limits):
+                while hits and hits[0] <= now - period:
+                    hits.popleft()
+                if len(hits) >= limit:
+                    retry_after = max(retry_after, hits[0] + period - now)
+            if retry_after:
+                return RateLimitResult(False, retry_after)
+            for hits in windows:
+                hits.append(now)
+            return RateLimitResult(True, 0.0)
+
+    def token_bucket(self, key, capacity, refill_rate, now):
+        with self._lock:
+            self._purge(now)
+            tokens, updated, _, _ = self._buckets.get(key, (capacity, now, capacity, refill_rate))
+            tokens = min(capacity, tokens + (now - updated) * refill_rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, capacity, refill_rate)
+                return RateLimitResult(False, (1 - tokens) / refill_rate)
+            self._buckets[key] = (tokens - 1, now, capacity, refill_rate)
+            return RateLimitResult(True, 0.0)
+
+
+# KEYS: 各窗口的有序集合；ARGV: 当前毫秒时间, 本次请求的唯一成员, 之后每两个为 (上限, 窗口毫秒)
+_SLIDING_WINDOW_LUA = """
+local now = tonumber(ARGV[1])
+local retry = 0
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[1 + i * 2])
+    local window = tonumber(ARGV[2 + i * 2])
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    if redis.call('ZCARD', key) >= limit then
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        retry = math.max(retry, tonumber(oldest[2]) + window - now)
+    end
+end
+if retry > 0 then
+    return retry
+end
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, ARGV[2])
+    redis.call('PEXPIRE', key, ARGV[2 + i * 2])
+end
+return 0
+"""
+
+# KEYS[1]: 令牌桶哈希；ARGV: 容量, 每毫秒补充的令牌数, 当前毫秒时间
+_TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local retry = 0
+if tokens < 1 then
+    retry = math.ceil((1 - tokens) / rate)
+else
+    tokens = tokens - 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate))
+return retry
+"""
+
+
+class RedisBackend:
+    """Redis 后端：每次检查是一次 EVALSHA 调用，多进程/多机之间共享计数。"""
+
+    def __init__(self, alias='default'):
+        from django_redis import get_redis_connection
+        self.client = get_redis_connection(alias)
+        self._sliding_window = self.client.register_script(_SLIDING_WINDOW_LUA)
+        self._token_bucket = self.client.register_script(_TOKEN_BUCKET_LUA)
+
+    def sliding_window(self, keys, limits, now):
+        now_ms = int(now * 1000)
+        args = [now_ms, f'{now_ms}-{uuid.uuid4().hex[:8]}']
+        for limit, period in limits:
+            args += [limit, period * 1000]
+        retry_ms = int(self._sliding_window(keys=keys, args=args))
+        return RateLimitResult(retry_ms == 0, retry_ms / 1000)
+
+    def token_bucket(self, key, capacity, refill_rate, now):
+        retry_ms = int(self._token_bucket(keys=[key], args=[capacity, refill_rate / 1000, int(now * 1000)]))
+        return RateLimitResult(retry_ms == 0, retry_ms / 1000)
+
+    # 异步视图使用 redis.asyncio 客户端执行同一段脚本（见 acache.py）
+
+    async def asliding_window(self, keys, limits, now):
+        script = acache.get_client().register_script(_SLIDING_WINDOW_LUA)
+        now_ms = int(now * 1000)
+        args = [now_ms, f'{now_ms}-{uuid.uuid4().hex[:8]}']
+        for limit, period in limits:
+            args += [limit, period * 1000]
+        retry_ms = int(await script(keys=keys, args=args))
+        return RateLimitResult(retry_ms == 0, retry_ms / 1000)
+
+    async def atoken_bucket(self, key, capacity, refill_rate, now):
+        script = acache.get_client().register_script(_TOKEN_BUCKET_LUA)
+        retry_ms = int(await script(keys=[key], args=[capacity, refill_rate / 1000, int(now * 1000)]))
+        return RateLimitResult(retry_ms == 0, retry_ms / 1000)
+
+
+def _backend_errors():
+    """Redis 后端调用可能抛出的、应当退回进程内限流的异常；脚本或参数错误等编程错误不在其中。"""
+    try:
+        from redis.exceptions import RedisError
+    except ImportError:
+        return (OSError,)
+    return (RedisError, OSError)
+
+
+_BACKEND_ERRORS = _backend_errors()
+_memory_backend = MemoryBackend()
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                cache_backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+                if cache_backend.startswith('django_redis'):
+                    try:
+                        _backend = RedisBackend()
+                    except Exception as e:
+                        logger.warning("无法初始化 Redis 限流后端，使用进程内存后端: %s", e)
+                        _backend = _memory_backend
+                else:
+                    _backend = _memory_backend
+    return _backend
+
+
+def _call(method, *args):
+    backend = get_backend()
+    if isinstance(backend, MemoryBackend):
+        return getattr(backend, method)(*args)
+    try:
+        return getattr(backend, method)(*args)
+    except _BACKEND_ERRORS as e:
+        # Redis 暂时不可用时不应该让业务请求失败，退回进程内限流
+        logger.warning("Redis 限流调用失败，临时使用进程内存后端: %s", e)
+        return getattr(_memory_backend, method)(*args)
+
+
+async def _acall(method, *args):
+    backend = get_backend()
+    if isinstance(backend, MemoryBackend):
+        # 进程内存后端只持有很短时间的锁，直接在事件循环中调用
+        return getattr(backend, method)(*args)
+    try:
+        return await getattr(backend, f'a{method}')(*args)
+    except _BACKEND_ERRORS as e:
+        logger.warning("Redis 限流调用失败，临时使用进程内存后端: %s", e)
+        return getattr(_memory_backend, method)(*args)
+
+
+# ---------------------------------
+#  对外接口
+# ---------------------------------
+
+def hit(group, identity, rates):
+    """
+    滑动窗口限流：对 (group, identity) 记一次请求。
+    rates 可以是一个速率或多个速率的列表，多个窗口在一次原子操作中同时检查，全部通过才计数。
+    """
+    return _call('sliding_window', *_window_args(group, identity, rates))
+
+
+def take_token(group, identity, rate):
+    """令牌桶限流：桶容量为速率中的次数，并按该速率匀速补充。"""
+    return _call('token_bucket', *_bucket_args(group, identity, rate))
+
+
+async def ahit(group, identity, rates):
+    return await _acall('sliding_window', *_window_args(group, identity, rates))
+
+
+async def atake_token(group, identity, rate):
+    return await _acall('token_bucket', *_bucket_args(group, identity, rate))
+
+
+def _window_args(group, identity, rates):
+    if isinstance(rates, str):
+        rates = [rates]
+    limits = [parse_rate(rate) for rate in rates]
+    # 花括号是 Redis Cluster 的 hash tag，保证同一身份的多个窗口落在同一个槽位，可以在一个脚本中操作
+    keys = [f'{KEY_PREFIX}:{{{group}:{identity}}}:{period}' for _, period in limits]
+    return keys, limits, time.time()
+
+
+def _bucket_args(group, identity, rate):
+    capacity, period = parse_rate(rate)
+    key = f'{KEY_PREFIX}:{{{group}:{identity}}}:bucket'
+    return key, capacity, capacity / period, time.time()
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR') or 'unknown'
+
+
+def _identity(request, key):
+    if callable(key):
+        return key(request)
+    if key == 'user' and request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return client_ip(request)
+
+
+def too_many_requests(retry_after, message=DEFAULT_MESSAGE):
+    """返回带 Retry-After 头的 429 响应，响应体与其他 JSON 接口保持一致。"""
+    response = JsonResponse({'status': 'error', 'message': message}, status=429)
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def check_request(request, rate, key='ip', algorithm='sliding_window', group=None):
+    """按规则检查一个请求，返回 RateLimitResult。"""
+    group = group or 'default'
+    identity = _identity(request, key)
+    if algorithm == 'token_bucket':
+        return take_token(group, identity, rate)
+    return hit(group, identity, rate)
+
+
+async def acheck_request(request, rate, key='ip', algorithm='sliding_window', group=None):
+    """check_request 的异步版本。"""
+    group = group or 'default'
+    if key == 'ip':
+        identity = client_ip(request)
+    else:
+        # 解析 request.user 需要查询会话和用户表，不能直接在事件循环中进行
+        identity = await sync_to_async(_identity)(request, key)
+    if algorithm == 'token_bucket':
+        return await atake_token(group, identity, rate)
+    return await ahit(group, identity, rate)
+
+
+def ratelimit(rate, key='ip', algorithm='sliding_window', methods=None, group=None, message=DEFAULT_MESSAGE):
+    """
+    视图装饰器，同步视图和 async def 视图都可以使用。
+    :param rate: 速率，如 '30/m'；滑动窗口算法下也可以传入列表同时限制多个窗口
+    :param key: 'ip'、'user'（未登录时按 IP）或 request -> str 的函数
+    :param algorithm: 'sliding_window' 或 'token_bucket'
+    :param methods: 只对这些 HTTP 方法限流，默认全部
+    :param group: 计数分组名，默认使用视图函数的限定名
+    """
+    def decorator(view_func):
+        group_name = group or f'{view_func.__module__}.{view_func.__qualname__}'
+
+        if asyncio.iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                if methods is None or request.method in methods:
+                    result = await acheck_request(request, rate, key=key, algorithm=algorithm, group=group_name)
+                    if not result.allowed:
+                        return too_many_requests(result.retry_after, message)
+                return await view_func(request, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if methods is None or request.method in methods:
+                result = check_request(request, rate, key=key, algorithm=algorithm, group=group_name)
+                if not result.allowed:
+                    return too_many_requests(result.retry_after, message)
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class RateLimitMiddleware:
+    """
+    按 URL 名称集中配置限流，适合不方便修改视图代码的场景（如第三方应用的视图）：
+
+        KNOWLEDGE_RATE_LIMITS = {
+            'ck_editor_5_upload_file': [{'rate': '30/m', 'key': 'user'}],
+        }
+
+    每条规则可选 key、algorithm、methods、message，含义与 ratelimit() 装饰器相同。
+    需要放在 AuthenticationMiddleware 之后（key='user' 要用到 request.user）；没有配置规则时不启用。
+    同时支持同步和异步请求处理链，异步模式下检查在事件循环中完成，不经过线程池。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rules = getattr(settings, 'KNOWLEDGE_RATE_LIMITS', {})
+        if not self.rules:
+            raise MiddlewareNotUsed
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            self.process_view = self._aprocess_view
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def _matching_rules(self, request):
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        for rule in self.rules.get(url_name, ()):
+            if not rule.get('methods') or request.method in rule['methods']:
+                yield rule, f'url:{url_name}'
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        for rule, group in self._matching_rules(request):
+            result = check_request(request, rule['rate'], key=rule.get('key', 'ip'),
+                                   algorithm=rule.get('algorithm', 'sliding_window'), group=group)
+            if not result.allowed:
+                return too_many_requests(result.retry_after, rule.get('message', DEFAULT_MESSAGE))
+        return None
+
+    async def _aprocess_view(self, request, view_func, view_args, view_kwargs):
+        for rule, group in self._matching_rules(request):
+            result = await acheck_request(request, rule['rate'], key=rule.get('key', 'ip'),
+                                          algorithm=rule.get('algorithm', 'sliding_window'), group=group)
+            if not result.allowed:
+                return too_many_requests(result.retry_after, rule.get('message', DEFAULT_MESSAGE))
+        return None
@@ -0,0 +1,740 @@
+# knowledge_project/realtime.py
+"""
+笔记的实时协作编辑。
+
+原来的编辑方式是“保存整篇 -> 其他人重新加载”，同一项目的成员之间看不到彼此正在进行的修改。
+现在每篇笔记有一个 WebSocket 频道 ws/notes/<id>/（由 Team_Project/asgi.py 路由到这里）：
+
+- 客户端发送基于某个版本号的增量操作（操作变换，格式见 ot.py），服务器把它变换到最新版本之上、
+  应用到协作文档，再按版本号顺序广播给所有连接；发送者收到 ack；
+- 在线成员和光标位置 (presence) 同样通过频道广播，客户端需要定期发送 ping；
+- 连接期间成员可能被移出项目或降为查看者：收到 op/presence/ping 以及向客户端转发消息之前都重新解析角色
+  （走 permissions 的两级缓存，命中时不查询数据库），不再是成员时关闭连接 (4403)，降为查看者后操作被拒绝；
+  超过 PRESENCE_TTL 没有收到任何消息（包括 ping）的连接被关闭 (4408)；
+- 协作文档每隔 FLUSH_INTERVAL 秒、以及本进程最后一个连接断开时写回 Note.content
+  （普通的 save(update_fields=['content'])，渲染、索引、历史版本照常更新）；
+  写回时如果发现正文已经被其他途径（例如 note_detail_api 的 PUT）修改，以数据库为准，
+  通知客户端重新加载 (reset)。
+
+频道层 (channel layer) 负责协作文档的状态、操作历史、在线列表和消息广播：
+- MemoryLayer：进程内实现，用于测试和单进程部署；
+- RedisLayer：多个工作进程共享同一份状态，用 WATCH/MULTI 保证同一篇笔记的操作串行应用，
+  每个进程只用一个 Pub/Sub 连接接收所有频道的消息再分发给本地连接。
+默认缓存是 django-redis 时使用 RedisLayer，可以通过 KNOWLEDGE_REALTIME['LAYER'] 指定。
+
+协议（JSON 文本帧）：
+    客户端 -> 服务器: {"type": "op", "rev": 12, "op": [...]}
+                     {"type": "presence", "cursor": {...}}    {"type": "ping"}
+    服务器 -> 客户端: {"type": "init", "rev", "content", "title", "conn", "can_edit", "presence": [...]}
+                     {"type": "ack", "rev"}    {"type": "op", "rev", "op", "user"}
+                     {"type": "presence", "event": "join" | "update" | "leave", "conn", "user", ...}
+                     {"type": "reset", "reason"}（之后服务器关闭连接，客户端重新连接即可）
+                     {"type": "error", "message"}    {"type": "pong"}
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+import weakref
+from collections import deque
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+
+from . import acache, ot, permissions
+from .models import Note, VersionConflict
+from .revisions import content_hash
+
+logger = logging.getLogger(__name__)
+
+_DEFAULTS = {
+    'LAYER': None,              # 'memory' 或 'redis'，默认跟随缓存后端
+    'FLUSH_INTERVAL': 5,        # 协作文档写回数据库的间隔（秒）
+    'HISTORY': 500,             # 保留最近多少个操作；落后更多的客户端需要重新加载
+    'PRESENCE_TTL': 60,         # 超过这么久没有 ping 的连接从在线列表中消失
+    'STATE_TTL': 60 * 60,       # Redis 中的协作状态在没有编辑之后保留的时间
+    'MAX_MESSAGE': 1024 * 1024,  # 单条消息的最大字节数
+    'ALLOWED_ORIGINS': (),      # 同源之外允许连接的 Origin，例如 ('https://notes.example.com',)
+}
+
+PATH_RE = re.compile(r'^/ws/notes/(?P<note_id>\d+)/$')
+
+# 关闭码：握手阶段关闭时浏览器看到的是 403
+CLOSE_FORBIDDEN = 4403
+CLOSE_NOT_FOUND = 4404
+CLOSE_IDLE = 4408
+CLOSE_RESET = 4409
+
+
+def get_options():
+    return {**_DEFAULTS, **getattr(settings, 'KNOWLEDGE_REALTIME', {})}
+
+
+class StaleRevision(Exception):
+    """客户端的版本太旧（历史已经被裁剪），或者协作状态已经被丢弃，需要重新加载。"""
+
+
+class AccessRevoked(Exception):
+    """连接期间用户已经不是笔记所属项目的成员。"""
+
+
+def _rebase(op, base_rev, rev, entries):
+    """把基于 base_rev 的操作变换到 rev 之上；entries 是 base_rev 之后的全部历史（按版本号升序）。"""
+    if base_rev > rev or base_rev < 0:
+        raise ot.OTError(f'无效的版本号 {base_rev}')
+    if len(entries) < rev - base_rev:
+        raise StaleRevision(base_rev)
+    for entry in entries[len(entries) - (rev - base_rev):]:
+        op, _ = ot.transform(op, entry['op'])
+    return op
+
+
+def _new_state(content):
+    return {'content': content, 'rev': 0, 'persisted_rev': 0, 'base_hash': content_hash(content), 'editor': None}
+
+
+# ---------------------------------
+#  频道层
+# ---------------------------------
+
+class _Fanout:
+    """把一个笔记频道的消息分发给本进程内订阅了它的连接（每个连接一个 asyncio.Queue）。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = {}  # note_id -> {queue: loop}
+
+    def add(self, note_id):
+        queue = asyncio.Queue()
+        with self._lock:
+            first = note_id not in self._queues
+            self._queues.setdefault(note_id, {})[queue] = asyncio.get_running_loop()
+        return queue, first
+
+    def remove(self, note_id, queue):
+        with self._lock:
+            queues = self._queues.get(note_id, {})
+            queues.pop(queue, None)
+            if queues:
+                return False
+            self._queues.pop(note_id, None)
+            return True
+
+    def deliver(self, note_id, message):
+        with self._lock:
+            targets = list(self._queues.get(note_id, {}).items())
+        for queue, loop in targets:
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+
+
+class MemoryLayer:
+    """进程内频道层：状态保存在字典中，所有操作在一把锁内完成（临界区内没有 await）。"""
+
+    def __init__(self, options):
+        self.options = options
+        self._lock = threading.Lock()
+        self._docs = {}
+        self._history = {}
+        self._presence = {}
+        self._flushing = set()
+        self._fanout = _Fanout()
+
+    async def load(self, note_id):
+        with self._lock:
+            state = self._docs.get(note_id)
+            return dict(state) if state else None
+
+    async def init(self, note_id, content):
+        with self._lock:
+            if note_id not in self._docs:
+                self._docs[note_id] = _new_state(content)
+                self._history[note_id] = deque(maxlen=self.options['HISTORY'])
+            return dict(self._docs[note_id])
+
+    async def submit(self, note_id, base_rev, op, origin, user_id):
+        with self._lock:
+            state = self._docs.get(note_id)
+            if state is None:
+                raise StaleRevision(base_rev)
+            history = self._history[note_id]
+            op = _rebase(op, base_rev, state['rev'], list(history))
+            state['content'] = ot.apply(state['content'], op)
+            state['rev'] += 1
+            state['editor'] = user_id
+            entry = {'rev': state['rev'], 'op': op, 'origin': origin, 'user': user_id}
+            history.append(entry)
+            return entry
+
+    async def ops_since(self, note_id, rev):
+        with self._lock:
+            state = self._docs.get(note_id)
+            if state is None:
+                raise StaleRevision(rev)
+            entries = [entry for entry in self._history[note_id] if entry['rev'] > rev]
+            if len(entries) < state['rev'] - rev:
+                raise StaleRevision(rev)
+            return entries
+
+    async def mark_persisted(self, note_id, rev, base_hash):
+        with self._lock:
+            state = self._docs.get(note_id)
+            if state is not None:
+                state['persisted_rev'], state['base_hash'] = rev, base_hash
+
+    async def drop(self, note_id):
+        with self._lock:
+            self._docs.pop(note_id, None)
+            self._history.pop(note_id, None)
+
+    async def lock(self, note_id):
+        with self._lock:
+            if note_id in self._flushing:
+                return None
+            self._flushing.add(note_id)
+            return True
+
+    async def unlock(self, note_id, token):
+        with self._lock:
+            self._flushing.discard(note_id)
+
+    async def set_presence(self, note_id, conn, info):
+        with self._lock:
+            self._presence.setdefault(note_id, {})[conn] = {**info, 'seen': time.time()}
+
+    async def remove_presence(self, note_id, conn):
+        with self._lock:
+            entries = self._presence.get(note_id, {})
+            entries.pop(conn, None)
+            if not entries:
+                self._presence.pop(note_id, None)
+
+    async def presence(self, note_id):
+        cutoff = time.time() - self.options['PRESENCE_TTL']
+        with self._lock:
+            entries = dict(self._presence.get(note_id, {}))
+        return [{'conn': conn, **info} for conn, info in entries.items() if info['seen'] >= cutoff]
+
+    async def publish(self, note_id, message):
+        self._fanout.deliver(note_id, message)
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, note_id):
+        queue, _ = self._fanout.add(note_id)
+        try:
+            yield queue
+        finally:
+            self._fanout.remove(note_id, queue)
+
+
+# KEYS[1]: 锁；ARGV[1]: 加锁时的令牌。只释放自己持有的锁
+_UNLOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisLayer:
+    """
+    Redis 频道层。每篇笔记使用以下键：
+    realtime:<id>:state（哈希：content, rev, persisted_rev, base_hash, editor）、realtime:<id>:history（操作列表）、
+    realtime:<id>:presence（哈希：连接 -> 在线信息）、realtime:<id>:flush（写回锁），以及 Pub/Sub 频道 realtime:<id>。
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self._fanout = _Fanout()
+        self._listeners = weakref.WeakKeyDictionary()  # 事件循环 -> (PubSub, 读取任务)
+
+    @staticmethod
+    def _key(note_id, suffix=None):
+        return f'realtime:{note_id}' + (f':{suffix}' if suffix else '')
+
+    @staticmethod
+    def _client():
+        return acache.get_client()
+
+    @staticmethod
+    def _decode_state(raw):
+        if not raw:
+            return None
+        state = {k.decode(): v.decode('utf-8') for k, v in raw.items()}
+        return {
+            'content': state.get('content', ''),
+            'rev': int(state.get('rev', 0)),
+            'persisted_rev': int(state.get('persisted_rev', 0)),
+            'base_hash': state.get('base_hash', ''),
+            'editor': int(state['editor']) if state.get('editor') else None,
+        }
+
+    async def load(self, note_id):
+        return self._decode_state(await self._client().hgetall(self._key(note_id, 'state')))
+
+    async def init(self, note_id, content):
+        key = self._key(note_id, 'state')
+
+        async def create(pipe):
+            if await pipe.exists(key):
+                pipe.multi()
+                return
+            state = _new_state(content)
+            pipe.multi()
+            pipe.hset(key, mapping={k: '' if v is None else v for k, v in state.items()})
+            pipe.expire(key, self.options['STATE_TTL'])
+
+        await self._client().transaction(create, key)
+        return await self.load(note_id)
+
+    async def submit(self, note_id, base_rev, op, origin, user_id):
+        key, history_key = self._key(note_id, 'state'), self._key(note_id, 'history')
+        ttl = self.options['STATE_TTL']
+
+        async def apply(pipe):
+            state = self._decode_state(await pipe.hgetall(key))
+            if state is None:
+                raise StaleRevision(base_rev)
+            behind = state['rev'] - base_rev
+            raw = await pipe.lrange(history_key, -behind, -1) if behind > 0 else []
+            rebased = _rebase(op, base_rev, state['rev'], [json.loads(item) for item in raw])
+            content = ot.apply(state['content'], rebased)
+            entry = {'rev': state['rev'] + 1, 'op': rebased, 'origin': origin, 'user': user_id}
+            pipe.multi()
+            pipe.hset(key, mapping={'content': content, 'rev': entry['rev'], 'editor': user_id or ''})
+            pipe.rpush(history_key, json.dumps(entry, ensure_ascii=False))
+            pipe.ltrim(history_key, -self.options['HISTORY'], -1)
+            pipe.expire(key, ttl)
+            pipe.expire(history_key, ttl)
+            return entry
+
+        return await self._client().transaction(apply, key, history_key, value_from_callable=True)
+
+    async def ops_since(self, note_id, rev):
+        client = self._client()
+        current = await client.hget(self._key(note_id, 'state'), 'rev')
+        if current is None:
+            raise StaleRevision(rev)
+        behind = int(current) - rev
+        if behind <= 0:
+            return []
+        entries = [json.loads(item) for item in await client.lrange(self._key(note_id, 'history'), -behind, -1)]
+        entries = [entry for entry in entries if entry['rev'] > rev]
+        if len(entries) < behind:
+            raise StaleRevision(rev)
+        return entries
+
+    async def mark_persisted(self, note_id, rev, base_hash):
+        key = self._key(note_id, 'state')
+        # 状态可能刚被 drop（写回期间持有锁，不会有别的进程重新写回），只更新仍然存在的状态
+        if await self._client().exists(key):
+            await self._client().hset(key, mapping={'persisted_rev': rev, 'base_hash': base_hash})
+
+    async def drop(self, note_id):
+        await self._client().delete(self._key(note_id, 'state'), self._key(note_id, 'history'))
+
+    async def lock(self, note_id):
+        token = uuid.uuid4().hex
+        # 写回最多持续这么久；进程崩溃时锁自动过期
+        if await self._client().set(self._key(note_id, 'flush'), token, nx=True, ex=60):
+            return token
+        return None
+
+    async def unlock(self, note_id, token):
+        await self._client().eval(_UNLOCK_LUA, 1, self._key(note_id, 'flush'), token)
+
+    async def set_presence(self, note_id, conn, info):
+        key = self._key(note_id, 'presence')
+        async with self._client().pipeline(transaction=False) as pipe:
+            pipe.hset(key, conn, json.dumps({**info, 'seen': time.time()}, ensure_ascii=False))
+            pipe.expire(key, self.options['PRESENCE_TTL'] * 2)
+            await pipe.execute()
+
+    async def remove_presence(self, note_id, conn):
+        await self._client().hdel(self._key(note_id, 'presence'), conn)
+
+    async def presence(self, note_id):
+        cutoff = time.time() - self.options['PRESENCE_TTL']
+        raw = await self._client().hgetall(self._key(note_id, 'presence'))
+        entries = [{'conn': conn.decode(), **json.loads(info)} for conn, info in raw.items()]
+        # 异常退出的进程没有机会删除自己的连接，按最后一次 ping 的时间过滤
+        return [entry for entry in entries if entry['seen'] >= cutoff]
+
+    async def publish(self, note_id, message):
+        await self._client().publish(self._key(note_id), json.dumps(message, ensure_ascii=False))
+
+    def _listener(self):
+        loop = asyncio.get_running_loop()
+        listener = self._listeners.get(loop)
+        if listener is None:
+            pubsub = self._client().pubsub(ignore_subscribe_messages=True)
+            listener = self._listeners[loop] = (pubsub, loop.create_task(self._read(pubsub)))
+        return listener[0]
+
+    async def _read(self, pubsub):
+        prefix = len(self._key(''))
+        while True:
+            try:
+                if not pubsub.subscribed:
+                    await asyncio.sleep(0.1)
+                    continue
+                message = await pubsub.get_message(timeout=1.0)
+                if message and message['type'] == 'message':
+                    note_id = int(message['channel'][prefix:])
+                    self._fanout.deliver(note_id, json.loads(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("实时协作 Pub/Sub 读取失败: %s", e)
+                await asyncio.sleep(1)
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, note_id):
+        pubsub = self._listener()
+        queue, first = self._fanout.add(note_id)
+        if first:
+            await pubsub.subscribe(self._key(note_id))
+        try:
+            yield queue
+        finally:
+            if self._fanout.remove(note_id, queue):
+                await pubsub.unsubscribe(self._key(note_id))
+
+
+_layer = None
+_layer_lock = threading.Lock()
+
+
+def get_layer():
+    global _layer
+    if _layer is None:
+        with _layer_lock:
+            if _layer is None:
+                options = get_options()
+                name = options['LAYER'] or ('redis' if acache.is_redis() else 'memory')
+                _layer = RedisLayer(options) if name == 'redis' else MemoryLayer(options)
+    return _layer
+
+
+# ---------------------------------
+#  写回数据库
+# ---------------------------------
+
+def _persist(note_id, content, base_hash, editor_id):
+    """
+    把协作文档写回 Note.content，返回新的正文哈希。
+    数据库中的正文已经不是协作开始（或上次写回）时的内容时抛出 VersionConflict。
+    只改了标题、公开状态等其他列不算冲突。
+    """
+    note = Note.objects.with_content().get(pk=note_id)
+    if content_hash(note.content) != base_hash:
+        raise VersionConflict(f'笔记 {note_id} 的正文已被其他途径修改')
+    note.content = content
+    note._revision_author = editor_id
+    note.save(update_fields=['content'])
+    return content_hash(content)
+
+
+async def flush(note_id):
+    """有未写回的操作时把协作文档写回数据库，返回是否写入。多个进程同时调用时只有一个会执行。"""
+    layer = get_layer()
+    token = await layer.lock(note_id)
+    if not token:
+        return False
+    try:
+        state = await layer.load(note_id)
+        if state is None or state['rev'] <= state['persisted_rev']:
+            return False
+        try:
+            base_hash = await sync_to_async(_persist)(note_id, state['content'], state['base_hash'], state['editor'])
+        except (VersionConflict, Note.DoesNotExist) as e:
+            # 以数据库为准：丢弃协作状态，让所有客户端重新加载
+            reason = 'conflict' if isinstance(e, VersionConflict) else 'deleted'
+            logger.info("笔记 %s 的协作状态被丢弃 (%s)", note_id, reason)
+            await layer.drop(note_id)
+            await layer.publish(note_id, {'type': 'reset', 'reason': reason})
+            return False
+        await layer.mark_persisted(note_id, state['rev'], base_hash)
+        return True
+    finally:
+        await layer.unlock(note_id, token)
+
+
+class _Flushers:
+    """本进程内有连接的笔记各有一个定时写回任务；最后一个连接断开时立即写回一次。"""
+
+    def __init__(self):
+        self._tasks = {}  # note_id -> [任务, 连接数]
+
+    def acquire(self, note_id):
+        entry = self._tasks.get(note_id)
+        if entry is None:
+            entry = self._tasks[note_id] = [asyncio.get_running_loop().create_task(self._run(note_id)), 0]
+        entry[1] += 1
+
+    async def release(self, note_id):
+        entry = self._tasks.get(note_id)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] > 0:
+            return
+        del self._tasks[note_id]
+        entry[0].cancel()
+        await flush(note_id)
+
+    @staticmethod
+    async def _run(note_id):
+        interval = get_options()['FLUSH_INTERVAL']
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await flush(note_id)
+            except Exception:
+                logger.exception("笔记 %s 的协作内容写回失败", note_id)
+
+
+_flushers = _Flushers()
+
+
+# ---------------------------------
+#  WebSocket 连接
+# ---------------------------------
+
+def _headers(scope):
+    return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+
+
+def _origin_allowed(headers, options):
+    """拒绝跨站页面发起的连接（浏览器会自动带上 Cookie）。非浏览器客户端没有 Origin 头。"""
+    origin = headers.get('origin')
+    if not origin:
+        return True
+    return urlsplit(origin).netloc == headers.get('host') or origin in options['ALLOWED_ORIGINS']
+
+
+def _load_user(session_key):
+    engine = import_module(settings.SESSION_ENGINE)
+    return get_user(SimpleNamespace(session=engine.SessionStore(session_key)))
+
+
+async def authenticate(scope):
+    """根据会话 Cookie 解析用户，与普通请求使用同一套会话。"""
+    cookie = SimpleCookie()
+    cookie.load(_headers(scope).get('cookie', ''))
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    return await sync_to_async(_load_user)(morsel.value if morsel else None)
+
+
+class NoteSocket:
+    """一个 WebSocket 连接。"""
+
+    def __init__(self, scope, receive, send, note_id):
+        self.scope, self.receive, self.send = scope, receive, send
+        self.note_id = note_id
+        self.conn = uuid.uuid4().hex[:12]
+        self.options = get_options()
+        self.layer = get_layer()
+        self.rev = 0
+        self.user = None
+        self.note = None
+        self.can_edit = False
+        self.info = {}
+
+    async def send_json(self, message):
+        await self.send({'type': 'websocket.send', 'text': json.dumps(message, ensure_ascii=False)})
+
+    async def close(self, code=1000):
+        await self.send({'type': 'websocket.close', 'code': code})
+
+    async def run(self):
+        event = await self.receive()
+        if event['type'] != 'websocket.connect':
+            return
+        note = await self._authorize()
+        if note is None:
+            return
+
+        await self.send({'type': 'websocket.accept'})
+        async with self.layer.subscribe(self.note_id) as queue:
+            # 先订阅再读取状态：读取之后产生的操作一定能从队列中收到
+            state = await self.layer.load(self.note_id)
+            if state is None:
+                state = await self.layer.init(self.note_id, await self._load_content())
+            self.rev = state['rev']
+            self.info = {'user': self.user.pk, 'username': self.user.get_username(), 'cursor': None}
+            await self.layer.set_presence(self.note_id, self.conn, self.info)
+            await self.layer.publish(self.note_id, {'type': 'presence', 'event': 'join', 'conn': self.conn,
+                                                    **self.info})
+            await self.send_json({
+                'type': 'init', 'rev': state['rev'], 'content': state['content'], 'title': note.title,
+                'conn': self.conn, 'can_edit': self.can_edit,
+                'presence': await self.layer.presence(self.note_id),
+            })
+            _flushers.acquire(self.note_id)
+            try:
+                await self._serve(queue)
+            finally:
+                await self.layer.remove_presence(self.note_id, self.conn)
+                await self.layer.publish(self.note_id, {'type': 'presence', 'event': 'leave', 'conn': self.conn,
+                                                        'user': self.user.pk})
+                await _flushers.release(self.note_id)
+
+    async def _authorize(self):
+        if not _origin_allowed(_headers(self.scope), self.options):
+            await self.close(CLOSE_FORBIDDEN)
+            return None
+        self.user = await authenticate(self.scope)
+        if not self.user.is_authenticated:
+            await self.close(CLOSE_FORBIDDEN)
+            return None
+        note = await Note.objects.only('id', 'title', 'project_id', 'author_id').filter(pk=self.note_id).afirst()
+        if note is None:
+            await self.close(CLOSE_NOT_FOUND)
+            return None
+        role = await permissions.anote_role(self.user, note)
+        if role is None:
+            await self.close(CLOSE_FORBIDDEN)
+            return None
+        self.note = note
+        self.can_edit = permissions.can_write(role)
+        return note
+
+    async def _recheck_role(self):
+        """重新解析当前用户的角色，更新 can_edit；不再是成员时抛出 AccessRevoked。"""
+        role = await permissions.anote_role(self.user, self.note)
+        if role is None:
+            raise AccessRevoked()
+        self.can_edit = permissions.can_write(role)
+
+    async def _load_content(self):
+        return await Note.objects.acontent_of(self.note_id) or ''
+
+    async def _serve(self, queue):
+        reader = asyncio.ensure_future(self._read_client())
+        writer = asyncio.ensure_future(self._forward(queue))
+        try:
+            done, _ = await asyncio.wait({reader, writer}, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in (reader, writer):
+                task.cancel()
+            await asyncio.gather(reader, writer, return_exceptions=True)
+
+    async def _read_client(self):
+        """处理客户端消息，直到连接断开。"""
+        while True:
+            try:
+                event = await asyncio.wait_for(self.receive(), self.options['PRESENCE_TTL'])
+            except asyncio.TimeoutError:
+                # 客户端每 20 秒 ping 一次，长时间没有消息说明连接已经失效
+                await self.close(CLOSE_IDLE)
+                return
+            if event['type'] == 'websocket.disconnect':
+                return
+            text = event.get('text')
+            if text is None and event.get('bytes') is not None:
+                text = event['bytes'].decode('utf-8', 'replace')
+            if not text or len(text) > self.options['MAX_MESSAGE']:
+                await self.send_json({'type': 'error', 'message': '消息为空或过大'})
+                continue
+            try:
+                message = json.loads(text)
+                await self._handle(message)
+            except StaleRevision:
+                await self._reset('stale')
+                return
+            except AccessRevoked:
+                await self._revoke()
+                return
+            except (ValueError, TypeError, KeyError) as e:
+                # OTError 是 ValueError 的子类
+                await self.send_json({'type': 'error', 'message': str(e) or '无效的消息'})
+
+    async def _handle(self, message):
+        kind = message.get('type')
+        if kind == 'op':
+            await self._recheck_role()
+            if not self.can_edit:
+                await self.send_json({'type': 'error', 'message': '您没有权限修改此笔记'})
+                return
+            op = ot.normalize(message['op'])
+            base_rev = message['rev']
+            if isinstance(base_rev, bool) or not isinstance(base_rev, int):
+                raise TypeError('rev 必须是整数')
+            entry = await self.layer.submit(self.note_id, base_rev, op, self.conn, self.user.pk)
+            # ack 也通过频道发给自己，保证与其他人的操作按版本号顺序到达
+            await self.layer.publish(self.note_id, {'type': 'op', **entry})
+        elif kind == 'presence':
+            await self._recheck_role()
+            self.info['cursor'] = message.get('cursor')
+            await self.layer.set_presence(self.note_id, self.conn, self.info)
+            await self.layer.publish(self.note_id, {'type': 'presence', 'event': 'update', 'conn': self.conn,
+                                                    **self.info})
+        elif kind == 'ping':
+            await self._recheck_role()
+            await self.layer.set_presence(self.note_id, self.conn, self.info)
+            await self.send_json({'type': 'pong'})
+        else:
+            raise ValueError(f'未知的消息类型: {kind!r}')
+
+    async def _forward(self, queue):
+        """把频道中的消息转发给客户端；操作按版本号顺序发送，缺失的（不同进程发布顺序不同）从历史中补齐。"""
+        while True:
+            message = await queue.get()
+            kind = message.get('type')
+            if kind in ('op', 'presence'):
+                # 不发送任何消息的客户端也不能在失去权限后继续收到笔记内容
+                try:
+                    await self._recheck_role()
+                except AccessRevoked:
+                    await self._revoke()
+                    return
+            if kind == 'op':
+                if message['rev'] <= self.rev:
+                    continue
+                entries = [message]
+                if message['rev'] > self.rev + 1:
+                    entries = await self.layer.ops_since(self.note_id, self.rev)
+                for entry in entries:
+                    if entry['rev'] != self.rev + 1:
+                        continue
+                    self.rev = entry['rev']
+                    if entry['origin'] == self.conn:
+                        await self.send_json({'type': 'ack', 'rev': entry['rev']})
+                    else:
+                        await self.send_json({'type': 'op', 'rev': entry['rev'], 'op': entry['op'],
+                                              'user': entry['user']})
+            elif kind == 'presence':
+                if message.get('conn') != self.conn:
+                    await self.send_json(message)
+            elif kind == 'reset':
+                await self._reset(message.get('reason'))
+                return
+
+    async def _revoke(self):
+        await self.send_json({'type': 'error', 'message': '您已没有权限访问此笔记'})
+        await self.close(CLOSE_FORBIDDEN)
+
+    async def _reset(self, reason):
+        await self.send_json({'type': 'reset', 'reason': reason})
+        await self.close(CLOSE_RESET)
+
+
+async def websocket_application(scope, receive, send):
+    """ASGI 应用：处理 websocket 类型的连接（见 Team_Project/asgi.py）。"""
+    match = PATH_RE.match(scope.get('path', ''))
+    if match is None:
+        await receive()
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+    await NoteSocket(scope, receive, send, int(match['note_id'])).run()
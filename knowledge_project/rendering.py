@@ -0,0 +1,90 @@
+# knowledge_project/rendering.py
+"""
+笔记内容的渲染管线。
+
+note_detail_api 原来直接返回 CKEditor 生成的原始 HTML，没有任何清洗，前端每次翻页都要重新解析。
+现在笔记保存时（signals.py）执行一次渲染：
+
+1. 按白名单清洗 HTML（utils/html.sanitize_html），同时给标题加锚点、生成目录；
+2. 抽取纯文本，供全文检索和字数统计使用；
+3. 按分页符和页面大小切分为 NoteChunk（paging.py），目录项记录所在页码。
+
+结果保存在 NoteRender 中；正文没有变化（按 SHA-256 判断）时跳过，只改标题不会重新解析。
+RENDERER_VERSION 在渲染规则变化时递增，旧版本的结果会在读取时或通过 rerender_notes 命令重新生成。
+"""
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+from .models import NoteRender
+from . import paging
+from .utils.html import count_words, extract_text, paginate_with_breaks, sanitize_html
+
+RENDERER_VERSION = 1
+SUMMARY_FIELDS = ('toc', 'word_count')  # 详情接口第一页附带的字段
+
+
+def source_hash(content):
+    return hashlib.sha256((content or '').encode('utf-8')).hexdigest()
+
+
+def _remember(note, render):
+    # 供同一次保存中的检索索引使用，避免再解析一遍 HTML（见 search.note_text）
+    note._rendered_text = render.text
+    return render
+
+
+def render_note(note, force=False):
+    """渲染笔记并保存结果，正文未变化且版本相同时直接返回已有结果。返回 NoteRender。"""
+    existing = NoteRender.objects.defer('html').filter(note_id=note.pk).first()
+    current = existing is not None and existing.version == RENDERER_VERSION
+    if not force and current and 'content' in note.get_deferred_fields():
+        # 正文没有被加载，本次保存不可能修改它
+        return _remember(note, existing)
+
+    content = note.content or ''
+    digest = source_hash(content)
+    if not force and current and existing.source_hash == digest:
+        return _remember(note, existing)
+
+    html, toc = sanitize_html(content)
+    pages = paginate_with_breaks(html, paging.CHARS_PER_PAGE)
+    for entry in toc:
+        # 目录项所在的页码，前端点击目录可以直接跳到对应页
+        anchor = f'id="{entry["id"]}"'
+        entry['page'] = next((i for i, page in enumerate(pages, start=1) if anchor in page), 1)
+    text = extract_text(html)
+
+    render = NoteRender(note_id=note.pk, version=RENDERER_VERSION, source_hash=digest, html=html,
+                        text=text, toc=toc, word_count=count_words(text))
+    with transaction.atomic():
+        render.save()
+        paging.save_pages(note, pages)
+    return _remember(note, render)
+
+
+def _render_query(note, fields):
+    query = NoteRender.objects.filter(note_id=note.pk)
+    if fields is not None:
+        # version 总是要读取，用来判断是否需要按新规则重新渲染
+        query = query.only('version', *fields)
+    return query
+
+
+def get_render(note, fields=None):
+    """
+    读取渲染结果；旧笔记或渲染器升级后第一次访问时补建。
+    【优化】fields 指定只需要的字段（例如 SUMMARY_FIELDS），不读取整篇清洗后的 HTML 和纯文本。
+    """
+    render = _render_query(note, fields).first()
+    if render is None or render.version != RENDERER_VERSION:
+        render = render_note(note, force=True)
+    return render
+
+
+async def aget_render(note, fields=None):
+    render = await _render_query(note, fields).afirst()
+    if render is None or render.version != RENDERER_VERSION:
+        render = await sync_to_async(render_note)(note, force=True)
+    return render
@@ -0,0 +1,296 @@
+# knowledge_project/revisions.py
+"""
+笔记历史版本。
+
+note_detail_api 的 PUT 原来直接覆盖 note.content，没有任何历史；而每次保存一份完整副本会让最大的表成倍增长。
+现在笔记保存后由 signals.py 调用 record() 记录一个版本：
+
+- 每隔 SNAPSHOT_INTERVAL 个版本保存一次完整快照（zlib 压缩）；
+- 其余版本只保存相对于上一个版本的差异：正文按 HTML 标签、单词和空白切分为词元，
+  差异是“复制上一版本的第 i..j 个词元 / 插入一段新文本”的操作序列，同样经过 zlib 压缩，
+  大小与改动成正比；差异比快照还大时（例如整篇替换）直接保存快照；
+- 读取第 N 个版本时，从不晚于 N 的最近一个快照开始依次应用差异，代价与到快照的距离成正比。
+
+视图可以设置 note._revision_author 记录修改者。compact_revisions 命令对旧版本抽稀（每天只保留最后一个），
+并重新编码保留下来的版本链。
+"""
+import difflib
+import hashlib
+import json
+import re
+import zlib
+from itertools import groupby
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import compression
+from .models import Note, NoteRevision
+
+SNAPSHOT_INTERVAL = 20
+COMPRESS_LEVEL = 6
+
+# HTML 标签、连续的非空白字符、连续的空白；最后的 '<' 兜住没有闭合的尖括号，保证词元拼接后与原文完全一致
+_TOKEN_RE = re.compile(r'<[^>]*>|[^<\s]+|\s+|<')
+
+
+class RevisionNotFound(LookupError):
+    pass
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text or '')
+
+
+def content_hash(content):
+    return hashlib.sha256((content or '').encode('utf-8')).hexdigest()
+
+
+# ---------------------------------
+#  差异的计算与应用
+# ---------------------------------
+
+def make_delta(old_tokens, new_tokens):
+    """
+    计算把 old_tokens 变成 new_tokens 的操作序列：[i, j] 表示复制旧词元 old_tokens[i:j]，字符串表示插入的文本。
+    编辑通常集中在一处，先去掉相同的首尾再交给 SequenceMatcher，长笔记上的小改动也很快。
+    """
+    prefix = 0
+    limit = min(len(old_tokens), len(new_tokens))
+    while prefix < limit and old_tokens[prefix] == new_tokens[prefix]:
+        prefix += 1
+    suffix = 0
+    while (suffix < limit - prefix
+           and old_tokens[len(old_tokens) - 1 - suffix] == new_tokens[len(new_tokens) - 1 - suffix]):
+        suffix += 1
+
+    ops = [[0, prefix]] if prefix else []
+    old_mid = old_tokens[prefix:len(old_tokens) - suffix]
+    new_mid = new_tokens[prefix:len(new_tokens) - suffix]
+    matcher = difflib.SequenceMatcher(None, old_mid, new_mid)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([prefix + i1, prefix + i2])
+        elif tag in ('replace', 'insert'):
+            ops.append(''.join(new_mid[j1:j2]))
+    if suffix:
+        ops.append([len(old_tokens) - suffix, len(old_tokens)])
+    return ops
+
+
+def apply_delta(old_tokens, ops):
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(old_tokens[op[0]:op[1]])
+    return ''.join(parts)
+
+
+def _encode_snapshot(content):
+    return zlib.compress((content or '').encode('utf-8'), COMPRESS_LEVEL)
+
+
+def _encode_delta(ops):
+    return zlib.compress(json.dumps(ops, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), COMPRESS_LEVEL)
+
+
+def _decode(revision):
+    raw = zlib.decompress(bytes(revision.data)).decode('utf-8')
+    return raw if revision.kind == NoteRevision.SNAPSHOT else json.loads(raw)
+
+
+def _encode(previous, content, chain_length):
+    """
+    返回 (kind, data)：previous 为上一个版本的正文（没有时为 None），chain_length 为上一个版本到其快照的版本数。
+    """
+    if previous is None or chain_length >= SNAPSHOT_INTERVAL:
+        return NoteRevision.SNAPSHOT, _encode_snapshot(content)
+    delta = _encode_delta(make_delta(tokenize(previous), tokenize(content)))
+    if len(delta) > len(content) // 4:
+        # 改动很大时比较一下，快照更小就直接存快照，之后的版本也从这里开始计算距离
+        snapshot = _encode_snapshot(content)
+        if len(snapshot) <= len(delta):
+            return NoteRevision.SNAPSHOT, snapshot
+    return NoteRevision.DELTA, delta
+
+
+# ---------------------------------
+#  读取
+# ---------------------------------
+
+def _chain(note_id, number):
+    """从不晚于 number 的最近一个快照到 number 的全部版本（按版本号升序）。"""
+    snapshot = (NoteRevision.objects.filter(note_id=note_id, number__lte=number, kind=NoteRevision.SNAPSHOT)
+                .order_by('-number').values_list('number', flat=True).first())
+    if snapshot is None:
+        raise RevisionNotFound(f'版本 {number} 不存在')
+    chain = list(NoteRevision.objects.filter(note_id=note_id, number__gte=snapshot, number__lte=number)
+                 .order_by('number').only('number', 'kind', 'data', 'title'))
+    if chain[-1].number != number:
+        raise RevisionNotFound(f'版本 {number} 不存在')
+    return chain
+
+
+def _replay(chain):
+    content = None
+    for revision in chain:
+        payload = _decode(revision)
+        content = payload if revision.kind == NoteRevision.SNAPSHOT else apply_delta(tokenize(content), payload)
+    return content
+
+
+def get_revision(note_id, number):
+    """返回第 number 个版本的 (标题, 正文)。"""
+    chain = _chain(note_id, number)
+    return chain[-1].title, _replay(chain)
+
+
+def latest_number(note_id):
+    return (NoteRevision.objects.filter(note_id=note_id).order_by('-number')
+            .values_list('number', flat=True).first())
+
+
+def list_revisions(note_id, limit=50, before=None):
+    """按版本号倒序返回版本列表（不含正文），before 为上一页最后一个版本号。"""
+    revisions = NoteRevision.objects.filter(note_id=note_id).order_by('-number')
+    if before:
+        revisions = revisions.filter(number__lt=before)
+    rows = list(revisions.values('number', 'title', 'kind', 'content_length', 'created_at',
+                                 'author_id', 'author__username')[:limit + 1])
+    return {
+        'results': [{
+            'number': row['number'],
+            'title': row['title'],
+            'size': row['content_length'],
+            'created_at': row['created_at'].isoformat(),
+            'author': {'id': row['author_id'], 'username': row['author__username']} if row['author_id'] else None,
+        } for row in rows[:limit]],
+        'next_cursor': str(rows[limit - 1]['number']) if len(rows) > limit else None,
+    }
+
+
+def diff(note_id, from_number, to_number):
+    """
+    比较两个版本的正文，返回 [{'op': 'equal'|'insert'|'delete', 'text': ...}]，相邻的同类片段已合并。
+    """
+    old_tokens = tokenize(get_revision(note_id, from_number)[1])
+    new_tokens = tokenize(get_revision(note_id, to_number)[1])
+    changes = []
+
+    def add(op, tokens):
+        text = ''.join(tokens)
+        if not text:
+            return
+        if changes and changes[-1]['op'] == op:
+            changes[-1]['text'] += text
+        else:
+            changes.append({'op': op, 'text': text})
+
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old_tokens, new_tokens).get_opcodes():
+        if tag == 'equal':
+            add('equal', old_tokens[i1:i2])
+        else:
+            add('delete', old_tokens[i1:i2])
+            add('insert', new_tokens[j1:j2])
+    return changes
+
+
+# ---------------------------------
+#  写入
+# ---------------------------------
+
+def _lock_note(note_id):
+    # 锁住笔记行，同一篇笔记的版本号分配串行进行
+    Note.objects.select_for_update().filter(pk=note_id).values_list('pk', flat=True).first()
+
+
+def ensure_baseline(note):
+    """
+    已有笔记在第一次修改之前还没有任何版本：先把数据库中的旧内容存为第 1 个版本（由 pre_save 信号调用）。
+    """
+    if note._state.adding or note.pk is None or NoteRevision.objects.filter(note_id=note.pk).exists():
+        return
+    row = (Note.objects.filter(pk=note.pk)
+           .values('title', 'content', 'content_blob', 'author_id', 'updated_at').first())
+    if row is None:
+        return
+    content = compression.load(row['content'], row['content_blob']) or ''
+    revision = NoteRevision(note_id=note.pk, number=1, kind=NoteRevision.SNAPSHOT, title=row['title'],
+                            data=_encode_snapshot(content), content_hash=content_hash(content),
+                            content_length=len(content), author_id=row['author_id'])
+    revision.save()
+    # 旧内容的时间是它最后一次修改的时间，而不是现在
+    NoteRevision.objects.filter(pk=revision.pk).update(created_at=row['updated_at'])
+
+
+def record(note, author=None):
+    """为笔记当前的标题和正文记录一个新版本；与最新版本相同时不记录。返回新版本或 None。"""
+    with transaction.atomic():
+        _lock_note(note.pk)
+        latest = (NoteRevision.objects.filter(note_id=note.pk).order_by('-number')
+                  .only('number', 'title', 'content_hash').first())
+        if latest is not None and latest.title == note.title and 'content' in note.get_deferred_fields():
+            return None  # 只改了其他字段（例如公开状态），正文没有被加载，不可能被修改
+
+        content = note.content or ''
+        digest = content_hash(content)
+        if latest is not None and latest.title == note.title and latest.content_hash == digest:
+            return None
+
+        previous, chain_length = None, 0
+        if latest is not None:
+            chain = _chain(note.pk, latest.number)
+            previous, chain_length = _replay(chain), len(chain)
+        kind, data = _encode(previous, content, chain_length)
+        return NoteRevision.objects.create(
+            note_id=note.pk, number=(latest.number if latest else 0) + 1, kind=kind, title=note.title,
+            data=data, content_hash=digest, content_length=len(content),
+            author_id=getattr(author, 'pk', author),
+        )
+
+
+def restore(note, number, author=None):
+    """把笔记恢复到第 number 个版本的标题和正文。恢复本身也会产生一个新版本，不会丢失当前内容。"""
+    title, content = get_revision(note.pk, number)
+    note.title, note.content = title, content
+    note._revision_author = author
+    note.save()
+    return note
+
+
+def compact(note_id, before, dry_run=False):
+    """
+    对创建时间早于 before 的版本抽稀：每天只保留最后一个版本，最新版本和 before 之后的版本全部保留。
+    保留下来的版本重新编码为新的快照/差异链，版本号不变。返回删除的版本数。
+    """
+    with transaction.atomic():
+        _lock_note(note_id)
+        revisions = list(NoteRevision.objects.filter(note_id=note_id).order_by('number'))
+        if not revisions:
+            return 0
+        keep = {revisions[-1].pk}
+        keep.update(r.pk for r in revisions if r.created_at >= before)
+        old = [r for r in revisions if r.created_at < before]
+        for _, day in groupby(old, key=lambda r: timezone.localdate(r.created_at)):
+            keep.add(list(day)[-1].pk)
+        dropped = [r.pk for r in revisions if r.pk not in keep]
+        if dry_run or not dropped:
+            return len(dropped)
+
+        # 按原来的链依次还原每个版本的正文，对保留下来的版本相对于上一个保留版本重新编码
+        content, previous, chain_length, changed = None, None, 0, []
+        for revision in revisions:
+            payload = _decode(revision)
+            content = payload if revision.kind == NoteRevision.SNAPSHOT else apply_delta(tokenize(content), payload)
+            if revision.pk not in keep:
+                continue
+            kind, data = _encode(previous, content, chain_length)
+            chain_length = 1 if kind == NoteRevision.SNAPSHOT else chain_length + 1
+            revision.kind, revision.data = kind, data
+            changed.append(revision)
+            previous = content
+        NoteRevision.objects.bulk_update(changed, ['kind', 'data'], batch_size=100)
+        NoteRevision.objects.filter(pk__in=dropped).delete()
+        return len(dropped)
@@ -0,0 +1,386 @@
+# knowledge_project/search.py
+"""
+笔记全文检索子系统。
+
+用一张倒排索引表 (NoteSearchToken) 代替 `content__icontains` 的全表 LIKE 扫描：
+- 标题和从 CKEditor HTML 中抽取出的正文被切分为词项（英文/数字按单词，中文同时索引单字和二元组）；
+- 笔记保存时重建该笔记的索引，删除时索引随外键级联删除；
+- 查询时只读取命中词项的索引行，按 TF-IDF 打分排序，并生成高亮摘要；
+- 【修改】单个汉字的查询命中一元组，较长的英文查询词按前缀匹配（`term LIKE 'abc%'` 可以走 (term, note) 索引）。
+  修改分词规则后需要执行一次 rebuild_search_index 重建已有笔记的索引。
+
+默认后端只依赖 Django ORM，在 SQLite（测试环境）和 MySQL 上行为一致，
+不需要 MySQL 的 FULLTEXT 索引。可以通过 settings.KNOWLEDGE_SEARCH_BACKEND 替换为其他实现。
+"""
+import math
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, IntegerField, Max, Q, Sum, Value, When
+from django.utils.html import escape
+from django.utils.module_loading import import_string
+
+from .models import Note, NoteSearchDocument, NoteSearchToken
+from .utils.html import extract_text
+from . import acache, visibility
+
+TITLE_BOOST = 5         # 标题中的词项权重是正文的 5 倍
+MAX_TERM_LENGTH = 64    # 与 NoteSearchToken.term 的 max_length 保持一致
+SNIPPET_LENGTH = 120    # 摘要的目标长度（字符数）
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MIN_PREFIX_LENGTH = 3          # 【新增】英文查询词至少 3 个字符才按前缀匹配，避免 "a%" 这类前缀展开出大量词项
+MAX_PREFIX_EXPANSIONS = 50     # 【新增】每个前缀最多展开为文档频率最高的 50 个词项
+PREFIX_MATCH_FACTOR = 0.5      # 【新增】前缀命中的得分打折，完整命中的笔记排在前面
+TOTAL_DOCS_CACHE_KEY = 'search:total_docs'
+TOTAL_DOCS_TIMEOUT = 300       # 【新增】文档总数只用于 IDF，允许几分钟的误差，不必每次查询都 COUNT(*)
+
+# 英文单词/数字，或者连续的中日韩文字
+_CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_TOKEN_RE = re.compile(f'[0-9a-z]+|[{_CJK_CHARS}]+')
+_CJK_RE = re.compile(f'[{_CJK_CHARS}]')
+
+
+def normalize(text):
+    """统一全角/半角和大小写，使索引和查询使用同一套规范化规则。"""
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def tokenize(text):
+    """
+    将文本切分为索引用的词项列表（保留重复，用于统计词频）。
+    - 英文和数字按连续字符切分为单词；
+    - 中文没有空格分词，按相邻两个字切分为二元组；
+    - 【修改】同时索引每个汉字的一元组，单字查询（如“库”）也能命中，不再只能匹配单字成段的文本。
+    """
+    terms = []
+    for match in _TOKEN_RE.finditer(normalize(text)):
+        run = match.group()
+        if _CJK_RE.match(run):
+            terms.extend(run)
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run[:MAX_TERM_LENGTH])
+    return terms
+
+
+def query_terms(query):
+    """
+    【新增】将查询切分为 [(词项, 是否前缀匹配)]，去重后按词项排序。
+    - 中文片段只有一个字时查一元组，否则查二元组（比一元组选择性高得多）；
+    - 英文/数字单词达到 MIN_PREFIX_LENGTH 时按前缀匹配，例如 "optim" 命中 optimize、optimization。
+    """
+    terms = {}
+    for match in _TOKEN_RE.finditer(normalize(query)):
+        run = match.group()
+        if _CJK_RE.match(run):
+            for term in (run,) if len(run) == 1 else (run[i:i + 2] for i in range(len(run) - 1)):
+                terms[term] = False
+        else:
+            term = run[:MAX_TERM_LENGTH]
+            terms[term] = len(term) >= MIN_PREFIX_LENGTH
+    return sorted(terms.items())
+
+
+def note_text(note):
+    """返回笔记正文的纯文本，用于索引和摘要。刚渲染过的笔记直接使用渲染管线抽取的文本。"""
+    rendered = getattr(note, '_rendered_text', None)
+    if rendered is not None:
+        return rendered
+    return extract_text(note.content)
+
+
+def visible_to(user, prefix=''):
+    """
+    构造“用户可见的笔记”过滤条件：笔记在用户参与的项目中，或没有项目且作者是用户本人。
+    prefix 用于从关联模型出发过滤，例如 prefix='note__'。
+    【优化】改为对 NoteVisibility 的半连接子查询，不再 JOIN 成员关系表，结果也无需 DISTINCT。
+    """
+    return Q(**{f'{prefix}id__in': visibility.visible_note_ids(user)})
+
+
+def highlight(text, query, length=SNIPPET_LENGTH):
+    """
+    从纯文本中截取包含查询词的一段，并用 <mark> 标记命中部分。
+    返回的字符串已经过 HTML 转义，可以直接插入页面。
+    """
+    if not text:
+        return ''
+    needles = [n for n in (normalize(part) for part in query.split()) if n]
+    haystack = normalize(text)
+    if len(haystack) != len(text):
+        # 极少数字符在 NFKC 规范化后长度会变化，此时位置无法对齐，退化为只做大小写匹配
+        haystack = text.lower()
+        needles = [n.lower() for n in query.split() if n]
+
+    first = min((pos for pos in (haystack.find(n) for n in needles) if pos >= 0), default=-1)
+    if first < 0:
+        # 查询词只以二元组的形式分散命中，没有连续出现，直接返回开头部分
+        snippet = text[:length]
+        return escape(snippet) + ('…' if len(text) > length else '')
+
+    start = max(first - length // 4, 0)
+    end = min(start + length, len(text))
+    window = haystack[start:end]
+
+    # 收集窗口内所有命中区间并合并重叠部分
+    spans = []
+    for needle in needles:
+        pos = window.find(needle)
+        while pos >= 0:
+            spans.append((pos, pos + len(needle)))
+            pos = window.find(needle, pos + len(needle))
+    spans.sort()
+    merged = []
+    for s, e in spans:
+        if merged and s <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+        else:
+            merged.append((s, e))
+
+    original = text[start:end]
+    parts, cursor = [], 0
+    for s, e in merged:
+        parts.append(escape(original[cursor:s]))
+        parts.append(f'<mark>{escape(original[s:e])}</mark>')
+        cursor = e
+    parts.append(escape(original[cursor:]))
+    return ('…' if start > 0 else '') + ''.join(parts) + ('…' if end < len(text) else '')
+
+
+class InvertedIndexBackend:
+    """
+    基于 NoteSearchDocument / NoteSearchToken 两张表的倒排索引后端。
+    纯 Python 分词 + 标准 ORM 查询，SQLite 和 MySQL 均可使用。
+    """
+
+    def build_entries(self, note):
+        """计算一篇笔记的检索文档和词项权重，不访问数据库。"""
+        text = note_text(note)
+        title_terms = Counter(tokenize(note.title))
+        content_terms = Counter(tokenize(text))
+        weights = Counter()
+        for term, tf in title_terms.items():
+            weights[term] += tf * TITLE_BOOST
+        for term, tf in content_terms.items():
+            weights[term] += tf
+        document = NoteSearchDocument(note_id=note.pk, text=text,
+                                      length=sum(title_terms.values()) + sum(content_terms.values()))
+        tokens = [NoteSearchToken(note_id=note.pk, term=term, weight=weight) for term, weight in weights.items()]
+        return document, tokens
+
+    def index_note(self, note):
+        """重建单篇笔记的索引。"""
+        self.index_notes([note])
+
+    def index_notes(self, notes, batch_size=1000):
+        """批量重建多篇笔记的索引（用于重建命令和基准测试）。"""
+        documents, tokens = [], []
+        for note in notes:
+            document, note_tokens = self.build_entries(note)
+            documents.append(document)
+            tokens.extend(note_tokens)
+        note_ids = [d.note_id for d in documents]
+        with transaction.atomic():
+            NoteSearchToken.objects.filter(note_id__in=note_ids).delete()
+            NoteSearchDocument.objects.filter(note_id__in=note_ids).delete()
+            NoteSearchDocument.objects.bulk_create(documents, batch_size=batch_size)
+            NoteSearchToken.objects.bulk_create(tokens, batch_size=batch_size)
+
+    def remove_note(self, note_id):
+        NoteSearchToken.objects.filter(note_id=note_id).delete()
+        NoteSearchDocument.objects.filter(note_id=note_id).delete()
+
+    def _doc_freq_query(self, terms):
+        """一次聚合查询得到全部候选词项（精确词项和前缀展开出的词项）的文档频率。"""
+        condition = Q(term__in=[t for t, prefix in terms if not prefix])
+        for term, prefix in terms:
+            if prefix:
+                condition |= Q(term__startswith=term)
+        return NoteSearchToken.objects.filter(condition).values_list('term').annotate(df=Count('note_id'))
+
+    @staticmethod
+    def _expand(terms, doc_freq):
+        """
+        【新增】把每个查询词展开为它在索引中对应的词项组；任何一组为空说明 AND 查询必然没有结果，返回 None。
+        前缀只保留文档频率最高的 MAX_PREFIX_EXPANSIONS 个词项。
+        """
+        groups = []
+        for term, prefix in terms:
+            if prefix:
+                group = sorted((t for t in doc_freq if t.startswith(term)), key=lambda t: (-doc_freq[t], t))
+                group = group[:MAX_PREFIX_EXPANSIONS]
+            else:
+                group = [term] if term in doc_freq else []
+            if not group:
+                return None
+            groups.append((term, group))
+        return groups
+
+    @staticmethod
+    def _match_query(groups, condition=Q(), **annotations):
+        """包含全部查询词的笔记，按 note_id 聚合；condition 是额外的过滤条件（例如可见性）。"""
+        expanded = sorted({t for _, group in groups for t in group})
+        # 每个查询词（词项组）在一篇笔记中命中与否记为 0/1，加起来等于查询词个数即满足 AND
+        matched = sum((Max(Case(When(term__in=group, then=Value(1)), default=Value(0), output_field=IntegerField()))
+                       for _, group in groups), Value(0))
+        return (NoteSearchToken.objects.filter(Q(term__in=expanded) & condition)
+                .values('note_id')
+                .annotate(matched=matched, **annotations)
+                .filter(matched=len(groups)))
+
+    def _score_query(self, user, groups, idf, limit, offset):
+        score = Sum(Case(
+            *[When(term=t, then=F('weight') * Value(idf[t])) for t in idf],
+            default=Value(0.0), output_field=FloatField(),
+        ))
+        return (self._match_query(groups, visible_to(user, prefix='note__'), score=score)
+                .order_by('-score', '-note_id')[offset:offset + limit + 1])
+
+    def note_ids(self, query):
+        """
+        【新增】包含查询中全部词项的笔记 ID（不排序、不做可见性过滤），返回可以用作子查询的 QuerySet。
+        供后台管理等已经有权限控制的地方按正文检索使用。
+        """
+        terms = query_terms(query)
+        groups = self._expand(terms, dict(self._doc_freq_query(terms))) if terms else None
+        if groups is None:
+            return NoteSearchToken.objects.none().values('note_id')
+        return self._match_query(groups).values('note_id')
+
+    @staticmethod
+    def _idf(groups, total_docs, doc_freq):
+        idf = {}
+        for term, group in groups:
+            for t in group:
+                value = math.log(1 + max(total_docs or 1, doc_freq[t]) / doc_freq[t])
+                idf[t] = max(idf.get(t, 0), value if t == term else value * PREFIX_MATCH_FACTOR)
+        return idf
+
+    @staticmethod
+    def _total_docs():
+        """【新增】索引中的文档总数，缓存 TOTAL_DOCS_TIMEOUT 秒，避免每次查询都对整张表 COUNT(*)。"""
+        total = cache.get(TOTAL_DOCS_CACHE_KEY)
+        if total is None:
+            total = NoteSearchDocument.objects.count()
+            cache.set(TOTAL_DOCS_CACHE_KEY, total, TOTAL_DOCS_TIMEOUT)
+        return total
+
+    @staticmethod
+    async def _atotal_docs():
+        total = await acache.aget(TOTAL_DOCS_CACHE_KEY)
+        if total is None:
+            total = await NoteSearchDocument.objects.acount()
+            await acache.aset(TOTAL_DOCS_CACHE_KEY, total, TOTAL_DOCS_TIMEOUT)
+        return total
+
+    @staticmethod
+    def _results(rows, titles, texts, query):
+        return [{
+            'id': r['note_id'],
+            'title': titles.get(r['note_id'], ''),
+            'snippet': highlight(texts.get(r['note_id'], ''), query),
+            'score': round(r['score'], 4),
+        } for r in rows]
+
+    def search(self, user, query, limit=DEFAULT_LIMIT, offset=0):
+        """
+        返回 (结果列表, 是否还有下一页)。
+        多个词项之间是 AND 关系：笔记必须包含查询中的全部词项。
+        """
+        terms = query_terms(query)
+        if not terms:
+            return [], False
+
+        # 1. 一次聚合查询得到每个词项的文档频率，用于计算 IDF
+        doc_freq = dict(self._doc_freq_query(terms))
+        groups = self._expand(terms, doc_freq)
+        if groups is None:
+            return [], False  # 有词项在整个索引中都不存在，AND 查询必然为空
+        idf = self._idf(groups, self._total_docs(), doc_freq)
+
+        # 2. 只扫描命中词项的索引行，按笔记聚合打分
+        rows = list(self._score_query(user, groups, idf, limit, offset))
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        # 3. 为当前页的结果补充标题和摘要
+        ids = [r['note_id'] for r in rows]
+        titles = dict(Note.objects.filter(pk__in=ids).values_list('id', 'title'))
+        texts = dict(NoteSearchDocument.objects.filter(note_id__in=ids).values_list('note_id', 'text'))
+        return self._results(rows, titles, texts, query), has_more
+
+    async def asearch(self, user, query, limit=DEFAULT_LIMIT, offset=0):
+        """search 的异步版本，查询相同，使用异步 ORM 执行。"""
+        terms = query_terms(query)
+        if not terms:
+            return [], False
+
+        doc_freq = {term: df async for term, df in self._doc_freq_query(terms)}
+        groups = self._expand(terms, doc_freq)
+        if groups is None:
+            return [], False
+        idf = self._idf(groups, await self._atotal_docs(), doc_freq)
+
+        rows = [row async for row in self._score_query(user, groups, idf, limit, offset)]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        ids = [r['note_id'] for r in rows]
+        titles = {pk: title async for pk, title in Note.objects.filter(pk__in=ids).values_list('id', 'title')}
+        texts = {pk: text async for pk, text in
+                 NoteSearchDocument.objects.filter(note_id__in=ids).values_list('note_id', 'text')}
+        return self._results(rows, titles, texts, query), has_more
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    backend_path = getattr(settings, 'KNOWLEDGE_SEARCH_BACKEND', 'knowledge_project.search.InvertedIndexBackend')
+    return import_string(backend_path)()
+
+
+def index_note(note):
+    get_backend().index_note(note)
+
+
+def remove_note(note_id):
+    get_backend().remove_note(note_id)
+
+
+def note_ids(query):
+    return get_backend().note_ids(query)
+
+
+def search_notes(user, query, limit=DEFAULT_LIMIT, cursor=None):
+    """
+    对外的检索入口。cursor 是上一页返回的 next_cursor（即结果偏移量）。
+    返回 {'results': [...], 'next_cursor': str | None}。
+    """
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    offset = max(int(cursor or 0), 0)
+    results, has_more = get_backend().search(user, query, limit=limit, offset=offset)
+    return {
+        'results': results,
+        'next_cursor': str(offset + limit) if has_more else None,
+    }
+
+
+async def asearch_notes(user, query, limit=DEFAULT_LIMIT, cursor=None):
+    """search_notes 的异步版本。没有实现 asearch 的自定义后端在线程中执行同步的 search。"""
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    offset = max(int(cursor or 0), 0)
+    backend = get_backend()
+    if hasattr(backend, 'asearch'):
+        results, has_more = await backend.asearch(user, query, limit=limit, offset=offset)
+    else:
+        results, has_more = await sync_to_async(backend.search)(user, query, limit=limit, offset=offset)
+    return {
+        'results': results,
+        'next_cursor': str(offset + limit) if has_more else None,
+    }
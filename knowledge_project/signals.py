@@ -1,32 +1,165 @@
 # In: knowledge_project/signals.py (Refactored Version)
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.db import transaction
+from django.db.backends.signals import connection_created
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 # 【核心修改】导入新的模型
-from .models import Project, ProjectMembership
+from .models import Asset, Project, ProjectMembership, Note, NoteTombstone
+from . import (assets, caching, permissions, profiling, provisioning, publishing, rendering, revisions, search,
+               thumbnails, visibility)
 
 @receiver(post_save, sender=User)
-def create_personal_project_for_new_user(sender, instance, created, **kwargs):
+def provision_new_user(sender, instance, created, raw=False, **kwargs):
     """
-    当一个新用户被创建时，自动为他创建一个个人项目，
-    并将他自己设为该项目的所有者。
+    【重构】新用户创建时，创建 Profile 和个人项目空间，并将他自己设为该项目的所有者。
+    原来 models.py 中的两个接收器和这里的一个重复创建、互相冲突，现在统一为这一个；
+    批量导入请使用 provisioning.provision_users()，它不经过逐行信号。
     """
-    if created:
-        # 1. 创建一个新的个人项目
-        personal_project = Project.objects.create(
-            # 项目的标题可以直接使用用户名，或者更友好一些
-            title=f"{instance.username}",
-            # 将新注册的用户设为这个项目的所有者
-            is_personal_inbox=True,
-            owner=instance
-        )
-
-        # 2. 在 ProjectMembership 中创建一条记录，明确该用户是所有者
-        #    这是必需的，因为 'owner' 字段只定义了所有权，
-        #    而 'members' 字段（通过ProjectMembership管理）才真正定义了谁可以访问。
-        ProjectMembership.objects.create(
-            user=instance,
-            project=personal_project,
-            role='owner' # 将用户在此项目中的角色设为 'owner'
-        )
\ No newline at end of file
+    if created and not raw:
+        provisioning.provision_user(instance)
+
+def _touches(update_fields, fields):
+    """save(update_fields=...) 只写了部分列时，判断是否涉及 fields；普通的 save() 视为全部涉及。"""
+    return update_fields is None or not fields.isdisjoint(update_fields)
+
+
+# 影响渲染结果、检索索引和历史版本的列
+CONTENT_FIELDS = frozenset({'title', 'content'})
+# 影响侧边栏列表的列
+SIDEBAR_FIELDS = frozenset({'title', 'project', 'author'})
+
+# --- 渲染与全文检索索引维护 ---
+
+@receiver(post_save, sender=Note)
+def render_and_index_note(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    【重构】笔记保存后先执行渲染管线（清洗、目录、分页块），再用渲染得到的纯文本重建倒排索引。
+    删除时渲染结果、分页块和索引行都随外键级联删除，无需额外处理。
+    只更新了其他列（例如公开状态）时跳过。
+    """
+    if raw or not _touches(update_fields, CONTENT_FIELDS):
+        return
+    rendering.render_note(instance)
+    search.index_note(instance)
+
+
+# --- 历史版本 ---
+
+@receiver(pre_save, sender=Note)
+def ensure_revision_baseline(sender, instance, raw=False, update_fields=None, **kwargs):
+    """功能上线前创建的笔记第一次被修改时，先把旧内容存为第一个版本。"""
+    if not raw and _touches(update_fields, CONTENT_FIELDS):
+        revisions.ensure_baseline(instance)
+
+
+@receiver(post_save, sender=Note)
+def record_note_revision(sender, instance, raw=False, update_fields=None, **kwargs):
+    """【新增】笔记保存后记录一个历史版本（压缩差异），修改者由视图通过 _revision_author 传入。"""
+    if not raw and _touches(update_fields, CONTENT_FIELDS):
+        revisions.record(instance, author=getattr(instance, '_revision_author', None))
+
+
+@receiver(post_save, sender=Note)
+@receiver(post_delete, sender=Note)
+def purge_public_note(sender, instance, **kwargs):
+    """笔记保存（包括取消公开）或删除后清除公开页面的缓存；必须在渲染之后执行，才不会缓存到旧内容。"""
+    publishing.purge(instance.public_id)
+
+
+# --- 侧边栏缓存版本维护 ---
+
+@receiver(post_init, sender=Note)
+def remember_note_scope(sender, instance, **kwargs):
+    """记录笔记加载时所属的项目和作者，用于在笔记被移动到其他项目时让原项目的列表也失效。"""
+    instance._loaded_project_id = instance.__dict__.get('project_id')
+    instance._loaded_author_id = instance.__dict__.get('author_id')
+
+
+def _note_scope(project_id, author_id):
+    return ('project', project_id) if project_id else ('inbox', author_id)
+
+
+@receiver(post_save, sender=Note)
+def sync_note_visibility(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    """【新增】新建的笔记，或所属项目、作者发生变化的笔记，重建它在 NoteVisibility 中的行。"""
+    if raw or not _touches(update_fields, SIDEBAR_FIELDS):
+        return
+    loaded = (instance._loaded_project_id, instance._loaded_author_id)
+    if created or loaded != (instance.project_id, instance.author_id):
+        visibility.index_note(instance)
+
+
+@receiver(post_save, sender=Note)
+def bump_sidebar_version_on_save(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if not _touches(update_fields, SIDEBAR_FIELDS):
+        return
+    caching.bump_note_scope(instance.project_id, instance.author_id)
+    loaded = (instance._loaded_project_id, instance._loaded_author_id)
+    if not created and _note_scope(*loaded) != _note_scope(instance.project_id, instance.author_id):
+        caching.bump_note_scope(*loaded)
+        if not raw:
+            # 笔记离开了原来的项目，对原项目的成员来说相当于被删除
+            NoteTombstone.objects.create(note_id=instance.pk, project_id=loaded[0], author_id=loaded[1])
+    instance._loaded_project_id, instance._loaded_author_id = instance.project_id, instance.author_id
+
+
+@receiver(post_delete, sender=Note)
+def bump_sidebar_version_on_delete(sender, instance, **kwargs):
+    caching.bump_note_scope(instance.project_id, instance.author_id)
+    NoteTombstone.objects.create(note_id=instance.pk, project_id=instance.project_id, author_id=instance.author_id)
+
+
+@receiver(post_save, sender=ProjectMembership)
+@receiver(post_delete, sender=ProjectMembership)
+def forget_user_projects(sender, instance, **kwargs):
+    """成员加入或退出项目后，该用户可见的项目集合发生变化。"""
+    caching.forget_user_projects(instance.user_id)
+
+
+@receiver(post_save, sender=ProjectMembership)
+def add_member_visibility(sender, instance, created=False, raw=False, **kwargs):
+    """【新增】成员加入项目后可以看到项目中的全部笔记；只修改角色时可见范围不变。"""
+    if created and not raw:
+        visibility.add_member(instance.user_id, instance.project_id)
+
+
+@receiver(post_delete, sender=ProjectMembership)
+def remove_member_visibility(sender, instance, **kwargs):
+    visibility.remove_member(instance.user_id, instance.project_id)
+
+
+# --- 角色缓存失效 ---
+
+@receiver(post_save, sender=ProjectMembership)
+@receiver(post_delete, sender=ProjectMembership)
+def invalidate_project_role(sender, instance, **kwargs):
+    """成员角色变化或被移出项目时，清除 (用户, 项目) 的角色缓存。"""
+    permissions.invalidate(instance.user_id, instance.project_id)
+
+
+# --- 资产文件引用计数 ---
+
+@receiver(post_save, sender=Asset)
+def attach_asset_blob(sender, instance, raw=False, **kwargs):
+    """资产保存后关联到内容寻址的 Blob，并维护引用计数。"""
+    if not raw:
+        assets.attach_blob(instance)
+        if thumbnails.is_image(instance):
+            # 事务提交后再交给进程池，工作进程读到的一定是已经落盘的文件
+            transaction.on_commit(lambda: thumbnails.schedule(instance))
+
+
+@receiver(post_delete, sender=Asset)
+def release_asset_blob(sender, instance, **kwargs):
+    """资产删除后减少 Blob 的引用计数；文件本身由 gc_blobs 命令回收。"""
+    assets.release_blob(instance.blob_id)
+
+
+# --- 性能剖析 ---
+
+@receiver(connection_created)
+def install_query_profiler(sender, connection, **kwargs):
+    """【新增】每个数据库连接都安装查询记录器，ProfilingMiddleware 据此统计每个请求的 SQL 条数和耗时。"""
+    profiling.install(connection)
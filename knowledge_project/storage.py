@@ -0,0 +1,122 @@
+# knowledge_project/storage.py
+"""
+内容寻址存储 (content-addressed storage)。
+
+Asset.file 原来按 uploads/user_<id>/<文件名> 保存：同一个 PDF 被上传到十个项目就存十份，
+文件名冲突时还会被追加随机后缀。现在文件按内容的 SHA-256 存放：
+
+    cas/ab/cd/abcd1234...<扩展名>
+
+- 上传时一边按块写入临时文件一边计算哈希，不会把整个文件读入内存；
+- 相同内容的文件只保存一次，重复上传只需要算一遍哈希；
+- 文件被哪些 Asset 引用由 Blob 模型记录（见 assets.py），孤立文件由 gc_blobs 命令清理。
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+CAS_PREFIX = 'cas'
+TMP_DIR = 'tmp'
+CHUNK_SIZE = 1024 * 1024
+
+_NAME_RE = re.compile(r'^cas/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.[A-Za-z0-9]{1,16})?$')
+
+
+def blob_name(digest, ext=''):
+    return f'{CAS_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def digest_from_name(name):
+    """从存储路径中取出 SHA-256；不是内容寻址路径（例如旧的 user_<id>/ 文件）时返回 None。"""
+    match = _NAME_RE.match(name or '')
+    return match.group(1) if match else None
+
+
+def _extension(name):
+    ext = os.path.splitext(name or '')[1].lower()
+    return ext if re.fullmatch(r'\.[a-z0-9]{1,16}', ext) else ''
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    保存时忽略传入的路径，只保留扩展名（便于按类型提供下载），实际路径由内容哈希决定。
+    与 FileSystemStorage 共用 MEDIA_ROOT / MEDIA_URL，旧文件仍然可以正常读取。
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # 路径由内容决定，同名即同内容，不需要追加随机后缀
+        return name
+
+    def mkstemp(self):
+        """在存储目录内创建临时文件（与最终位置在同一文件系统上，os.replace 是原子的），返回 (fd, 路径)。"""
+        tmp_dir = self.path(f'{CAS_PREFIX}/{TMP_DIR}')
+        os.makedirs(tmp_dir, exist_ok=True)
+        return tempfile.mkstemp(dir=tmp_dir)
+
+    def upload_dir(self, upload_id):
+        """分片上传的分片暂存目录。"""
+        return self.path(f'{CAS_PREFIX}/{TMP_DIR}/{upload_id}')
+
+    def _save(self, name, content):
+        sha256 = hashlib.sha256()
+        fd, tmp_path = self.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    sha256.update(chunk)
+                    tmp.write(chunk)
+            return self._commit(tmp_path, sha256.hexdigest(), _extension(name))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def save_hashed(self, tmp_path, digest, name=''):
+        """
+        把一个已经计算好哈希的临时文件移入存储（例如分片上传合并时，避免再读一遍），
+        name 只用于取扩展名。tmp_path 会被移动或删除。
+        """
+        try:
+            return self._commit(tmp_path, digest, _extension(name))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _commit(self, tmp_path, digest, ext):
+        name = blob_name(digest, ext)
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            # 已经有相同内容：丢弃临时文件，并刷新修改时间，避免正在进行的垃圾回收把它当成孤立文件
+            os.utime(full_path)
+            return name
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        os.replace(tmp_path, full_path)
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+    def iter_blob_names(self, prefix=CAS_PREFIX):
+        """遍历磁盘上所有内容寻址文件（或 prefix 目录下的派生文件），产出 (存储路径, 修改时间)。"""
+        root = self.path(prefix)
+        for dirpath, dirnames, filenames in os.walk(root):
+            if dirpath == root and TMP_DIR in dirnames:
+                dirnames.remove(TMP_DIR)
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                name = os.path.relpath(full_path, self.location).replace(os.sep, '/')
+                yield name, os.path.getmtime(full_path)
+
+    def iter_temp_files(self):
+        """遍历上传中断遗留的临时文件，产出 (绝对路径, 修改时间)。"""
+        tmp_dir = self.path(f'{CAS_PREFIX}/{TMP_DIR}')
+        if os.path.isdir(tmp_dir):
+            for entry in os.scandir(tmp_dir):
+                if entry.is_file():
+                    yield entry.path, entry.stat().st_mtime
+
+
+asset_storage = ContentAddressedStorage()
@@ -0,0 +1,199 @@
+# knowledge_project/sync.py
+"""
+侧边栏笔记列表的分页与增量同步。
+
+- 分页：按 (created_at, id) 做键集分页（keyset pagination），翻页代价与页码无关；
+- 增量：客户端保存上次同步返回的 sync_token，之后用 since=<token> 只拉取此后新建、改名或删除的笔记。
+
+sync_token 中包含签发时间和用户所属项目集合的指纹。
+用户加入或退出项目后可见范围整体变化，此时返回 reset=true，要求客户端重新全量同步。
+"""
+import base64
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .caching import aget_user_project_ids, get_user_project_ids
+from .models import NoteTombstone, NoteVisibility
+
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+# 单次增量超过这个数量时，让客户端直接全量同步更划算
+MAX_DELTA_SIZE = 1000
+# 墓碑保留时长；更早的 sync_token 无法保证拿到全部删除记录，只能全量同步
+TOMBSTONE_RETENTION = timedelta(days=30)
+# 事务提交存在延迟，增量查询的起点向前多取一小段时间，重复的记录对客户端是幂等的
+CLOCK_SKEW = timedelta(seconds=5)
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def _encode(payload):
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        return json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise InvalidToken('无效的同步令牌') from e
+
+
+def _fingerprint(project_ids):
+    joined = ','.join(str(pid) for pid in sorted(project_ids))
+    return hashlib.sha1(joined.encode()).hexdigest()[:12]
+
+
+def _visible_notes(user):
+    # 【优化】从可见性表出发：(user, created_at, note) 索引上的范围扫描，不需要 JOIN 成员关系表和 DISTINCT
+    return NoteVisibility.objects.filter(user=user).order_by('-created_at', '-note_id')
+
+
+def _serialize(row):
+    return {'id': row['note_id'], 'title': row['note__title'], 'created_at': row['created_at'].isoformat()}
+
+
+def _token(issued_at, project_ids):
+    return _encode({'t': issued_at.isoformat(), 'm': _fingerprint(project_ids)})
+
+
+def issue_token(user, issued_at=None):
+    """签发一个代表“截至此刻”的同步令牌。"""
+    return _token(issued_at or timezone.now(), get_user_project_ids(user))
+
+
+def _page_query(user, limit, cursor):
+    notes = _visible_notes(user)
+    if cursor:
+        position = _decode(cursor)
+        try:
+            created_at, note_id = datetime.fromisoformat(position['c']), int(position['i'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise InvalidToken('无效的分页游标') from e
+        notes = notes.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, note_id__lt=note_id))
+    # 多取一行用于判断是否还有下一页
+    return notes.values('note_id', 'note__title', 'created_at')[:limit + 1]
+
+
+def _page_result(rows, limit, sync_token):
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = _encode({'c': last['created_at'].isoformat(), 'i': last['note_id']})
+    return {
+        'results': [_serialize(row) for row in rows],
+        'next_cursor': next_cursor,
+        'sync_token': sync_token,
+    }
+
+
+def list_page(user, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """
+    返回一页笔记，按创建时间倒序。
+    cursor 是上一页返回的 next_cursor；第一页同时返回 sync_token，全量拉取完成后即可切换到增量模式。
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    issued_at = timezone.now()
+    project_ids = get_user_project_ids(user)
+    rows = list(_page_query(user, limit, cursor))
+    return _page_result(rows, limit, _token(issued_at, project_ids))
+
+
+def _parse_since(since):
+    payload = _decode(since)
+    try:
+        return datetime.fromisoformat(payload['t']), payload['m']
+    except (KeyError, TypeError, ValueError) as e:
+        raise InvalidToken('无效的同步令牌') from e
+
+
+def _needs_reset(fingerprint, since_at, issued_at, project_ids):
+    return fingerprint != _fingerprint(project_ids) or since_at < issued_at - TOMBSTONE_RETENTION
+
+
+def _reset(sync_token):
+    return {'changed': [], 'deleted': [], 'reset': True, 'sync_token': sync_token}
+
+
+def _changed_query(user, window_start):
+    return (_visible_notes(user).filter(note__updated_at__gte=window_start)
+            .values('note_id', 'note__title', 'created_at')[:MAX_DELTA_SIZE + 1])
+
+
+def _deleted_query(user, project_ids, window_start):
+    return (NoteTombstone.objects.filter(deleted_at__gte=window_start)
+            .filter(Q(project_id__in=project_ids) | Q(project_id__isnull=True, author_id=user.id))
+            .values_list('note_id', flat=True))
+
+
+def _delta_result(changed, deleted_ids, sync_token):
+    changed_ids = {row['note_id'] for row in changed}
+    return {
+        'changed': [_serialize(row) for row in changed],
+        'deleted': sorted(set(deleted_ids) - changed_ids),
+        'reset': False,
+        'sync_token': sync_token,
+    }
+
+
+def delta(user, since):
+    """
+    返回自 since 令牌签发以来的变化：
+    {'changed': [...], 'deleted': [id, ...], 'reset': bool, 'sync_token': str}
+    """
+    since_at, fingerprint = _parse_since(since)
+    issued_at = timezone.now()
+    project_ids = get_user_project_ids(user)
+    sync_token = _token(issued_at, project_ids)
+    if _needs_reset(fingerprint, since_at, issued_at, project_ids):
+        return _reset(sync_token)
+
+    window_start = since_at - CLOCK_SKEW
+    changed = list(_changed_query(user, window_start))
+    if len(changed) > MAX_DELTA_SIZE:
+        return _reset(sync_token)
+    return _delta_result(changed, _deleted_query(user, project_ids, window_start), sync_token)
+
+
+# ---------------------------------
+#  异步版本（异步视图使用）
+# ---------------------------------
+
+async def alist_page(user, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    issued_at = timezone.now()
+    project_ids = await aget_user_project_ids(user)
+    rows = [row async for row in _page_query(user, limit, cursor)]
+    return _page_result(rows, limit, _token(issued_at, project_ids))
+
+
+async def adelta(user, since):
+    since_at, fingerprint = _parse_since(since)
+    issued_at = timezone.now()
+    project_ids = await aget_user_project_ids(user)
+    sync_token = _token(issued_at, project_ids)
+    if _needs_reset(fingerprint, since_at, issued_at, project_ids):
+        return _reset(sync_token)
+
+    window_start = since_at - CLOCK_SKEW
+    changed = [row async for row in _changed_query(user, window_start)]
+    if len(changed) > MAX_DELTA_SIZE:
+        return _reset(sync_token)
+    deleted_ids = [note_id async for note_id in _deleted_query(user, project_ids, window_start)]
+    return _delta_result(changed, deleted_ids, sync_token)
+
+
+def purge_tombstones(now=None):
+    """删除超过保留期的墓碑记录，返回删除的条数。"""
+    now = now or timezone.now()
+    deleted, _ = NoteTombstone.objects.filter(deleted_at__lt=now - TOMBSTONE_RETENTION).delete()
+    return deleted
@@ -1,3 +1,1249 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import Future
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import Http404
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import admin as admin_module
+from . import (benchmark, caching, captcha, compression, downloads, mailqueue, ot, permissions, profiling,
+               provisioning, publishing, ratelimit, realtime, revisions, search, storage, sync, thumbnails, visibility)
+from .utils import html as html_utils, images as image_utils
+from Team_Project.asgi import application
+from .models import (Asset, Blob, EmailJob, Note, NoteRevision, NoteVisibility, Profile, Project, ProjectMembership,
+                     UploadSession, VersionConflict)
+
+
+class AdminChangelistQueryCountTests(TestCase):
+    """后台列表页的查询次数应当与行数无关。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # 使用 bulk_create 创建用户，不触发新用户的信号（个人空间等），只保留本测试需要的数据
+        User.objects.bulk_create([User(username='admin', is_staff=True, is_superuser=True)])
+        cls.admin = User.objects.get(username='admin')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def _add_projects(self, count, offset=0):
+        names = [f'user{offset + i}' for i in range(count)]
+        User.objects.bulk_create([User(username=name) for name in names])
+        for user in User.objects.filter(username__in=names):
+            project = Project.objects.create(title=f'{user.username} project')
+            ProjectMembership.objects.create(user=user, project=project, role='owner')
+            Note.objects.bulk_create([Note(title=f'{user.username} note', author=user, project=project)])
+
+    def _count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_project_changelist_query_count_is_constant(self):
+        url = reverse('admin:knowledge_project_project_changelist')
+        self._add_projects(2)
+        few = self._count_queries(url)
+        self._add_projects(20, offset=2)
+        self.assertEqual(self._count_queries(url), few)
+
+    def test_note_changelist_query_count_is_constant(self):
+        url = reverse('admin:knowledge_project_note_changelist')
+        self._add_projects(2)
+        few = self._count_queries(url)
+        self._add_projects(20, offset=2)
+        self.assertEqual(self._count_queries(url), few)
+
+    def test_note_search_uses_index_for_content(self):
+        url = reverse('admin:knowledge_project_note_changelist')
+        author = User.objects.create_user('writer', password='x')
+        plain = Note.objects.create(title='plain', content='<p>kubernetes rollout</p>', author=author)
+        packed = Note.objects.create(title='packed', content='<p>kubernetes ' + 'padding ' * 2000 + '</p>',
+                                     author=author)
+        Note.objects.create(title='other', content='<p>nothing relevant</p>', author=author)
+        self.assertTrue(Note.objects.filter(pk=packed.pk, content_blob__isnull=False).exists())
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, {'q': 'kubernetes'})
+        self.assertEqual({note.pk for note in response.context['cl'].result_list}, {plain.pk, packed.pk})
+        self.assertFalse([q for q in ctx.captured_queries if 'LIKE' in q['sql'] and '"content"' in q['sql']])
+        response = self.client.get(url, {'q': 'other'})
+        self.assertEqual([note.title for note in response.context['cl'].result_list], ['other'])
+
+    def test_email_job_page_hides_verification_code(self):
+        job = mailqueue.enqueue('注册验证码', '您的注册验证码是：482913。10分钟内有效。', ['a@example.com'], ttl=600)
+        response = self.client.get(reverse('admin:knowledge_project_emailjob_change', args=[job.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, '482913')
+        self.assertContains(response, '您的注册验证码是：******。10分钟内有效。')
+        self.assertNotContains(response, 'name="body"')
+
+    def _note_form_data(self, note):
+        response = self.client.get(reverse('admin:knowledge_project_note_change', args=[note.pk]))
+        self.assertContains(response, 'type="hidden" name="base_version"')
+        form = response.context['adminform'].form
+        self.assertEqual(form['base_version'].value(), Note.objects.get(pk=note.pk).version)
+        data = {name: form[name].value() for name in form.fields}
+        return {name: value for name, value in data.items() if value not in (None, False)}
+
+    def test_stale_note_form_reports_conflict(self):
+        note = Note.objects.create(title='draft', content='<p>v1</p>', author=self.admin)
+        url = reverse('admin:knowledge_project_note_change', args=[note.pk])
+        data = self._note_form_data(note)
+
+        other = Note.objects.with_content().get(pk=note.pk)
+        other.content = '<p>saved elsewhere</p>'
+        other.save()
+
+        response = self.client.post(url, {**data, 'content': '<p>stale edit</p>'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(admin_module.VERSION_CONFLICT_MESSAGE, response.context['adminform'].form.non_field_errors())
+        self.assertEqual(Note.objects.content_of(note.pk), '<p>saved elsewhere</p>')
+
+        data = self._note_form_data(note)
+        response = self.client.post(url, {**data, 'content': '<p>fresh edit</p>'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Note.objects.content_of(note.pk), '<p>fresh edit</p>')
+
+    def test_conflict_while_saving_is_not_a_server_error(self):
+        note = Note.objects.create(title='draft', content='<p>v1</p>', author=self.admin)
+        url = reverse('admin:knowledge_project_note_change', args=[note.pk])
+        data = self._note_form_data(note)
+        with mock.patch.object(Note, 'save', side_effect=VersionConflict(note.pk)):
+            response = self.client.post(url, {**data, 'content': '<p>edit</p>'}, follow=True)
+        self.assertRedirects(response, url)
+        self.assertIn(admin_module.VERSION_CONFLICT_MESSAGE, [str(m) for m in response.context['messages']])
+        self.assertEqual(Note.objects.content_of(note.pk), '<p>v1</p>')
+
+    def test_with_owner_returns_owner(self):
+        self._add_projects(3)
+        projects = list(Project.objects.with_owner())
+        with self.assertNumQueries(0):
+            owners = {project.title: project.owner.username for project in projects}
+        self.assertEqual(owners['user0 project'], 'user0')
+
+
+class ProvisioningTests(TestCase):
+    """批量开通与单个注册应当得到相同的数据，且重复运行不会重复创建。"""
+
+    def test_signal_provisions_single_user(self):
+        user = User.objects.create_user('alice', password='x')
+        self.assertTrue(Profile.objects.filter(user=user).exists())
+        memberships = ProjectMembership.objects.filter(user=user, role='owner', project__is_personal_space=True)
+        self.assertEqual(memberships.count(), 1)
+
+    def test_bulk_provisioning_is_idempotent(self):
+        rows = [{'username': f'bulk{i}', 'email': f'bulk{i}@example.com'} for i in range(25)]
+        rows.append({'username': ''})
+        stats = provisioning.provision_users(rows, batch_size=10)
+        self.assertEqual((stats['created'], stats['spaces'], len(stats['errors'])), (25, 25, 1))
+
+        # 模拟中断：删掉一部分个人空间后重新运行，只补齐缺失的部分；
+        # 同名但没有成员的旧空间不会被认领（覆盖不返回批量插入主键的数据库上按标题找回主键的分支）
+        Project.objects.filter(title__in=['bulk0的个人空间', 'bulk1的个人空间']).delete()
+        orphan = Project.objects.create(title='bulk0的个人空间', is_personal_space=True)
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert',
+                               new_callable=mock.PropertyMock, return_value=False):
+            stats = provisioning.provision_users(rows, batch_size=10)
+        self.assertEqual((stats['created'], stats['existing'], stats['spaces']), (0, 25, 2))
+        self.assertEqual(Profile.objects.filter(user__username__startswith='bulk').count(), 25)
+        self.assertEqual(Project.objects.filter(is_personal_space=True, title__startswith='bulk').count(), 26)
+        space = ProjectMembership.objects.get(user__username='bulk0', role='owner').project
+        self.assertEqual(space.title, 'bulk0的个人空间')
+        self.assertGreater(space.pk, orphan.pk)
+        self.assertFalse(orphan.memberships.exists())
+        self.assertFalse(User.objects.get(username='bulk3').has_usable_password())
+
+    def test_bulk_query_count_does_not_grow_with_batch(self):
+        with CaptureQueriesContext(connection) as ctx:
+            provisioning.provision_users([{'username': f'q{i}'} for i in range(50)], batch_size=50)
+        self.assertLess(len(ctx.captured_queries), 15)
+
+
+class AsyncNotesApiTests(TestCase):
+    """笔记 JSON 接口是 async def 视图，在异步客户端下与原来的同步版本返回相同的数据。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='x')
+        cls.note = Note.objects.create(title='Hello', content='<h2>A</h2><p>alpha beta</p>', author=cls.user)
+
+    def setUp(self):
+        self.async_client.force_login(self.user)
+
+    async def test_note_detail_first_page(self):
+        response = await self.async_client.get(reverse('api_note_detail', args=[self.note.pk]))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['pagination'], {'current_page': 1, 'total_pages': 1})
+        self.assertEqual([entry['text'] for entry in data['toc']], ['A'])
+
+    async def test_list_and_search(self):
+        response = await self.async_client.get(reverse('get_all_notes_api'))
+        self.assertIn('Hello', [note['title'] for note in response.json()])
+        response = await self.async_client.get(reverse('api_search_notes'), {'q': 'alpha'})
+        self.assertEqual([r['id'] for r in response.json()['results']], [self.note.pk])
+
+
+class SearchTests(TestCase):
+    """倒排索引检索：排序、AND 语义、可见性过滤、分页和摘要高亮。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='x')
+        cls.bob = User.objects.create_user('bob', password='x')
+
+    def setUp(self):
+        cache.delete(search.TOTAL_DOCS_CACHE_KEY)
+
+    def _ids(self, query, user=None, **kwargs):
+        return [r['id'] for r in search.search_notes(user or self.alice, query, **kwargs)['results']]
+
+    def _note(self, title, content, author=None):
+        return Note.objects.create(title=title, content=content, author=author or self.alice)
+
+    def test_title_match_ranks_first(self):
+        body = self._note('misc', '<p>the kafka consumer lags</p>')
+        title = self._note('kafka', '<p>notes</p>')
+        self.assertEqual(self._ids('kafka'), [title.pk, body.pk])
+
+    def test_terms_are_anded(self):
+        both = self._note('a', '<p>redis cluster setup</p>')
+        self._note('b', '<p>redis sentinel</p>')
+        self._note('c', '<p>cluster sizing</p>')
+        self.assertEqual(self._ids('redis cluster'), [both.pk])
+        self.assertEqual(self._ids('redis nosuchterm'), [])
+
+    def test_results_are_limited_to_visible_notes(self):
+        mine = self._note('a', '<p>quarterly budget</p>')
+        self._note('b', '<p>quarterly budget</p>', author=self.bob)
+        self.assertEqual(self._ids('budget'), [mine.pk])
+
+    def test_cursor_pages_through_results(self):
+        notes = [self._note(f'n{i}', '<p>paging</p>') for i in range(5)]
+        seen, cursor = [], None
+        while True:
+            page = search.search_notes(self.alice, 'paging', limit=2, cursor=cursor)
+            seen.extend(r['id'] for r in page['results'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(sorted(seen), sorted(note.pk for note in notes))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_single_cjk_character_and_english_prefix(self):
+        note = self._note('知识库', '<p>database optimization</p>')
+        self.assertEqual(self._ids('库'), [note.pk])
+        self.assertEqual(self._ids('知识'), [note.pk])
+        self.assertEqual(self._ids('optim'), [note.pk])
+        self.assertEqual(self._ids('op'), [])  # 太短的英文词不做前缀展开
+
+    def test_snippet_is_escaped_and_highlighted(self):
+        self._note('x', '<p>&lt;script&gt;alert(1)&lt;/script&gt; needle here</p>')
+        snippet = search.search_notes(self.alice, 'needle')['results'][0]['snippet']
+        self.assertIn('<mark>needle</mark>', snippet)
+        self.assertNotIn('<script>', snippet)
+        self.assertIn('&lt;script&gt;', snippet)
+
+    def test_total_docs_is_cached(self):
+        self._note('a', '<p>cached count</p>')
+        self._ids('cached')
+        with CaptureQueriesContext(connection) as ctx:
+            self._ids('cached')
+        self.assertFalse([q for q in ctx.captured_queries if 'COUNT(*)' in q['sql'] and 'searchdocument' in q['sql']])
+
+
+class SidebarCacheTests(TestCase):
+    """侧边栏列表按项目版本号缓存：一个成员的修改让其他成员的缓存失效，不需要逐个删除用户的缓存。"""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='x')
+        self.bob = User.objects.create_user('bob', password='x')
+        self.project = Project.objects.create(title='shared')
+        ProjectMembership.objects.create(user=self.alice, project=self.project, role='editor')
+        ProjectMembership.objects.create(user=self.bob, project=self.project, role='viewer')
+        self.note = Note.objects.create(title='draft', author=self.alice, project=self.project)
+
+    def test_member_save_invalidates_other_members_sidebar(self):
+        self.assertEqual([n['title'] for n in caching.get_sidebar_notes(self.bob)], ['draft'])
+        with self.assertNumQueries(0):
+            caching.get_sidebar_notes(self.bob)
+
+        with mock.patch.object(caching.cache, 'delete') as delete, \
+                mock.patch.object(caching.cache, 'delete_many') as delete_many:
+            self.note.title = 'final'
+            self.note.save()
+        deleted = [call.args[0] for call in delete.call_args_list]
+        deleted += [key for call in delete_many.call_args_list for key in call.args[0]]
+        self.assertFalse([key for key in deleted if 'user' in key or 'sidebar' in key], deleted)
+
+        # bob 的所属项目列表仍在缓存中，只有项目的笔记列表重新查询一次
+        with self.assertNumQueries(1):
+            self.assertEqual([n['title'] for n in caching.get_sidebar_notes(self.bob)], ['final'])
+        self.assertEqual([n['title'] for n in caching.get_sidebar_notes(self.alice)], ['final'])
+
+
+class NoteSyncApiTests(TestCase):
+    """get_all_notes_api 的键集分页和增量同步（sync.py）。"""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='x')
+        self.bob = User.objects.create_user('bob', password='x')
+        self.project = Project.objects.create(title='shared')
+        ProjectMembership.objects.create(user=self.alice, project=self.project, role='owner')
+        ProjectMembership.objects.create(user=self.bob, project=self.project, role='editor')
+        self.notes = [Note.objects.create(title=f'n{i}', author=self.alice, project=self.project) for i in range(5)]
+        # 让已有笔记落在增量窗口 (CLOCK_SKEW) 之外
+        Note.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        self.client.force_login(self.bob)
+
+    def _get(self, **params):
+        response = self.client.get(reverse('get_all_notes_api'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_keyset_pages_cover_all_notes_in_order(self):
+        ids, cursor = [], None
+        while True:
+            page = self._get(limit=2, **({'cursor': cursor} if cursor else {}))
+            self.assertLessEqual(len(page['results']), 2)
+            self.assertTrue(page['sync_token'])
+            ids.extend(row['id'] for row in page['results'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(ids, [note.pk for note in reversed(self.notes)])
+
+        response = self.client.get(reverse('get_all_notes_api'), {'limit': 2, 'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_since_returns_changes_and_tombstones(self):
+        token = self._get(limit=10)['sync_token']
+        self.assertEqual(self._get(since=token)['changed'], [])
+
+        renamed, deleted, moved = self.notes[:3]
+        renamed.title = 'renamed'
+        renamed.save()
+        created = Note.objects.create(title='new', author=self.alice, project=self.project)
+        deleted_id = deleted.pk
+        deleted.delete()
+        # 移到 bob 不在的项目，对 bob 来说相当于删除
+        moved.project = Project.objects.create(title='private')
+        moved.save()
+
+        data = self._get(since=token)
+        self.assertFalse(data['reset'])
+        self.assertEqual({row['id']: row['title'] for row in data['changed']},
+                         {renamed.pk: 'renamed', created.pk: 'new'})
+        self.assertEqual(set(data['deleted']), {deleted_id, moved.pk})
+        self.assertTrue(data['sync_token'])
+
+    def test_membership_change_or_expired_token_resets(self):
+        token = self._get(limit=10)['sync_token']
+        ProjectMembership.objects.create(user=self.bob, project=Project.objects.create(title='other'), role='viewer')
+        self.assertTrue(self._get(since=token)['reset'])
+
+        stale = sync.issue_token(self.bob, issued_at=timezone.now() - sync.TOMBSTONE_RETENTION - timedelta(days=1))
+        data = self._get(since=stale)
+        self.assertTrue(data['reset'])
+        self.assertFalse(self._get(since=data['sync_token'])['reset'])
+
+        response = self.client.get(reverse('get_all_notes_api'), {'since': '!!'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RoleCacheTests(TestCase):
+    """角色解析结果缓存在进程内和默认缓存两级，成员关系变化时两级都被信号清除。"""
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(permissions, '_local', {})
+        self.local = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.alice = User.objects.create_user('alice', password='x')
+        self.project = Project.objects.create(title='shared')
+        self.key = permissions._cache_key(self.alice.pk, self.project.pk)
+
+    def test_cache_hits_run_no_queries(self):
+        self.assertIsNone(permissions.get_role(self.alice, self.project.pk))
+        with self.assertNumQueries(0):
+            self.assertIsNone(permissions.get_role(self.alice, self.project.pk))  # 非成员的结果也被缓存
+        membership = ProjectMembership.objects.create(user=self.alice, project=self.project, role='viewer')
+        self.assertEqual(permissions.get_role(self.alice, self.project.pk), 'viewer')
+        with self.assertNumQueries(0):
+            self.assertEqual(permissions.get_role(self.alice, self.project.pk), 'viewer')
+            self.local.clear()  # 进程内缓存过期后由第二级缓存命中
+            self.assertEqual(permissions.get_role(self.alice, self.project.pk), 'viewer')
+        self.assertEqual(permissions.note_role(self.alice, Note(project=membership.project)), 'viewer')
+
+    def test_membership_signals_clear_both_levels(self):
+        membership = ProjectMembership.objects.create(user=self.alice, project=self.project, role='viewer')
+        self.assertEqual(permissions.get_role(self.alice, self.project.pk), 'viewer')
+        self.assertIn(self.key, self.local)
+        self.assertEqual(cache.get(self.key), 'viewer')
+
+        membership.role = 'editor'
+        membership.save()
+        self.assertNotIn(self.key, self.local)
+        self.assertIsNone(cache.get(self.key))
+        self.assertTrue(permissions.can_write(permissions.get_role(self.alice, self.project.pk)))
+
+        membership.delete()
+        self.assertNotIn(self.key, self.local)
+        self.assertIsNone(cache.get(self.key))
+        self.assertIsNone(permissions.get_role(self.alice, self.project.pk))
+
+
+class PublicNoteTests(TestCase):
+    """公开笔记页面：整页缓存、强 ETag 和 304，未公开返回 404，保存或取消公开后清除缓存。"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', password='x')
+        self.note = Note.objects.create(title='Public', content='<p>first version</p>', author=self.user,
+                                        is_public=True)
+        self.url = reverse('public_note_view', args=[self.note.public_id])
+
+    def test_etag_and_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'first version')
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertEqual(response['Cache-Control'], publishing.cache_control())
+        self.assertIn('s-maxage', response['Cache-Control'])
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_private_and_unknown_notes_are_404(self):
+        private = Note.objects.create(title='Private', content='<p>secret</p>', author=self.user)
+        self.assertEqual(self.client.get(reverse('public_note_view', args=[private.public_id])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('public_note_view', args=[uuid.uuid4()])).status_code, 404)
+
+    def test_save_and_unpublish_purge_cached_page(self):
+        etag = self.client.get(self.url)['ETag']
+        self.note.content = '<p>second version</p>'
+        self.note.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'second version')
+        self.assertNotEqual(response['ETag'], etag)
+
+        self.note.is_public = False
+        self.note.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class NoteRevisionTests(TestCase):
+    """小改动只存储差异，任意版本都能还原。"""
+
+    def test_small_edits_store_deltas(self):
+        user = User.objects.create_user('alice', password='x')
+        contents = [''.join(f'<p>line {i}</p>' for i in range(500))]
+        note = Note.objects.create(title='T', content=contents[0], author=user)
+        for i in range(revisions.SNAPSHOT_INTERVAL + 2):
+            contents.append(contents[-1].replace(f'line {i}<', f'line {i} edited<'))
+            note.content = contents[-1]
+            note.save()
+
+        stored = list(NoteRevision.objects.filter(note=note).order_by('number'))
+        self.assertEqual(len(stored), len(contents))
+        self.assertEqual([r.kind for r in stored].count(NoteRevision.SNAPSHOT), 2)
+        self.assertLess(max(len(bytes(r.data)) for r in stored if r.kind == NoteRevision.DELTA), 100)
+        for revision in stored:
+            self.assertEqual(revisions.get_revision(note.pk, revision.number)[1], contents[revision.number - 1])
+
+
+class NoteConcurrencyTests(TestCase):
+    """基于旧版本的保存不能覆盖其他人的修改。"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='x')
+        self.note = Note.objects.create(title='T', content='<p>a</p>', author=self.user)
+
+    def test_stale_instance_raises_conflict(self):
+        first, second = Note.objects.get(pk=self.note.pk), Note.objects.get(pk=self.note.pk)
+        first.title = 'first'
+        first.save()
+        second.title = 'second'
+        # 与 IntegrityError 一样，冲突会让外层事务不可用，所以放在单独的 atomic 块中
+        with self.assertRaises(VersionConflict), transaction.atomic():
+            second.save()
+        self.assertEqual(Note.objects.get(pk=self.note.pk).title, 'first')
+
+    def test_put_with_stale_if_match_returns_server_copy(self):
+        self.client.force_login(self.user)
+        url = reverse('api_note_detail', args=[self.note.pk])
+        response = self.client.put(url, '{"title": "new"}', content_type='application/json', HTTP_IF_MATCH='"1"')
+        self.assertEqual((response.status_code, response['ETag']), (200, '"2"'))
+        response = self.client.put(url, '{"title": "lost"}', content_type='application/json', HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['server']['title'], 'new')
+
+    def test_content_write_requires_precondition(self):
+        self.client.force_login(self.user)
+        url = reverse('api_note_detail', args=[self.note.pk])
+        response = self.client.put(url, '{"content": "<p>b</p>"}', content_type='application/json')
+        self.assertEqual(response.status_code, 428)
+        response = self.client.put(url, '{"content": "<p>b</p>", "version": 1}', content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Note.objects.content_of(self.note.pk), '<p>b</p>')
+
+
+class RealtimeEditingTests(TestCase):
+    """两个连接基于同一版本的并发操作被变换后按相同顺序应用，最后一个连接断开时写回数据库。"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='x')
+        self.note = Note.objects.create(title='T', content='hello world', author=self.user)
+        self.client.force_login(self.user)
+        # 每个测试使用独立的频道层：回滚后笔记主键会被复用，不能读到上一个测试留下的协作状态
+        patcher = mock.patch.object(realtime, '_layer', realtime.MemoryLayer(realtime.get_options()))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cookie = f'sessionid={self.client.cookies["sessionid"].value}'.encode()
+
+    def _connect(self, cookie=None):
+        scope = {'type': 'websocket', 'path': f'/ws/notes/{self.note.pk}/',
+                 'headers': [(b'host', b'testserver'), (b'cookie', cookie or self.cookie)]}
+        incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+        task = asyncio.ensure_future(application(scope, incoming.get, outgoing.put))
+        incoming.put_nowait({'type': 'websocket.connect'})
+
+        async def recv(kind):
+            while True:
+                event = await asyncio.wait_for(outgoing.get(), 5)
+                message = json.loads(event['text']) if event['type'] == 'websocket.send' else event
+                if message['type'] == kind:
+                    return message
+
+        async def send(message):
+            await incoming.put({'type': 'websocket.receive', 'text': json.dumps(message)})
+        return task, incoming, send, recv
+
+    async def test_concurrent_ops_converge_and_persist(self):
+        task_a, incoming_a, send_a, recv_a = self._connect()
+        task_b, incoming_b, send_b, recv_b = self._connect()
+        self.assertEqual((await recv_a('init'))['content'], 'hello world')
+        await recv_b('init')
+        await send_a({'type': 'op', 'rev': 0, 'op': [5, ' big', 6]})
+        await send_b({'type': 'op', 'rev': 0, 'op': [11, '!']})
+
+        # a 的操作先到达服务器：a 收到的是变换后的 b 的操作，b 需要用自己还没确认的操作变换 a 的操作
+        self.assertEqual((await recv_a('ack'))['rev'], 1)
+        self.assertEqual(ot.apply('hello big world', (await recv_a('op'))['op']), 'hello big world!')
+        remote = await recv_b('op')
+        self.assertEqual(ot.apply('hello world!', ot.transform([11, '!'], remote['op'])[1]), 'hello big world!')
+        self.assertEqual((await recv_b('ack'))['rev'], 2)
+
+        for incoming, task in ((incoming_a, task_a), (incoming_b, task_b)):
+            await incoming.put({'type': 'websocket.disconnect', 'code': 1000})
+            await asyncio.wait_for(task, 5)
+        self.assertEqual(await Note.objects.acontent_of(self.note.pk), 'hello big world!')
+
+    async def test_role_changes_apply_to_open_connections(self):
+        bob = await sync_to_async(User.objects.create_user)('bob', password='x')
+        bob_client = Client()  # 同一个客户端登录另一个用户会清空 alice 的会话
+        await sync_to_async(bob_client.force_login)(bob)
+        bob_cookie = f'sessionid={bob_client.cookies["sessionid"].value}'.encode()
+        project = await Project.objects.acreate(title='P')
+        membership = await ProjectMembership.objects.acreate(user=self.user, project=project, role='editor')
+        await ProjectMembership.objects.acreate(user=bob, project=project, role='editor')
+        await Note.objects.filter(pk=self.note.pk).aupdate(project=project)
+        task, incoming, send, recv = self._connect()
+        task_b, incoming_b, send_b, recv_b = self._connect(bob_cookie)
+        self.assertTrue((await recv('init'))['can_edit'])
+        await recv_b('init')
+
+        # 降为查看者：之后的操作被拒绝，连接保持
+        membership.role = 'viewer'
+        await sync_to_async(membership.save)()
+        await send({'type': 'op', 'rev': 0, 'op': [11, '!']})
+        self.assertEqual((await recv('error'))['message'], '您没有权限修改此笔记')
+
+        # 移出项目：即使客户端什么也不发送，转发下一条消息之前连接就会被关闭，收不到 bob 的修改
+        await sync_to_async(membership.delete)()
+        await send_b({'type': 'op', 'rev': 0, 'op': [11, '!']})
+        self.assertEqual((await recv('error'))['message'], '您已没有权限访问此笔记')
+        self.assertEqual((await recv('websocket.close'))['code'], 4403)
+        self.assertEqual((await recv_b('ack'))['rev'], 1)
+        for incoming_queue, connection_task in ((incoming, task), (incoming_b, task_b)):
+            await incoming_queue.put({'type': 'websocket.disconnect', 'code': 1000})
+            await asyncio.wait_for(connection_task, 5)
+        self.assertEqual(await Note.objects.acontent_of(self.note.pk), 'hello world!')
+
+    @override_settings(KNOWLEDGE_REALTIME={'PRESENCE_TTL': 0.2})
+    async def test_idle_connection_is_closed(self):
+        task, incoming, send, recv = self._connect()
+        await recv('init')
+        self.assertEqual((await recv('websocket.close'))['code'], 4408)
+        await asyncio.wait_for(task, 5)
+
+
+class ProfilingMiddlewareTests(TestCase):
+    """每个响应带 Server-Timing，查询条数与 CaptureQueriesContext 看到的一致，并计入 /metrics/。"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='x', is_staff=True)
+        self.client.force_login(self.user)
+        profiling.registry.reset()
+
+    def test_server_timing_and_metrics(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('knowledge_list'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn(f'desc="{len(ctx.captured_queries)} queries"', response['Server-Timing'])
+        self.assertIn('render;dur=', response['Server-Timing'])
+
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('knowledge_requests_total{view="knowledge_list",method="GET",status="200"} 1', metrics)
+        self.assertIn('knowledge_request_queries_count{view="knowledge_list"} 1', metrics)
+        self.assertEqual(self.client_class().get(reverse('metrics')).status_code, 403)
+
+
+class BenchmarkTests(TestCase):
+    """基准场景能在生成的数据上跑通，基线比较能发现查询数的增加。"""
+
+    def test_scenarios_run_and_compare(self):
+        benchmark.generate('tiny', seed=1)
+        runner = benchmark.Runner(benchmark.load_context(seed=1), seed=1)
+        summary = benchmark.summarize(runner.run(iterations=2, warmup=1))
+        self.assertEqual(set(summary), set(benchmark.SCENARIOS))
+        self.assertEqual(benchmark.compare(summary, {'scenarios': summary}), [])
+
+        worse = {name: {**row, 'queries': row['queries'] + 1} for name, row in summary.items()}
+        self.assertEqual(len(benchmark.compare(worse, {'scenarios': summary})), len(summary))
+
+
+class NoteVisibilityTests(TestCase):
+    """可见性表随笔记和成员关系变化而维护，与重建的结果一致。"""
+
+    def _visible(self, user):
+        return set(NoteVisibility.objects.filter(user=user).values_list('note_id', flat=True))
+
+    def test_signals_match_rebuild(self):
+        alice = User.objects.create_user('alice', password='x')
+        bob = User.objects.create_user('bob', password='x')
+        project = Project.objects.create(title='shared')
+        ProjectMembership.objects.create(user=alice, project=project, role='owner')
+        shared = Note.objects.create(title='shared', author=alice, project=project)
+        inbox = Note.objects.create(title='inbox', author=alice)
+        self.assertEqual(self._visible(alice), {shared.pk, inbox.pk})
+
+        membership = ProjectMembership.objects.create(user=bob, project=project, role='viewer')
+        self.assertEqual(self._visible(bob), {shared.pk})
+        inbox.project = project
+        inbox.save()
+        self.assertEqual(self._visible(bob), {shared.pk, inbox.pk})
+        membership.delete()
+        self.assertEqual(self._visible(bob), set())
+
+        before = set(NoteVisibility.objects.values_list('user_id', 'note_id'))
+        visibility.rebuild()
+        self.assertEqual(set(NoteVisibility.objects.values_list('user_id', 'note_id')), before)
+
+    def test_sync_pages_follow_visibility(self):
+        alice = User.objects.create_user('alice', password='x')
+        notes = [Note.objects.create(title=f'n{i}', author=alice) for i in range(5)]
+        page = sync.list_page(alice, limit=3)
+        rest = sync.list_page(alice, limit=3, cursor=page['next_cursor'])
+        ids = [row['id'] for row in page['results'] + rest['results']]
+        self.assertEqual(sorted(ids), sorted(note.pk for note in notes))
+        self.assertIsNone(rest['next_cursor'])
+
+
+class NoteCompressionTests(TestCase):
+    """超过阈值的正文压缩存储，读取时透明还原；转换命令可以往返。"""
+
+    def test_large_content_round_trip(self):
+        user = User.objects.create_user('alice', password='x')
+        content = ''.join(f'<tr><td style="border:1px solid #ccc">{i}</td></tr>' for i in range(500))
+        note = Note.objects.create(title='T', content=content, author=user)
+        small = Note.objects.create(title='S', content='<p>short</p>', author=user)
+
+        stored = Note.objects.filter(pk=note.pk).values('content', 'content_blob').get()
+        self.assertIsNone(stored['content'])
+        self.assertLess(len(bytes(stored['content_blob'])), len(content) // 10)
+        self.assertEqual(Note.objects.get(pk=note.pk).content, content)
+        self.assertEqual(Note.objects.get(pk=small.pk).content, '<p>short</p>')
+
+        # 只改标题时正文保持不变
+        loaded = Note.objects.defer('content', 'content_blob').get(pk=note.pk)
+        loaded.title = 'T2'
+        loaded.save()
+        self.assertEqual(Note.objects.get(pk=note.pk).content, content)
+
+        compression.convert(inline=True)
+        self.assertEqual(Note.objects.filter(pk=note.pk).values_list('content', flat=True).get(), content)
+        compression.convert()
+        self.assertIsNone(Note.objects.filter(pk=note.pk).values_list('content', flat=True).get())
+        self.assertEqual(Note.objects.get(pk=note.pk).content, content)
+
+
+class NoteDeferredContentTests(TestCase):
+    """Note.objects 默认不读取正文，with_content() / content_slice() 显式读取。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='x')
+        cls.short = Note.objects.create(title='S', content='<p>hello world</p>', author=cls.user)
+        cls.long = Note.objects.create(title='L', content='<p>' + '表格' * 5000 + '</p>', author=cls.user)
+
+    def test_content_is_deferred_by_default(self):
+        self.assertEqual(Note.objects.get(pk=self.short.pk).get_deferred_fields(), {'content', 'content_blob'})
+        self.assertEqual(Note.objects.with_content().get(pk=self.short.pk).get_deferred_fields(), set())
+        self.assertEqual(Note.objects.content_of(self.long.pk), self.long.content)
+
+    def test_content_slice_covers_compressed_rows(self):
+        with self.assertNumQueries(1):
+            notes = {note.pk: note for note in Note.objects.content_slice(3, 5)}
+            self.assertEqual((notes[self.short.pk].content_slice, notes[self.short.pk].content_length),
+                             ('hello', 18))
+            self.assertEqual((notes[self.long.pk].content_slice, notes[self.long.pk].content_length),
+                             ('表格表格表', 10007))
+
+    def test_forbidden_note_detail_does_not_read_content(self):
+        bob = User.objects.create_user('bob', password='x')
+        self.client.force_login(bob)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('api_note_detail', args=[self.long.pk]))
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(any('"content' in query['sql'] for query in ctx.captured_queries))
+
+    def test_first_page_reads_render_summary_only(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('api_note_detail', args=[self.long.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('word_count', response.json())
+        render_queries = [q['sql'] for q in ctx.captured_queries if 'noterender' in q['sql']]
+        self.assertEqual(len(render_queries), 1)
+        self.assertNotIn('"html"', render_queries[0])
+        self.assertNotIn('"text"', render_queries[0])
+
+
+def use_temp_media_root(test):
+    """测试期间把 MEDIA_ROOT 指向临时目录，结束后删除。"""
+    media_root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+    override = override_settings(MEDIA_ROOT=media_root)
+    override.enable()
+    test.addCleanup(override.disable)
+
+
+class AssetDownloadTests(TestCase):
+    """资产下载：成员检查、Range、条件请求；DEBUG 的 MEDIA_URL 路由不能绕过这些检查。"""
+
+    def setUp(self):
+        use_temp_media_root(self)
+        self.data = bytes(range(256)) * 4  # 1024 字节
+        self.member = User.objects.create_user('alice', password='x')
+        self.outsider = User.objects.create_user('bob', password='x')
+        project = Project.objects.create(title='P')
+        ProjectMembership.objects.create(user=self.member, project=project, role='viewer')
+        self.asset = Asset.objects.create(project=project, uploader=self.member, name='data.bin',
+                                          file=SimpleUploadedFile('data.bin', self.data))
+        self.url = reverse('asset_download', args=[self.asset.pk])
+        self.client.force_login(self.member)
+
+    def _body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-99')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 0-99/1024')
+        self.assertEqual(self._body(response), self.data[:100])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-100')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 924-1023/1024')
+        self.assertEqual(self._body(response), self.data[-100:])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_if_none_match(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._body(response), self.data)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_active_content_is_downloaded_not_rendered(self):
+        for name in ('page.html', 'logo.svg'):
+            asset = Asset.objects.create(project=self.asset.project, uploader=self.member, name=name,
+                                         file=SimpleUploadedFile(name, b'<script>alert(1)</script>'))
+            response = self.client.get(reverse('asset_download', args=[asset.pk]))
+            self.assertEqual(response['Content-Type'], 'application/octet-stream')
+            self.assertTrue(response['Content-Disposition'].startswith('attachment'))
+            self.assertEqual(response['Content-Security-Policy'], 'sandbox')
+
+        # 安全的类型仍然可以直接打开
+        pdf = Asset.objects.create(project=self.asset.project, uploader=self.member, name='a.pdf',
+                                   file=SimpleUploadedFile('a.pdf', b'%PDF-1.4'))
+        response = self.client.get(reverse('asset_download', args=[pdf.pk]))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response['Content-Disposition'].startswith('inline'))
+
+    def test_non_member_is_forbidden(self):
+        self.client.force_login(self.outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_media_route_does_not_serve_assets(self):
+        factory = RequestFactory()
+        name = self.asset.file.name
+        self.assertTrue(name.startswith('cas/'))
+        with self.assertRaises(Http404):
+            downloads.serve_public_media(factory.get('/uploads/' + name), name)
+        with self.assertRaises(Http404):
+            downloads.serve_public_media(factory.get('/uploads/x'), 'public/../' + name)
+
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'public'))
+        with open(os.path.join(settings.MEDIA_ROOT, 'public', 'a.txt'), 'w') as f:
+            f.write('ok')
+        self.assertEqual(downloads.serve_public_media(factory.get('/uploads/public/a.txt'),
+                                                      'public/a.txt').status_code, 200)
+
+
+class ContentAddressedStorageTests(TestCase):
+    """相同内容的上传只存一份，Blob.ref_count 随资产增删变化，gc_blobs 只回收没有引用的文件。"""
+
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user('alice', password='x')
+        self.projects = [Project.objects.create(title=f'P{i}') for i in range(2)]
+
+    def _asset(self, project, data, name='report.pdf'):
+        return Asset.objects.create(project=project, uploader=self.user, name=name,
+                                    file=SimpleUploadedFile(name, data))
+
+    def _files(self):
+        root = os.path.join(settings.MEDIA_ROOT, 'cas')
+        return sorted(os.path.relpath(os.path.join(d, f), root) for d, _, files in os.walk(root) for f in files)
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self._asset(self.projects[0], b'same bytes')
+        second = self._asset(self.projects[1], b'same bytes', name='copy.PDF')
+        other = self._asset(self.projects[1], b'other bytes')
+        digest = hashlib.sha256(b'same bytes').hexdigest()
+        self.assertEqual(first.file.name, storage.blob_name(digest, '.pdf'))
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual(len(self._files()), 2)
+        blob = Blob.objects.get(sha256=digest)
+        self.assertEqual((blob.ref_count, blob.size), (2, len(b'same bytes')))
+        self.assertEqual(Asset.objects.get(pk=other.pk).blob.ref_count, 1)
+
+        first.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        second.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 0)
+        self.assertEqual(len(self._files()), 2)  # 文件由 gc_blobs 回收，删除资产时不动
+
+    def test_gc_blobs_removes_only_unreferenced_files(self):
+        kept = self._asset(self.projects[0], b'kept')
+        self._asset(self.projects[0], b'dropped').delete()
+        stray = os.path.join(settings.MEDIA_ROOT, 'cas', 'ff', 'ff', 'f' * 64)
+        os.makedirs(os.path.dirname(stray))
+        with open(stray, 'wb') as f:
+            f.write(b'no blob row')
+        self.assertEqual(len(self._files()), 3)
+
+        # 宽限期内的对象都不回收
+        call_command('gc_blobs', stdout=StringIO())
+        self.assertEqual(Blob.objects.count(), 2)
+        self.assertEqual(len(self._files()), 3)
+
+        out = StringIO()
+        call_command('gc_blobs', grace_hours=0, stdout=out)
+        self.assertIn('孤立 Blob 1 个，无记录文件 1 个', out.getvalue())
+        self.assertEqual(list(Blob.objects.values_list('sha256', flat=True)), [hashlib.sha256(b'kept').hexdigest()])
+        self.assertEqual(self._files(), [os.path.relpath(kept.file.name, 'cas')])
+        with kept.file.open('rb') as f:
+            self.assertEqual(f.read(), b'kept')
+
+
+class ThumbnailTests(TestCase):
+    """缩略图按宽度等比缩小（不放大），JPEG 铺白底；尚未生成时重定向到原图。"""
+
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user('alice', password='x')
+        project = Project.objects.create(title='P')
+        ProjectMembership.objects.create(user=self.user, project=project, role='viewer')
+        image = Image.new('RGBA', (400, 200), (255, 0, 0, 255))
+        image.paste((0, 0, 0, 0), (0, 0, 200, 200))  # 左半边完全透明
+        buffer = BytesIO()
+        image.save(buffer, format='PNG')
+        self.asset = Asset.objects.create(project=project, uploader=self.user, name='photo.png', asset_type='image',
+                                          file=SimpleUploadedFile('photo.png', buffer.getvalue()))
+        self.client.force_login(self.user)
+        patcher = mock.patch.object(thumbnails, '_pending', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _render(self, width, fmt):
+        dest = os.path.join(settings.MEDIA_ROOT, 'out', f'{width}.{fmt}')
+        self.assertEqual(image_utils.render_thumbnail(self.asset.file.path, dest, width, fmt), dest)
+        return Image.open(dest)
+
+    def test_render_thumbnail(self):
+        with self._render(100, 'jpg') as thumb:
+            self.assertEqual((thumb.format, thumb.size, thumb.mode), ('JPEG', (100, 50), 'RGB'))
+            self.assertGreater(min(thumb.getpixel((10, 25))), 240)  # 透明部分变成白色而不是黑色
+            red, green, blue = thumb.getpixel((90, 25))
+            self.assertGreater(red, 200)
+            self.assertLess(green, 60)
+        with self._render(1000, 'webp') as thumb:
+            self.assertEqual((thumb.format, thumb.size, thumb.mode), ('WEBP', (400, 200), 'RGBA'))
+
+    def test_view_serves_thumbnail_or_redirects_to_original(self):
+        url = reverse('asset_thumbnail', args=[self.asset.pk, 'sm', 'webp'])
+        pending = Future()  # 永远不会完成的生成任务
+        with mock.patch.object(thumbnails, 'get_executor') as get_executor, \
+                override_settings(KNOWLEDGE_THUMBNAILS={'WAIT': 0}):
+            get_executor.return_value.submit.return_value = pending
+            response = self.client.get(url)
+        self.assertRedirects(response, reverse('asset_download', args=[self.asset.pk]), fetch_redirect_response=False)
+        self.assertEqual(response['Cache-Control'], 'no-store')
+
+        digest = storage.digest_from_name(self.asset.file.name)
+        image_utils.render_thumbnail(self.asset.file.path, storage.asset_storage.path(
+            thumbnails.thumbnail_name(digest, 'sm', 'webp')), 160, 'webp')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+
+        self.assertEqual(self.client.get(reverse('asset_thumbnail', args=[self.asset.pk, 'xl', 'webp'])).status_code,
+                         404)
+
+
+class PaginateHtmlTests(TestCase):
+    """按 HTML 结构分页：每页结构完整，文本不丢失，不会无限换页。"""
+
+    def test_deeply_nested_page_start_terminates(self):
+        # 重新打开的 8 层标签本身就超过了硬上限 (250)，新页面也必须能放下文本
+        opening = '<div class="wrapper-with-a-long-class-name">' * 8
+        pages = html_utils.paginate_html(opening + 'word ' * 400 + '</div>' * 8, page_size=200)
+        self.assertGreater(len(pages), 1)
+        for page in pages:
+            self.assertTrue(page.startswith(opening))
+            self.assertEqual(page.count('<div'), page.count('</div>'))
+        self.assertEqual(sum(html_utils.count_words(html_utils.extract_text(page)) for page in pages), 400)
+
+    def test_no_empty_pages(self):
+        # 重新打开的标签本身超过硬上限时，只有标签、没有正文的页面不能单独成页
+        opening = '<div class="wrapper-with-a-long-class-name">' * 8
+        for body in ('<p>short</p>', '<p>' + 'word ' * 100 + '</p>\n<p></p>'):
+            pages = html_utils.paginate_html(opening + body + '</div>' * 8 + '\n', page_size=200)
+            for page in pages:
+                self.assertTrue(html_utils.extract_text(page).strip(), page)
+
+    def test_breaks_between_top_level_elements_within_limit(self):
+        html = ''.join(f'<p>paragraph {i} ' + 'lorem ' * 20 + '</p>' for i in range(30))
+        pages = html_utils.paginate_html(html, page_size=500)
+        for page in pages:
+            self.assertLessEqual(len(page), 500 + 500 // 4)
+            self.assertTrue(page.startswith('<p>') and page.endswith('</p>'))
+        self.assertEqual(''.join(pages), html)
+
+    def test_images_count_as_content(self):
+        pages = html_utils.paginate_html('<figure><img src="a.png"></figure>' * 20, page_size=100)
+        self.assertGreater(len(pages), 1)
+        self.assertEqual(sum(page.count('<img') for page in pages), 20)
+
+    def test_empty_input_returns_one_page(self):
+        self.assertEqual(html_utils.paginate_html(''), [''])
+        self.assertEqual(html_utils.paginate_with_breaks('<p></p>'), ['<p></p>'])
+
+
+class SanitizeHtmlTests(TestCase):
+    """按白名单清洗 HTML，并生成目录；分页符在清洗后统一，分页时强制断页。"""
+
+    def test_dangerous_urls_and_styles_are_removed(self):
+        html, _ = html_utils.sanitize_html(
+            '<a href=" javascript:alert(1)" onclick="x()">a</a>'
+            '<p style="color:red;background-color:url(http://evil/x.png);position:fixed">b</p>'
+            '<script>alert(1)</script>')
+        self.assertEqual(html, '<a>a</a><p style="color:red">b</p>')
+
+    def test_data_urls_only_for_raster_images(self):
+        png = 'data:image/png;base64,iVBORw0KGgo='
+        html, _ = html_utils.sanitize_html(
+            f'<img src="{png}"><img src="data:image/svg+xml,&lt;svg onload=alert(1)&gt;">'
+            f'<a href="{png}">x</a>')
+        self.assertEqual(html, f'<img src="{png}"><img><a>x</a>')
+
+    def test_todo_list_checkboxes_are_kept(self):
+        html, _ = html_utils.sanitize_html(
+            '<ul class="todo-list"><li><label class="todo-list__label">'
+            '<input type="checkbox" disabled="disabled" checked><span>done</span></label></li></ul>'
+            '<input type="text" value="x">')
+        self.assertEqual(html, '<ul class="todo-list"><li><label class="todo-list__label">'
+                               '<input type="checkbox" disabled="disabled" checked="checked">'
+                               '<span>done</span></label></li></ul>')
+
+    def test_headings_get_anchors_and_toc(self):
+        html, toc = html_utils.sanitize_html('<h2>Intro <em>part</em></h2><p>x</p><h3>Details')
+        self.assertEqual(html, '<h2 id="h-1">Intro <em>part</em></h2><p>x</p><h3 id="h-2">Details</h3>')
+        self.assertEqual(toc, [{'level': 2, 'id': 'h-1', 'text': 'Intro part'},
+                               {'level': 3, 'id': 'h-2', 'text': 'Details'}])
+
+    def test_page_breaks_split_pages(self):
+        html, _ = html_utils.sanitize_html(
+            '<p>one</p><div class="page-break" style="page-break-after:always"><span>&nbsp;</span></div>'
+            '<p>two</p><div class="page-break"></div>')
+        self.assertEqual(html_utils.paginate_with_breaks(html), ['<p>one</p>', '<p>two</p>'])
+
+
+class RateLimitTests(TestCase):
+    """超出速率的请求返回 429 和 Retry-After；不同用户、不同 IP 分别计数。"""
+
+    def setUp(self):
+        # 每个测试使用独立的计数；get_backend() 返回的就是这个实例
+        self.backend = ratelimit.MemoryBackend()
+        patcher = mock.patch.object(ratelimit, '_backend', self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.alice = User.objects.create_user('alice', password='x')
+        self.bob = User.objects.create_user('bob', password='x')
+        self.note = Note.objects.create(title='T', content='<p>a</p>', author=self.alice, is_public=True)
+        self.url = reverse('api_note_detail', args=[self.note.pk])
+
+    def test_hit_rejects_after_limit_per_identity(self):
+        self.assertTrue(all(ratelimit.hit('test', '10.0.0.1', '3/m').allowed for _ in range(3)))
+        result = ratelimit.hit('test', '10.0.0.1', '3/m')
+        self.assertFalse(result.allowed)
+        self.assertTrue(0 < result.retry_after <= 60)
+        self.assertTrue(ratelimit.hit('test', '10.0.0.2', '3/m').allowed)
+
+    @override_settings(KNOWLEDGE_RATE_LIMITS={'api_note_detail': [{'rate': '2/m', 'key': 'user'}]})
+    def test_middleware_limits_each_user(self):
+        self.client.force_login(self.alice)
+        self.assertEqual([self.client.get(self.url).status_code for _ in range(2)], [200, 200])
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(1 <= int(response['Retry-After']) <= 60)
+
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.get(self.url).status_code, 403)  # 未被限流，由视图自己拒绝
+
+    @override_settings(KNOWLEDGE_RATE_LIMITS={'api_note_detail': [{'rate': '1/m', 'key': 'user'}]})
+    async def test_middleware_in_async_handler(self):
+        statuses = []
+        with self.assertNoLogs('knowledge_project.ratelimit', 'WARNING'):
+            for user in (self.alice, self.alice, self.bob):
+                await self.async_client.aforce_login(user)
+                statuses.append((await self.async_client.get(self.url)).status_code)
+        self.assertEqual(statuses, [200, 429, 403])
+        # 计数记录在测试使用的后端中，没有落到全局的兜底后端
+        self.assertTrue(self.backend._windows)
+        self.assertFalse(any(key.startswith('ratelimit:{url:api_note_detail')
+                             for key in ratelimit._memory_backend._windows))
+
+
+@override_settings(KNOWLEDGE_UPLOAD={'MIN_CHUNK_SIZE': 4})
+class ChunkedUploadTests(TestCase):
+    """分片可以乱序、重复上传；长度或偏移不对的分片被拒绝；缺分片或失去写权限时不能完成。"""
+
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user('alice', password='x')
+        self.project = Project.objects.create(title='P')
+        self.membership = ProjectMembership.objects.create(user=self.user, project=self.project, role='editor')
+        self.client.force_login(self.user)
+        self.data = b'0123456789abcdefghij'  # 20 字节，分片大小 8：3 个分片
+        response = self.client.post(reverse('api_upload_create'), {
+            'project_id': self.project.pk, 'filename': 'notes.txt', 'size': len(self.data), 'chunk_size': 8,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.upload_id = response.json()['upload_id']
+
+    def put_chunk(self, offset, data=None, sha256=None):
+        data = self.data[offset:offset + 8] if data is None else data
+        return self.client.put(reverse('api_upload_chunk', args=[self.upload_id, offset]), data,
+                               content_type='application/octet-stream',
+                               HTTP_X_CHUNK_SHA256=sha256 or hashlib.sha256(data).hexdigest())
+
+    def complete(self):
+        return self.client.post(reverse('api_upload_complete', args=[self.upload_id]))
+
+    def test_out_of_order_and_duplicate_chunks(self):
+        for offset in (16, 0, 0, 8):
+            self.assertEqual(self.put_chunk(offset).status_code, 200)
+        response = self.client.get(reverse('api_upload_detail', args=[self.upload_id]))
+        self.assertEqual(response.json()['missing_offsets'], [])
+        response = self.complete()
+        self.assertEqual(response.status_code, 200)
+        asset = Asset.objects.get(pk=response.json()['asset_id'])
+        with asset.file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_size_and_offset_mismatch(self):
+        self.assertEqual(self.put_chunk(0, data=self.data[:7]).status_code, 400)   # 分片应为 8 字节
+        self.assertEqual(self.put_chunk(16, data=self.data[16:] + b'!').status_code, 400)  # 最后一片 4 字节
+        self.assertEqual(self.put_chunk(4).status_code, 400)    # 不是分片大小的整数倍
+        self.assertEqual(self.put_chunk(24).status_code, 400)   # 超出文件大小
+        self.assertEqual(self.put_chunk(0, sha256='0' * 64).status_code, 400)
+
+    def test_complete_with_missing_chunk(self):
+        self.put_chunk(0)
+        self.put_chunk(16)
+        response = self.complete()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Asset.objects.exists())
+        # 补上缺失的分片后可以正常完成
+        self.put_chunk(8)
+        self.assertEqual(self.complete().status_code, 200)
+
+    def test_complete_rechecks_write_access(self):
+        for offset in (0, 8, 16):
+            self.put_chunk(offset)
+        self.membership.role = 'viewer'
+        self.membership.save()
+        self.assertEqual(self.complete().status_code, 403)
+        self.assertFalse(Asset.objects.exists())
+        self.assertEqual(UploadSession.objects.get(pk=self.upload_id).status, 'aborted')
+
+
+class CaptchaPoolTests(TestCase):
+    """预渲染验证码池：弹出、补充、池空时同步生成，每个验证码只发出一次。"""
+
+    def setUp(self):
+        counter = iter(range(10 ** 6))
+        patcher = mock.patch.object(captcha, 'render_png', side_effect=lambda: (b'png', f'C{next(counter)}'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = captcha.CaptchaPool(captcha.MemoryStore(), size=5, low_water=2)
+
+    def test_refill_then_pop_each_item_once(self):
+        self.assertEqual(self.pool.refill(batch_size=2), 5)
+        self.assertEqual(self.pool.refill(), 0)  # 已经满了
+        with mock.patch.object(self.pool, 'start_refill') as start_refill:
+            codes = [self.pool.pop()[1] for _ in range(5)]
+        self.assertEqual(len(set(codes)), 5)
+        self.assertEqual(self.pool.store.size(), 0)
+        self.assertEqual((self.pool.hits, self.pool.misses, self.pool.generated), (5, 0, 5))
+        # 剩余数量低于低水位（2）后每次弹出都会请求补充，补充线程本身保证只有一个
+        self.assertEqual(start_refill.call_count, 2)
+
+    def test_empty_pool_renders_on_the_fly(self):
+        with mock.patch.object(self.pool, 'start_refill') as start_refill:
+            png, code = self.pool.pop()
+        self.assertEqual((png, code), (b'png', 'C0'))
+        self.assertEqual((self.pool.hits, self.pool.misses), (0, 1))
+        start_refill.assert_called_once()
+
+        with mock.patch.object(self.pool.store, 'pop', side_effect=ConnectionError('down')), \
+                mock.patch.object(self.pool, 'start_refill'), self.assertLogs('knowledge_project.captcha', 'WARNING'):
+            self.assertEqual(self.pool.pop()[1], 'C1')
+
+    def test_background_refill(self):
+        self.pool.start_refill()
+        for _ in range(100):
+            if not self.pool._refilling:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.pool.store.size(), 5)
+
+    def test_view_stores_answer_in_session(self):
+        patcher = mock.patch.object(ratelimit, '_backend', ratelimit.MemoryBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool.refill()
+        with mock.patch.object(captcha, 'get_pool', return_value=self.pool):
+            codes = []
+            for _ in range(2):
+                response = self.client.get(reverse('captcha_image'))
+                self.assertEqual(response['Content-Type'], 'image/png')
+                self.assertEqual(response['Cache-Control'], 'no-store')
+                codes.append(self.client.session['captcha_code'])
+        self.assertEqual(codes, ['C0', 'C1'])
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    """模拟邮件服务器拒收。"""
+
+    def send_messages(self, email_messages):
+        raise ConnectionError("SMTP 服务不可用")
+
+
+class MailQueueTests(TestCase):
+    """验证码邮件写入队列后由 process_email_queue 发送；失败时重试，过了有效期不再发送。"""
+
+    def setUp(self):
+        patcher = mock.patch.object(ratelimit, '_backend', ratelimit.MemoryBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request_code(self, email='new@example.com'):
+        session = self.client.session
+        session['captcha_code'] = 'ABCD'
+        session.save()
+        return self.client.post(reverse('send_email_code'), {'email': email, 'image_captcha_code': 'abcd'},
+                                content_type='application/json')
+
+    def test_signup_code_is_queued_and_delivered(self):
+        self.assertEqual(self.request_code().status_code, 200)
+        job = EmailJob.objects.get()
+        self.assertEqual((job.status, job.recipients), ('pending', ['new@example.com']))
+        self.assertEqual(len(mail.outbox), 0)  # 请求线程中不发送
+
+        call_command('process_email_queue', '--once', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        code = self.client.session['registration_verification']['code']
+        self.assertIn(code, mail.outbox[0].body)
+        self.assertEqual(EmailJob.objects.get().status, 'sent')
+
+    @override_settings(EMAIL_BACKEND='knowledge_project.tests.FailingEmailBackend')
+    def test_failed_delivery_is_retried_until_the_code_expires(self):
+        job = mailqueue.enqueue('验证码', '123456', ['a@example.com'], ttl=600)
+        self.assertEqual(mailqueue.process_batch()['retried'], 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertGreater(job.next_attempt_at, timezone.now())
+        self.assertIn('SMTP', job.last_error)
+
+        # 下一次重试时验证码已经失效：不再排队
+        EmailJob.objects.filter(pk=job.pk).update(next_attempt_at=timezone.now(),
+                                                  expires_at=timezone.now() + timedelta(seconds=5))
+        self.assertEqual(mailqueue.process_batch()['expired'], 1)
+        self.assertEqual(EmailJob.objects.get(pk=job.pk).status, 'expired')
+
+    def test_expired_jobs_are_not_sent(self):
+        job = mailqueue.enqueue('验证码', '123456', ['a@example.com'], ttl=600)
+        EmailJob.objects.filter(pk=job.pk).update(expires_at=timezone.now())
+        self.assertEqual(sum(mailqueue.process_batch().values()), 0)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(EmailJob.objects.get(pk=job.pk).status, 'expired')
@@ -0,0 +1,119 @@
+# knowledge_project/thumbnails.py
+"""
+图片资产的缩略图派生。
+
+界面原来总是加载原图，几 MB 的照片要完整下载才能预览。现在图片资产保存后，
+会在后台进程池中生成多个尺寸的 WebP / JPEG 缩略图：
+
+- 生成在独立的工作进程中进行（Pillow 解码/缩放是 CPU 密集的，不占用请求线程，也不受 GIL 影响）；
+- 结果按 (内容哈希, 尺寸, 格式) 缓存在磁盘 MEDIA_ROOT/thumbs/ 下，相同内容的图片只生成一次；
+- 通过稳定的地址 /assets/<id>/thumbs/<尺寸>.<webp|jpg> 访问，尚未生成时先重定向到原图。
+
+只处理内容寻址存储中的图片（需要哈希作为缓存键）；旧路径的文件可先用 migrate_assets_to_cas 迁移。
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+from .storage import asset_storage, digest_from_name
+from .utils.images import render_thumbnail
+
+logger = logging.getLogger(__name__)
+
+_DEFAULTS = {
+    'SIZES': {'sm': 160, 'md': 480, 'lg': 1280},  # 尺寸名 -> 最大宽度
+    'FORMATS': ('webp', 'jpg'),
+    'WORKERS': 2,
+    'WAIT': 2.0,  # 请求到来时缩略图还没生成，最多等待的秒数
+}
+THUMBS_DIR = 'thumbs'
+
+
+def get_options():
+    return {**_DEFAULTS, **getattr(settings, 'KNOWLEDGE_THUMBNAILS', {})}
+
+
+def thumbnail_name(digest, size, fmt):
+    """缩略图在 MEDIA_ROOT 下的相对路径，缓存键只与内容有关。"""
+    return f'{THUMBS_DIR}/{digest[:2]}/{digest}_{size}.{fmt}'
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = {}  # 缩略图路径 -> Future，同一张缩略图不会被重复提交
+_pending_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn：工作进程不继承 Web 进程的数据库连接、线程等状态
+                _executor = ProcessPoolExecutor(max_workers=get_options()['WORKERS'],
+                                                mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def submit(digest, src_name, size, fmt):
+    """提交一张缩略图的生成任务，已存在时返回 None，否则返回 Future。"""
+    width = get_options()['SIZES'][size]
+    dest_name = thumbnail_name(digest, size, fmt)
+    dest_path = asset_storage.path(dest_name)
+    if os.path.exists(dest_path):
+        return None
+    executor = get_executor()
+    with _pending_lock:
+        future = _pending.get(dest_name)
+        if future is not None:
+            return future
+        future = executor.submit(render_thumbnail, asset_storage.path(src_name), dest_path, width, fmt)
+        _pending[dest_name] = future
+    future.add_done_callback(lambda f, key=dest_name: _done(key, f))
+    return future
+
+
+def _done(key, future):
+    with _pending_lock:
+        _pending.pop(key, None)
+    if future.exception():
+        logger.warning("缩略图生成失败 (%s): %s", key, future.exception())
+
+
+def is_image(asset):
+    return asset.asset_type == 'image' and digest_from_name(asset.file.name) is not None
+
+
+def schedule(asset):
+    """为图片资产提交所有尺寸和格式的缩略图（由 signals.py 在事务提交后调用），不等待结果。"""
+    if not is_image(asset):
+        return
+    digest = digest_from_name(asset.file.name)
+    options = get_options()
+    try:
+        for size in options['SIZES']:
+            for fmt in options['FORMATS']:
+                submit(digest, asset.file.name, size, fmt)
+    except Exception as e:
+        # 进程池不可用不应该影响资产保存，访问时还会再尝试
+        logger.warning("无法提交缩略图任务 (asset=%s): %s", asset.pk, e)
+
+
+def get_thumbnail(asset, size, fmt, wait=None):
+    """
+    返回缩略图的存储路径；还没有生成时提交任务并最多等待 wait 秒，仍未完成则返回 None。
+    """
+    digest = digest_from_name(asset.file.name)
+    dest_name = thumbnail_name(digest, size, fmt)
+    future = submit(digest, asset.file.name, size, fmt)
+    if future is None:
+        return dest_name
+    try:
+        future.result(timeout=get_options()['WAIT'] if wait is None else wait)
+    except Exception:
+        return None
+    return dest_name
@@ -0,0 +1,255 @@
+# knowledge_project/uploads.py
+"""
+可续传的分片上传。
+
+资产原来只能通过后台表单或 CKEditor 上传地址一次性 POST：500 MB 的文件要在一个请求里
+经过 Django 的上传处理器，连接一断就得从头再来。分片上传协议：
+
+1. POST   /api/uploads/                      创建会话，返回 upload_id、chunk_size、分片总数
+2. PUT    /api/uploads/<id>/chunks/<offset>/ 请求体为该偏移处的分片原始字节，
+                                             X-Chunk-SHA256 头为分片的 SHA-256，服务器校验后保存
+3. GET    /api/uploads/<id>/                 查询已收到的分片（断线后据此续传缺失的部分）
+4. POST   /api/uploads/<id>/complete/        按顺序合并分片，生成普通的 Asset（经过内容寻址存储去重）
+   DELETE /api/uploads/<id>/                 取消上传
+
+- 分片从请求流中按块读取并写入暂存文件，同时计算哈希，不会读入内存；
+- 同一会话同时上传的分片数受 MAX_CONCURRENT_CHUNKS 限制（缓存计数器），超出时返回 429；
+- 过期会话及其暂存文件由 gc_blobs 命令清理。
+"""
+import hashlib
+import os
+import shutil
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import permissions
+from .models import Asset, UploadChunk, UploadSession
+from .storage import asset_storage
+
+_DEFAULTS = {
+    'CHUNK_SIZE': 8 * 1024 * 1024,          # 默认分片大小
+    'MIN_CHUNK_SIZE': 256 * 1024,
+    'MAX_CHUNK_SIZE': 64 * 1024 * 1024,
+    'MAX_FILE_SIZE': 4 * 1024 * 1024 * 1024,
+    'MAX_CONCURRENT_CHUNKS': 4,             # 每个会话同时上传的分片数
+    'EXPIRES': timedelta(hours=24),         # 会话从创建起的有效期
+}
+READ_SIZE = 64 * 1024
+SLOT_TIMEOUT = 10 * 60  # 进程崩溃时并发计数器最多占用这么久
+
+
+class UploadError(ValueError):
+    """客户端请求不合法（参数错误、校验失败、分片缺失等），视图返回 400。"""
+
+
+class TooManyChunks(Exception):
+    """同一会话正在上传的分片数已达上限，视图返回 429。"""
+
+
+class UploadForbidden(Exception):
+    """上传者已失去项目的写权限（被移出项目或降为查看者），视图返回 403。"""
+
+
+def get_options():
+    return {**_DEFAULTS, **getattr(settings, 'KNOWLEDGE_UPLOAD', {})}
+
+
+def create_session(user, project, filename, size, chunk_size=None, asset_type='file'):
+    options = get_options()
+    filename = os.path.basename(str(filename or '')).strip()[:255]
+    if not filename:
+        raise UploadError("缺少文件名。")
+    try:
+        size = int(size)
+        chunk_size = int(chunk_size or options['CHUNK_SIZE'])
+    except (TypeError, ValueError):
+        raise UploadError("size 和 chunk_size 必须是整数。")
+    if not 0 <= size <= options['MAX_FILE_SIZE']:
+        raise UploadError(f"文件大小必须在 0 到 {options['MAX_FILE_SIZE']} 字节之间。")
+    if not options['MIN_CHUNK_SIZE'] <= chunk_size <= options['MAX_CHUNK_SIZE']:
+        raise UploadError(f"分片大小必须在 {options['MIN_CHUNK_SIZE']} 到 {options['MAX_CHUNK_SIZE']} 字节之间。")
+    if asset_type not in dict(Asset.ASSET_TYPE_CHOICES):
+        raise UploadError("未知的资源类型。")
+    return UploadSession.objects.create(
+        user=user, project=project, filename=filename, size=size, chunk_size=chunk_size,
+        asset_type=asset_type, expires_at=timezone.now() + options['EXPIRES'],
+    )
+
+
+def describe(session):
+    """会话状态，供客户端决定还需要上传哪些分片。"""
+    received = list(session.chunks.values_list('index', flat=True))
+    missing = sorted(set(range(session.total_chunks)) - set(received))
+    return {
+        'upload_id': str(session.pk),
+        'status': session.status,
+        'filename': session.filename,
+        'size': session.size,
+        'chunk_size': session.chunk_size,
+        'total_chunks': session.total_chunks,
+        'max_concurrent_chunks': get_options()['MAX_CONCURRENT_CHUNKS'],
+        'received_offsets': [index * session.chunk_size for index in received],
+        'missing_offsets': [index * session.chunk_size for index in missing],
+        'expires_at': session.expires_at.isoformat(),
+        'asset_id': session.asset_id,
+    }
+
+
+def _check_active(session):
+    if session.status != 'uploading':
+        raise UploadError(f"上传会话状态为 {session.status}，不能继续上传。")
+    if session.expires_at <= timezone.now():
+        raise UploadError("上传会话已过期。")
+
+
+def _acquire_slot(session):
+    key = f"upload_slots_{session.pk}"
+    cache.add(key, 0, timeout=SLOT_TIMEOUT)
+    try:
+        in_flight = cache.incr(key)
+    except ValueError:  # 键恰好过期
+        cache.add(key, 1, timeout=SLOT_TIMEOUT)
+        in_flight = 1
+    if in_flight > get_options()['MAX_CONCURRENT_CHUNKS']:
+        _release_slot(key)
+        raise TooManyChunks()
+    return key
+
+
+def _release_slot(key):
+    try:
+        cache.decr(key)
+    except ValueError:
+        pass
+
+
+def write_chunk(session, offset, stream, content_length, expected_sha256):
+    """
+    从 stream（通常就是 request）中读取 offset 处的分片，校验长度和 SHA-256 后保存。
+    重复上传同一个分片会覆盖之前的内容，客户端重试是安全的。
+    """
+    _check_active(session)
+    if offset < 0 or offset % session.chunk_size or offset >= max(session.size, 1):
+        raise UploadError("offset 必须是分片大小的整数倍，且小于文件大小。")
+    index = offset // session.chunk_size
+    expected_size = min(session.chunk_size, session.size - offset)
+    if content_length != expected_size:
+        raise UploadError(f"该分片应为 {expected_size} 字节，实际 Content-Length 为 {content_length}。")
+    expected_sha256 = (expected_sha256 or '').strip().lower()
+    if len(expected_sha256) != 64:
+        raise UploadError("缺少分片校验和（X-Chunk-SHA256 头）。")
+
+    slot = _acquire_slot(session)
+    try:
+        upload_dir = asset_storage.upload_dir(session.pk)
+        os.makedirs(upload_dir, exist_ok=True)
+        part_path = os.path.join(upload_dir, f'{index}.part')
+        tmp_path = f'{part_path}.{uuid.uuid4().hex}'
+        sha256 = hashlib.sha256()
+        received = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                while received < expected_size:
+                    data = stream.read(min(READ_SIZE, expected_size - received))
+                    if not data:
+                        break
+                    sha256.update(data)
+                    f.write(data)
+                    received += len(data)
+            if received != expected_size:
+                raise UploadError("分片数据不完整，请重新上传该分片。")
+            if sha256.hexdigest() != expected_sha256:
+                raise UploadError("分片校验和不匹配，请重新上传该分片。")
+            os.replace(tmp_path, part_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        UploadChunk.objects.update_or_create(
+            session=session, index=index, defaults={'size': received, 'sha256': expected_sha256},
+        )
+    finally:
+        _release_slot(slot)
+    return index
+
+
+def complete(session, user, expected_sha256=None):
+    """
+    合并全部分片并生成 Asset。重复调用返回同一个 Asset。
+    合并时重新计算整个文件的 SHA-256（既用于内容寻址，也可与客户端提供的值比对）。
+    会话可能在创建 24 小时后才完成，生成资产前重新检查 user 对项目的写权限，没有时取消会话。
+    """
+    if session.status == 'complete':
+        return session.asset
+    _check_active(session)
+    if not permissions.can_write(permissions.get_role(user, session.project_id)):
+        abort(session)
+        raise UploadForbidden("您已没有权限向此项目上传文件。")
+    # 状态从 uploading 原子地切换到 assembling，防止并发的 complete 请求重复合并
+    if not UploadSession.objects.filter(pk=session.pk, status='uploading').update(status='assembling'):
+        raise UploadError("该上传正在合并中。")
+    session.status = 'assembling'
+
+    try:
+        chunks = dict(session.chunks.values_list('index', 'size'))
+        missing = [index for index in range(session.total_chunks) if index not in chunks]
+        if session.size and missing:
+            raise UploadError(f"还有 {len(missing)} 个分片未上传。")
+
+        upload_dir = asset_storage.upload_dir(session.pk)
+        sha256 = hashlib.sha256()
+        fd, tmp_path = asset_storage.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for index in range(session.total_chunks if session.size else 0):
+                    with open(os.path.join(upload_dir, f'{index}.part'), 'rb') as part:
+                        while True:
+                            data = part.read(READ_SIZE)
+                            if not data:
+                                break
+                            sha256.update(data)
+                            out.write(data)
+            digest = sha256.hexdigest()
+            if expected_sha256 and expected_sha256.strip().lower() != digest:
+                raise UploadError("文件校验和不匹配，请重新上传。")
+            name = asset_storage.save_hashed(tmp_path, digest, session.filename)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    except Exception:
+        UploadSession.objects.filter(pk=session.pk).update(status='uploading')
+        session.status = 'uploading'
+        raise
+
+    with transaction.atomic():
+        asset = Asset.objects.create(
+            project_id=session.project_id, uploader_id=session.user_id, name=session.filename,
+            file=name, asset_type=session.asset_type,
+        )
+        session.status, session.asset = 'complete', asset
+        session.save(update_fields=['status', 'asset'])
+    shutil.rmtree(asset_storage.upload_dir(session.pk), ignore_errors=True)
+    session.chunks.all().delete()
+    return asset
+
+
+def abort(session):
+    UploadSession.objects.filter(pk=session.pk).exclude(status='complete').update(status='aborted')
+    shutil.rmtree(asset_storage.upload_dir(session.pk), ignore_errors=True)
+    session.chunks.all().delete()
+
+
+def purge_expired():
+    """删除过期或已取消的会话及其暂存分片（已完成的会话只删记录，资产不受影响），返回删除的会话数。"""
+    stale = UploadSession.objects.filter(Q(expires_at__lt=timezone.now()) | Q(status='aborted'))
+    count = 0
+    for upload_id in stale.values_list('pk', flat=True):
+        shutil.rmtree(asset_storage.upload_dir(upload_id), ignore_errors=True)
+        count += 1
+    stale.delete()
+    return count
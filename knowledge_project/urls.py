@@ -16,8 +16,19 @@ urlpatterns = [
     path('api/notes/search/', views.search_notes_api, name='api_search_notes'),
     path('api/notes/<int:note_id>/', views.note_detail_api, name='api_note_detail'),
     path('api/notes/all/', views.get_all_notes_api, name='get_all_notes_api'),
+    path('api/notes/<int:note_id>/revisions/', views.note_revisions_api, name='api_note_revisions'),
+    path('api/notes/<int:note_id>/revisions/diff/', views.note_revision_diff_api, name='api_note_revision_diff'),
+    path('api/notes/<int:note_id>/revisions/<int:number>/restore/', views.note_revision_restore_api,
+         name='api_note_revision_restore'),
+    path('assets/<int:asset_id>/download/', views.asset_download, name='asset_download'),
+    path('assets/<int:asset_id>/thumbs/<slug:size>.<slug:fmt>', views.asset_thumbnail, name='asset_thumbnail'),
+    path('api/uploads/', views.upload_create_api, name='api_upload_create'),
+    path('api/uploads/<uuid:upload_id>/', views.upload_detail_api, name='api_upload_detail'),
+    path('api/uploads/<uuid:upload_id>/chunks/<int:offset>/', views.upload_chunk_api, name='api_upload_chunk'),
+    path('api/uploads/<uuid:upload_id>/complete/', views.upload_complete_api, name='api_upload_complete'),
     #path('api/notes/create/', views.note_create_api, name='note_create_api'),
-    # path('notes/public/<uuid:public_id>/', views.public_note_view, name='public_note_view'),
+    path('notes/public/<uuid:public_id>/', views.public_note_view, name='public_note_view'),
+    path('metrics/', views.metrics, name='metrics'),
 
 ]
 
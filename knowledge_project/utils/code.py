@@ -1,9 +1,18 @@
+import os
 import random
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageTransform
 from io import BytesIO
 
 
-font_path = r"D:\Team Project\Team_Project\knowledge_project\static\utils\kumo.ttf"
+# 字体文件与本模块放在同一目录，不再依赖开发机上的绝对路径
+font_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kumo.ttf')
+
+
+@lru_cache(maxsize=8)
+def load_font(font_file, font_size):
+    """【新增】缓存字体句柄，避免每次生成验证码都从磁盘重新解析 TrueType 文件"""
+    return ImageFont.truetype(font_file, font_size)
 
 
 def check_code(width=120, height=30, char_length=5, font_file=font_path, font_size=28):
@@ -47,7 +56,7 @@ def check_code(width=120, height=30, char_length=5, font_file=font_path, font_si
     draw = ImageDraw.Draw(img)
 
     # 绘制验证码字符
-    font = ImageFont.truetype(font_file, font_size)
+    font = load_font(font_file, font_size)
     for i in range(char_length):
         char = rndChar()
         code.append(char)
@@ -86,6 +95,14 @@ def check_code(width=120, height=30, char_length=5, font_file=font_path, font_si
     return img, ''.join(code)
 
 
+def render_png(**kwargs):
+    """【新增】生成验证码并编码为 PNG，返回 (PNG 字节, 验证码)"""
+    img, code = check_code(**kwargs)
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue(), code
+
+
 # 示例调用函数 - 可用于测试或保存图片
 def save_captcha_image(path='./captcha.png'):
     """
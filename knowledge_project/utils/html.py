@@ -0,0 +1,355 @@
+# knowledge_project/utils/html.py
+"""
+处理 CKEditor 生成的 HTML 的工具函数。
+"""
+import re
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+# 这些标签的内容不是正文，抽取纯文本时整体跳过
+SKIP_TAGS = {'script', 'style', 'template', 'noscript'}
+
+# 块级标签：在它们的边界处插入换行，避免相邻段落的文字粘连在一起
+BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'figcaption', 'figure',
+    'footer', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'ol', 'p', 'pre', 'section',
+    'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'ul',
+}
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+        elif tag == 'img':
+            # 图片的替代文本也是可检索的内容
+            alt = dict(attrs).get('alt')
+            if alt:
+                self.parts.append(f' {alt} ')
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+
+def extract_text(html):
+    """
+    从 HTML 中抽取纯文本。
+    块级元素之间以换行分隔，连续空白被压缩，script/style 等内容被丢弃。
+    """
+    if not html:
+        return ''
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    lines = (' '.join(line.split()) for line in ''.join(parser.parts).splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+# --- 按 HTML 结构分页 ---
+
+# 没有结束标签的元素，不需要入栈
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+             'track', 'wbr'}
+
+# 注释、标签、文本，最后的 '<' 用来兜住不成对的尖括号
+_HTML_TOKEN_RE = re.compile(r'<!--.*?-->|<[^>]*>|[^<]+|<', re.S)
+_TAG_NAME_RE = re.compile(r'</?\s*([a-zA-Z][a-zA-Z0-9:-]*)')
+
+
+def _split_text(text, limit):
+    """
+    把一段文本切成不超过 limit 的两部分，优先在空白处断开，且不会切断 &amp; 这样的字符实体。
+    """
+    if len(text) <= limit:
+        return text, ''
+    cut = text.rfind(' ', 0, limit + 1)
+    if cut < limit // 2:
+        cut = limit
+    amp = text.rfind('&', 0, cut)
+    if amp > 0 and ';' not in text[amp:cut] and ';' in text[cut:amp + 12]:
+        cut = amp
+    return text[:cut], text[cut:]
+
+
+def paginate_html(html, page_size=2000):
+    """
+    将 HTML 切分为若干页，每页约 page_size 个字符。
+    - 只在标签/文本的边界处断页，绝不会把一个标签切成两半；
+    - 优先在顶层元素之间断页；单个元素过长时在元素内部断开，
+      并在本页末尾补齐结束标签、在下一页开头重新打开这些标签，保证每一页都是结构完整的 HTML。
+    返回页面字符串列表，至少包含一页。
+    """
+    if not html:
+        return ['']
+
+    hard_limit = page_size + page_size // 4
+    pages = []
+    current = []
+    length = 0
+    stack = []  # [(标签名, 原始开始标签)]
+    has_content = False  # 本页是否已有正文（非空白文本或图片等空元素），只有标签的页面不单独成页
+
+    def flush():
+        nonlocal current, length, has_content
+        closing = ''.join(f'</{name}>' for name, _ in reversed(stack))
+        pages.append(''.join(current) + closing)
+        reopen = ''.join(raw for _, raw in stack)
+        current = [reopen] if reopen else []
+        length = len(reopen)
+        has_content = False
+
+    for match in _HTML_TOKEN_RE.finditer(html):
+        token = match.group()
+        if token.startswith('<') and len(token) > 1 and not token.startswith('<!'):
+            name_match = _TAG_NAME_RE.match(token)
+            name = name_match.group(1).lower() if name_match else ''
+            current.append(token)
+            length += len(token)
+            if token.startswith('</'):
+                for i in range(len(stack) - 1, -1, -1):
+                    if stack[i][0] == name:
+                        del stack[i:]
+                        break
+            elif name and name not in VOID_TAGS and not token.endswith('/>'):
+                stack.append((name, token))
+            else:
+                has_content = True
+        else:
+            # 文本（或注释）：超过硬上限的部分在元素内部断开
+            while token and length + len(token) > hard_limit and not token.startswith('<!--'):
+                room = hard_limit - length
+                if not has_content:
+                    # 本页还没有正文（新页面开头只有重新打开的标签），至少放下半页文本：
+                    # 否则标签嵌套很深时会无限换页，或者换出只有标签的空白页
+                    limit = max(room, page_size // 2)
+                    if len(token) <= limit:
+                        break
+                elif room < 32:
+                    flush()  # 本页几乎已满，先换页再切分文本
+                    continue
+                else:
+                    limit = room
+                head, token = _split_text(token, limit)
+                current.append(head)
+                length += len(head)
+                has_content = True
+                flush()
+            current.append(token)
+            length += len(token)
+            has_content = has_content or not token.isspace()
+
+        if has_content and length >= page_size and (not stack or length >= hard_limit):
+            flush()
+
+    if has_content or not pages:
+        closing = ''.join(f'</{name}>' for name, _ in reversed(stack))
+        pages.append(''.join(current) + closing)
+    return pages
+
+
+# --- 清洗 ---
+
+# 允许保留的标签：编辑器常用格式（文字样式、标题、列表、待办列表、表格、代码块、图片、媒体嵌入）产生的元素，
+# 不在其中的标签被去掉，内容保留；input 只保留待办列表的复选框 (type="checkbox")
+ALLOWED_TAGS = {
+    'a', 'b', 'blockquote', 'br', 'caption', 'code', 'col', 'colgroup', 'del', 'div', 'em', 'figcaption',
+    'figure', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'input', 'kbd', 'label', 'li', 'mark',
+    'oembed', 'ol', 'p', 'pre', 's', 'span', 'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'tfoot', 'th',
+    'thead', 'tr', 'u', 'ul',
+}
+ALLOWED_ATTRS = {
+    '*': {'class', 'style'},
+    'a': {'href', 'title', 'target', 'rel'},
+    'img': {'src', 'alt', 'title', 'width', 'height', 'srcset', 'sizes'},
+    'oembed': {'url'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan', 'scope'},
+    'col': {'span'},
+    'ol': {'start', 'reversed'},
+    'li': {'value'},
+    'pre': {'data-language'},
+    'input': {'type', 'checked', 'disabled'},
+}
+URL_ATTRS = {'href', 'src', 'url'}
+ALLOWED_SCHEMES = {'', 'http', 'https', 'mailto', 'tel'}
+# 粘贴进编辑器的图片以 data: URL 内嵌，只允许出现在 img 的 src 中，且只接受位图（SVG 可以携带脚本）
+_DATA_IMAGE_RE = re.compile(r'data:image/(png|jpeg|gif|webp|avif|bmp)[;,]', re.I)
+ALLOWED_CSS = {
+    'background-color', 'border', 'border-color', 'border-style', 'border-width', 'color', 'float', 'font-family',
+    'font-size', 'height', 'margin-left', 'margin-right', 'padding', 'page-break-after', 'text-align',
+    'text-indent', 'vertical-align', 'width',
+}
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+# CKEditor 分页符插件输出的元素；清洗后统一为这个标记，分页时在这里强制断页
+PAGE_BREAK = '<div class="page-break"></div>'
+
+
+def _clean_style(style):
+    declarations = []
+    for declaration in style.split(';'):
+        prop, _, value = declaration.partition(':')
+        prop, value = prop.strip().lower(), value.strip()
+        if prop in ALLOWED_CSS and value and not re.search(r'url\s*\(|expression|[<>\\]', value, re.I):
+            declarations.append(f'{prop}:{value}')
+    return ';'.join(declarations)
+
+
+def _safe_url(url, allow_data_image=False):
+    url = (url or '').strip()
+    if allow_data_image and _DATA_IMAGE_RE.match(url):
+        return url
+    try:
+        scheme = urlsplit(re.sub(r'[\x00-\x20]', '', url)).scheme.lower()
+    except ValueError:
+        return None
+    return url if scheme in ALLOWED_SCHEMES else None
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.stack = []
+        self.toc = []
+        self._skip_depth = 0
+        self._page_break_depth = 0
+        self._heading = None  # 当前标题的 [层级, id, 文本片段]
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, self_closing=False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, self_closing=True)
+
+    def _start(self, tag, attrs, self_closing):
+        if self._skip_depth or self._page_break_depth:
+            if tag in SKIP_TAGS and not self_closing:
+                self._skip_depth += 1
+            elif self._page_break_depth and not self_closing and tag not in VOID_TAGS:
+                self._page_break_depth += 1
+            return
+        if tag in SKIP_TAGS:
+            self._skip_depth += not self_closing
+            return
+        attrs = dict(attrs)
+        if tag == 'div' and 'page-break' in (attrs.get('class') or '').split():
+            # 只有顶层的分页符有意义；它的内容（隐藏的占位符）一并丢弃
+            if not self.stack:
+                self.out.append(PAGE_BREAK)
+            self._page_break_depth = 0 if self_closing else 1
+            return
+        if tag not in ALLOWED_TAGS or (tag == 'input' and (attrs.get('type') or '').lower() != 'checkbox'):
+            return
+
+        allowed = ALLOWED_ATTRS['*'] | ALLOWED_ATTRS.get(tag, set())
+        parts = [tag]
+        for name, value in attrs.items():
+            if name not in allowed:
+                continue
+            if value is None and name in ('checked', 'disabled'):
+                value = name  # 布尔属性 <input checked>
+            elif value is None:
+                continue
+            if name in URL_ATTRS:
+                value = _safe_url(value, allow_data_image=(tag, name) == ('img', 'src'))
+            elif name == 'style':
+                value = _clean_style(value)
+            elif name == 'srcset':
+                value = value if all(_safe_url(c.split()[0]) is not None for c in value.split(',') if c.strip()) else None
+            if value:
+                parts.append(f'{name}="{escape(value)}"')
+        if tag == 'a' and attrs.get('target') == '_blank' and 'rel' not in attrs:
+            parts.append('rel="noopener noreferrer"')
+        if tag in HEADING_TAGS:
+            anchor = f'h-{len(self.toc) + 1}'
+            parts.append(f'id="{anchor}"')
+            self._heading = [int(tag[1]), anchor, []]
+        self.out.append(f'<{" ".join(parts)}>')
+        if tag not in VOID_TAGS:
+            if self_closing:
+                self.out.append(f'</{tag}>')
+            else:
+                self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if self._skip_depth:
+            if tag in SKIP_TAGS:
+                self._skip_depth -= 1
+            return
+        if self._page_break_depth:
+            if tag not in VOID_TAGS:
+                self._page_break_depth -= 1
+            return
+        if tag not in self.stack:
+            return  # 多余的结束标签
+        while self.stack:
+            open_tag = self.stack.pop()
+            self.out.append(f'</{open_tag}>')
+            if open_tag in HEADING_TAGS and self._heading:
+                level, anchor, text = self._heading
+                self.toc.append({'level': level, 'id': anchor, 'text': ' '.join(''.join(text).split())})
+                self._heading = None
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self._skip_depth or self._page_break_depth:
+            return
+        if self._heading:
+            self._heading[2].append(data)
+        self.out.append(escape(data, quote=False))
+
+    def close(self):
+        super().close()
+        while self.stack:
+            self.handle_endtag(self.stack[-1])
+
+
+def sanitize_html(html):
+    """
+    按白名单清洗 CKEditor 生成的 HTML，返回 (清洗后的 HTML, 目录)。
+    - 不在白名单中的标签被去掉（内容保留），script/style 等连同内容一起删除；
+    - 去掉事件属性、javascript: 等危险链接和不允许的 CSS 属性；
+    - 补齐未闭合的标签，输出结构完整的 HTML；
+    - 标题依次加上 id="h-1"、"h-2"…，目录为 [{'level', 'id', 'text'}]；
+    - 顶层的分页符统一输出为 PAGE_BREAK。
+    """
+    if not html:
+        return '', []
+    parser = _Sanitizer()
+    parser.feed(html)
+    parser.close()
+    return ''.join(parser.out), parser.toc
+
+
+def paginate_with_breaks(html, page_size=2000):
+    """先按分页符强制断页，每一段再按 paginate_html 的规则切分。"""
+    pages = []
+    for section in html.split(PAGE_BREAK):
+        if section.strip() or not pages:
+            pages.extend(paginate_html(section, page_size))
+    return pages
+
+
+_WORD_RE = re.compile('[\u3400-\u9fff\uf900-\ufaff]|[A-Za-z0-9]+(?:[\'’-][A-Za-z0-9]+)*')
+
+
+def count_words(text):
+    """字数统计：每个汉字算一个字，连续的字母数字算一个词。"""
+    return len(_WORD_RE.findall(text or ''))
@@ -0,0 +1,42 @@
+import os
+import tempfile
+
+from PIL import Image, ImageOps
+
+# 不依赖 Django：缩略图在独立的工作进程中生成，进程只需要导入这个模块和 Pillow
+
+SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+
+def render_thumbnail(src_path, dest_path, width, fmt):
+    """
+    生成宽度不超过 width 的缩略图（保持比例，不放大），写入 dest_path。
+    先写临时文件再原子地改名，多个进程同时生成同一张缩略图也不会读到半个文件。
+    :return: dest_path
+    """
+    with Image.open(src_path) as image:
+        image.draft('RGB', (width, width))  # JPEG 可以直接按缩小的尺寸解码，大图快很多
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            image.thumbnail((width, image.height * width // image.width or 1), Image.LANCZOS)
+        if fmt == 'jpg' and image.mode not in ('RGB', 'L'):
+            # JPEG 不支持透明通道，铺上白色背景
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image.convert('RGBA'), mask=image.convert('RGBA').getchannel('A'))
+            image = background
+        elif image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGBA')
+
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, **SAVE_OPTIONS[fmt])
+            os.replace(tmp_path, dest_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return dest_path
@@ -1,8 +1,11 @@
 # knowledge_project/views.py
+from functools import wraps
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth import login
-from .utils.code import check_code
-from django.http import HttpResponse
-from io import BytesIO
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
 from django.contrib.auth.forms import AuthenticationForm
 
 from django.urls import reverse
@@ -13,13 +16,14 @@ from django import forms
 from django.shortcuts import redirect
 from django.urls import reverse_lazy
 from django.views import View
+from django.utils.decorators import method_decorator
 from django.contrib.auth.models import User
 from django.conf import settings
-from django.core.mail import send_mail
+import os
 import random
 import string
 import time
-from django.http import JsonResponse, HttpResponseForbidden
+from django.http import JsonResponse, HttpResponseForbidden, HttpResponseNotAllowed
 from django.views.decorators.http import require_http_methods
 from django.shortcuts import get_object_or_404
 from django.conf import settings # 2. 导入 settings 模块
@@ -29,9 +33,37 @@ import json # <--- 确保在文件顶部导入了 json 模块
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.core.cache import cache
-from .models import Project, Note
-from django.db.models import F # 导入 F 对象用于精细化内容切片
-import math # 导入 math 用于计算总页数
+from .models import Asset, Project, Note, UploadSession, VersionConflict
+from . import (caching, captcha, downloads, mailqueue, paging, permissions, profiling, publishing, ratelimit,
+               rendering, revisions, search, sync, thumbnails, uploads)
+
+
+# ---------------------------------
+#  异步视图工具
+#  Django 4.2 的 login_required / require_http_methods 还不支持 async def 视图
+# ---------------------------------
+
+def alogin_required(view_func):
+    """login_required 的异步版本：在线程中解析 request.user（会话和用户查询是同步的），之后可以直接使用。"""
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def arequire_http_methods(methods):
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            return await view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
 class CustomUserCreationForm(UserCreationForm):
     email = forms.EmailField(required=True, help_text='必填项。')
 
@@ -40,6 +72,10 @@ class CustomUserCreationForm(UserCreationForm):
         fields = UserCreationForm.Meta.fields + ('email',)
 
 
+# 邮箱验证码的有效期（秒）：超时未发出的邮件不再发送，超时提交的验证码不再接受
+EMAIL_CODE_TTL = 10 * 60
+
+
 class SendEmailCodeView(View):
     """
     验证图片验证码，成功后再发送邮箱验证码。
@@ -47,24 +83,8 @@ class SendEmailCodeView(View):
     """
 
     def post(self, request, *args, **kwargs):
-        # 1. 识别客户端IP
-        ip_address = request.META.get('REMOTE_ADDR')
-
-        # 2. 定义不同时间窗口的缓存键
-        hourly_key = f"email_attempts_hourly_{ip_address}"
-        daily_key = f"email_attempts_daily_{ip_address}"
-
-        # 3. 检查小时限制 (1小时内最多3次)
-        hourly_attempts = cache.get(hourly_key, 0)
-        if hourly_attempts >= 3:
-            return JsonResponse({'status': 'error', 'message': '当前网络环境达到极限，请稍后再试。'}, status=429)
-
-        # 4. 检查天限制 (24小时内最多5次)
-        daily_attempts = cache.get(daily_key, 0)
-        if daily_attempts >= 5:
-            return JsonResponse({'status': 'error', 'message': '当前网络环境达到极限，请稍后再试。'}, status=429)
-
-        # --- 通过所有限制，继续执行原有逻辑 ---
+        # 识别客户端IP，用于下面的发送次数限制
+        ip_address = ratelimit.client_ip(request)
 
         try:
             data = json.loads(request.body)
@@ -84,33 +104,22 @@ class SendEmailCodeView(View):
         if User.objects.filter(email__iexact=email).exists():
             return JsonResponse({'status': 'error', 'message': '该邮箱已被注册'}, status=400)
 
-        # 生成并发送邮箱验证码
-        email_code = ''.join(random.choices(string.digits, k=6))
-        try:
-            send_mail(
-                '注册验证码',
-                f'您的注册验证码是：{email_code}。10分钟内有效。',
-                settings.DEFAULT_FROM_EMAIL,
-                [email],
-                fail_silently=False,
-            )
-        except Exception as e:
-            print(f"邮件发送失败 (IP: {ip_address}, Email: {email}), 错误: {e}")
-            return JsonResponse({'status': 'error', 'message': '邮件发送失败，请稍后重试。'}, status=500)
-
-        # --- 邮件发送成功后，更新两个计数器 ---
-
-        # a. 更新小时计数器
-        if hourly_attempts == 0:
-            cache.set(hourly_key, 1, timeout=3600)  # 3600秒 = 1小时
-        else:
-            cache.incr(hourly_key)
+        # 【重构】小时 (3次) 和天 (5次) 两个窗口在一次原子操作中同时检查并计数，
+        # 只有通过了图片验证码和邮箱校验、真正要发邮件的请求才会占用次数
+        limit = ratelimit.hit('send_email_code', ip_address, ['3/h', '5/d'])
+        if not limit.allowed:
+            return ratelimit.too_many_requests(limit.retry_after, '当前网络环境达到极限，请稍后再试。')
 
-        # b. 更新天计数器
-        if daily_attempts == 0:
-            cache.set(daily_key, 1, timeout=86400)  # 86400秒 = 24小时
-        else:
-            cache.incr(daily_key)
+        # 生成邮箱验证码并写入发送队列
+        # 【重构】不再在请求线程中同步连接 SMTP，由 process_email_queue 工作进程在后台发送
+        email_code = ''.join(random.choices(string.digits, k=6))
+        mailqueue.enqueue(
+            '注册验证码',
+            f'您的注册验证码是：{email_code}。{EMAIL_CODE_TTL // 60}分钟内有效。',
+            [email],
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            ttl=EMAIL_CODE_TTL,
+        )
 
         # 将验证码存入session用于注册
         request.session['registration_verification'] = {
@@ -122,39 +131,40 @@ class SendEmailCodeView(View):
         return JsonResponse({'status': 'success', 'message': '验证码已发送至您的邮箱'})
 
 
+@ratelimit.ratelimit('20/m', key='ip')
 def captcha_image(request):
     """
-    生成验证码图片并将其存储在 session 中
+    从预渲染的验证码池中取出一张图片，并把答案存储在 session 中
     """
-    # 调用工具函数生成验证码图片和随机码
-    img, code = check_code()
+    # 【重构】图片由后台线程提前生成，请求线程只需弹出一个 (PNG 字节, 验证码)
+    image_data, code = captcha.get_pool().pop()
 
     # 将验证码保存到 session，用于后续验证
     request.session['captcha_code'] = code
 
-    # 使用 BytesIO 将图像写入内存字节流
-    buffer = BytesIO()
-    img.save(buffer, format='PNG')
-    image_data = buffer.getvalue()
-
     # 返回 HTTP 响应，设置 content_type 为 image/png
-    return HttpResponse(image_data, content_type='image/png')
+    response = HttpResponse(image_data, content_type='image/png')
+    response['Cache-Control'] = 'no-store'  # 每次都必须是新的验证码
+    return response
 
 @login_required
 def home(request):
     return render(request, 'home.html')
 
 # --- 视图：实时检查用户名是否存在 (新功能) ---
-def check_username(request):
+@ratelimit.ratelimit('30/m', key='ip', algorithm='token_bucket')
+async def check_username(request):
     """一个专门用来检查用户名是否已被占用的API视图"""
     username = request.GET.get('username', None)
     if username:
         # 使用 __iexact 进行不区分大小写的查询
-        is_taken = User.objects.filter(username__iexact=username).exists()
+        # 【重构】异步视图：在 ASGI 下不占用线程池中的线程
+        is_taken = await User.objects.filter(username__iexact=username).aexists()
         return JsonResponse({'is_taken': is_taken})
     return JsonResponse({'error': 'Username not provided'}, status=400)
 
 
+@method_decorator(ratelimit.ratelimit('10/5m', key='ip', group='login'), name='post')
 class CustomLoginView(View):
     """
     一个完全自定义的登录视图，用于处理 /login/ 路径。
@@ -212,7 +222,7 @@ class SignUpView(View):
         # 1. 验证邮箱验证码 (这部分逻辑保持不变)
         verification_info = request.session.get('registration_verification')
         if not verification_info or verification_info.get('email') != email or verification_info.get(
-                'code') != email_code:
+                'code') != email_code or time.time() - verification_info.get('timestamp', 0) > EMAIL_CODE_TTL:
             # 返回一个更结构化的错误，方便前端处理
             return JsonResponse({'status': 'error', 'errors': {'emailCode': [{'message': '邮箱验证码错误或已过期'}]}},
                                 status=400)
@@ -245,182 +255,424 @@ class SignUpView(View):
 
 @login_required
 def knowledge_list(request):
-    user = request.user
-    sidebar_notes_key = f"sidebar_notes_user_{user.id}"
-    sidebar_notes = cache.get(sidebar_notes_key)
-
-    if sidebar_notes is None:
-        # 使用 Q 对象来构建更灵活的查询
-        user_projects = Project.objects.filter(members=user)
-
-        # 条件A: 笔记在用户的项目中
-        condition_in_project = Q(project__in=user_projects)
-        # 条件B: 笔记没有项目，但作者是当前用户
-        condition_no_project_own_by_user = Q(project__isnull=True, author=user)
-
-        sidebar_notes = list(
-            Note.objects.filter(
-                condition_in_project | condition_no_project_own_by_user
-            )
-            .order_by('-created_at')
-            .values('id', 'title')
-            .distinct()  # 添加 distinct 以防止因JOIN产生重复
-        )
-        cache.set(sidebar_notes_key, sidebar_notes, timeout=900)
+    # 【重构】侧边栏列表由按项目版本化的缓存合并而来，见 caching.get_sidebar_notes
+    sidebar_notes = caching.get_sidebar_notes(request.user)
 
     initial_data = {
         'sidebar_notes': sidebar_notes,
         'has_notes': bool(sidebar_notes),
+        # 【新增】前端之后用它向 api/notes/all/ 请求增量变化，而不是重新拉取完整列表
+        'sync_token': sync.issue_token(request.user),
         'csrf_token': request.COOKIES.get('csrftoken')
     }
     context = {'initial_data': initial_data}
-    return render(request, 'knowledge_list.html', context)
+    with profiling.span('render'):
+        return render(request, 'knowledge_list.html', context)
+
+
+def _note_payload(note, page, total_pages, content):
+    return {
+        'id': note.id,
+        'title': note.title,
+        'content': content,
+        'is_public': note.is_public,
+        'public_url': f"/notes/public/{note.public_id}/" if note.public_id and note.is_public else "",
+        'project': {'id': note.project.id, 'title': note.project.title} if note.project else None,
+        'created_at': note.created_at.strftime('%Y-%m-%d %H:%M'),
+        'author': {'id': note.author.id, 'username': note.author.username},
+        'pagination': {
+            'current_page': page,
+            'total_pages': total_pages,
+        },
+        'version': note.version,
+    }
 
 
-@login_required
-@require_http_methods(["GET", "PUT"])
-def note_detail_api(request, note_id):
-    note = get_object_or_404(Note, pk=note_id)
-
-    # --- 权限检查 (保持不变) ---
-    has_project_permission = note.project and note.project.members.filter(pk=request.user.pk).exists()
-    is_author_of_unassigned_note = not note.project and note.author == request.user
-    if not (has_project_permission or is_author_of_unassigned_note):
+def _note_response(data, note, status=200):
+    """【新增】笔记的 JSON 响应带上 ETag（即版本号），客户端保存时用 If-Match 回传。"""
+    response = profiling.json_response(data, status=status)
+    response['ETag'] = f'"{note.version}"'
+    return response
+
+
+def _expected_version(request, data):
+    """客户端编辑时所基于的版本：If-Match 头或请求体中的 version，都没有时返回 None。"""
+    if_match = request.headers.get('If-Match', '').strip()
+    if if_match and if_match != '*':
+        etags = parse_etags(if_match)
+        if not etags:
+            raise ValueError(if_match)
+        return int(etags[0].removeprefix('W/').strip('"'))
+    if data.get('version') is not None:
+        return int(data['version'])
+    return None
+
+
+def _conflict_response(server):
+    """409：返回服务器上的最新版本，由客户端合并后带着新的版本号重新提交。"""
+    return _note_response({
+        'error': '笔记已被其他人修改，请合并后重试。',
+        'server': {
+            'id': server.id,
+            'title': server.title,
+            'content': server.content or '',
+            'is_public': server.is_public,
+            'version': server.version,
+            'updated_at': server.updated_at.isoformat(),
+        },
+    }, server, status=409)
+
+
+def _save_note(note, data, user):
+    """【重构】只写入发生变化的列，返回写入的列名；没有变化时不执行 UPDATE。"""
+    changed = []
+    for field in ('title', 'is_public'):
+        if field in data and data[field] != getattr(note, field):
+            setattr(note, field, data[field])
+            changed.append(field)
+
+    # 【逻辑完善】如果请求中包含 content，说明是从编辑模式保存，需要更新完整内容
+    # 正文是延迟加载的，不读出来比较；内容没变时渲染管线会按哈希跳过
+    if 'content' in data:
+        note.content = data['content']
+        changed.append('content')
+
+    if changed:
+        # 保存后 post_save 信号会递增所属项目的缓存版本号，所有成员的侧边栏都会看到新标题
+        # 【新增】同时记录一个历史版本，修改者为当前用户（见 revisions.py）
+        note._revision_author = user
+        # 条件更新：期间有其他人保存过时抛出 VersionConflict（见 Note.save）
+        note.save(update_fields=changed)
+    return changed
+
+
+@alogin_required
+@arequire_http_methods(["GET", "PUT"])
+async def note_detail_api(request, note_id):
+    # 【重构】异步视图：读取路径全部使用异步 ORM 和异步缓存客户端 (acache.py)，不占用线程池
+    # 【优化】分页读取不需要完整内容，Note.objects 默认不读取正文（见 NoteQuerySet），无权限的请求也不会读取；
+    # project 和 author 在构造响应时都会用到，一次 JOIN 取回
+    try:
+        note = await Note.objects.select_related('project', 'author').aget(pk=note_id)
+    except Note.DoesNotExist:
+        raise Http404("笔记不存在。")
+
+    # --- 权限检查 ---
+    # 【重构】角色解析结果缓存在进程内和 Redis 中，命中时不产生数据库查询
+    role = await permissions.anote_role(request.user, note)
+    if role is None:
         return HttpResponseForbidden("您没有权限访问此笔记。")
 
     # --- GET 请求处理 ---
     if request.method == 'GET':
-        full_content = note.content if note.content else ""
-
         # 【逻辑修复】检查前端是否请求完整内容
         if request.GET.get('full_content') == 'true':
             # 如果是，直接返回完整内容，不进行分页
-            return JsonResponse({
+            # content 是延迟加载的字段，在异步视图中需要显式查询
+            content = await Note.objects.acontent_of(note.pk)
+            return _note_response({
                 'id': note.id,
                 'title': note.title,
-                'content': full_content,
+                'content': content or "",
+                'version': note.version,
                 # ... 其他字段可以酌情返回或简化
-            })
+            }, note)
 
-        # --- 如果不是请求完整内容，则执行分页逻辑 ---
-        CHARS_PER_PAGE = 2000
+        # --- 如果不是请求完整内容，则只读取请求的那一页 ---
         try:
             page = int(request.GET.get('page', 1))
-            if page < 1: page = 1
         except ValueError:
             page = 1
 
-        total_content_length = len(full_content)
-        # 【BUG 修复】使用正确的变量名 total_content_length
-        total_pages = math.ceil(total_content_length / CHARS_PER_PAGE) if total_content_length > 0 else 1
-
-        # 确保请求的页码不超过总页数
-        if page > total_pages:
-            page = total_pages
-
-        start_index = (page - 1) * CHARS_PER_PAGE
-        end_index = start_index + CHARS_PER_PAGE
-        current_page_content = full_content[start_index:end_index]
-
-        data = {
-            'id': note.id,
-            'title': note.title,
-            'content': current_page_content,
-            'is_public': note.is_public,
-            'public_url': f"/notes/public/{note.public_id}/" if note.public_id and note.is_public else "",
-            'project': {'id': note.project.id, 'title': note.project.title} if note.project else None,
-            'created_at': note.created_at.strftime('%Y-%m-%d %H:%M'),
-            'author': {'id': note.author.id, 'username': note.author.username},
-            'pagination': {
-                'current_page': page,
-                'total_pages': total_pages,
-            }
-        }
-        return JsonResponse(data)
+        # 【重构】页码越界处理和分页块读取都在 paging.aget_page 中完成
+        page, total_pages, current_page_content = await paging.aget_page(note, page)
+
+        data = _note_payload(note, page, total_pages, current_page_content)
+        if page == 1:
+            # 【新增】目录和字数在保存时由渲染管线预先计算，只随第一页返回，翻页时不再额外查询
+            render = await rendering.aget_render(note, fields=rendering.SUMMARY_FIELDS)
+            data['toc'], data['word_count'] = render.toc, render.word_count
+        return _note_response(data, note)
 
     # --- PUT 请求处理 ---
-    if request.method == 'PUT':
+    # 查看者 (viewer) 只能阅读，不能修改
+    if not permissions.can_write(role):
+        return HttpResponseForbidden("您没有权限修改此笔记。")
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': '无效的JSON格式'}, status=400)
+    try:
+        expected = _expected_version(request, data)
+    except (TypeError, ValueError):
+        return JsonResponse({'error': '无效的版本号 (If-Match / version)'}, status=400)
+    if 'content' in data and expected is None:
+        # 修改正文必须说明基于哪个版本，否则无法发现并发修改，只会静默覆盖
+        return JsonResponse({'error': '修改正文时必须提供 If-Match 或 version'}, status=428)
+
+    # 【新增】乐观并发控制：客户端基于旧版本编辑时返回 409，不覆盖其他成员的修改
+    try:
+        if expected is not None and expected != note.version:
+            raise VersionConflict(note.pk)
+        # 保存会触发渲染、索引等同步的信号处理，整体放到线程中执行
+        await sync_to_async(_save_note)(note, data, request.user)
+    except VersionConflict:
         try:
-            data = json.loads(request.body)
-        except json.JSONDecodeError:
-            return JsonResponse({'error': '无效的JSON格式'}, status=400)
-
-        note.title = data.get('title', note.title)
-        note.is_public = data.get('is_public', note.is_public)
-
-        # 【逻辑完善】如果请求中包含 content，说明是从编辑模式保存，需要更新完整内容
-        if 'content' in data:
-            note.content = data['content']
-
-        note.save()
-
-        # 清理侧边栏缓存，以便标题更新能及时显示
-        cache.delete(f"sidebar_notes_user_{request.user.id}")
-
-        # --- 保存后，返回更新后的笔记数据（第一页的内容） ---
-        # 这使得前端在保存后能立即看到最新的预览，体验更好
-        full_content = note.content if note.content else ""
-        CHARS_PER_PAGE = 2000
-        total_content_length = len(full_content)
-        total_pages = math.ceil(total_content_length / CHARS_PER_PAGE) if total_content_length > 0 else 1
-
-        updated_data = {
-            'id': note.id,
-            'title': note.title,
-            'content': full_content[:CHARS_PER_PAGE],  # 返回第一页的内容
-            'is_public': note.is_public,
-            'public_url': f"/notes/public/{note.public_id}/" if note.public_id and note.is_public else "",
-            'project': {'id': note.project.id, 'title': note.project.title} if note.project else None,
-            'created_at': note.created_at.strftime('%Y-%m-%d %H:%M'),
-            'author': {'id': note.author.id, 'username': note.author.username},
-            'pagination': {
-                'current_page': 1,  # 保存后总是回到第一页
-                'total_pages': total_pages
-            }
-        }
-        return JsonResponse(updated_data)
+            server = await Note.objects.with_content().aget(pk=note.pk)
+        except Note.DoesNotExist:
+            raise Http404("笔记不存在。")
+        return _conflict_response(server)
+
+    # --- 保存后，返回更新后的笔记数据（第一页的内容） ---
+    # 这使得前端在保存后能立即看到最新的预览，体验更好
+    # 分页块已在 post_save 信号中重建，这里直接读取第一页
+    _, total_pages, first_page_content = await paging.aget_page(note, 1)
+    # 保存后总是回到第一页
+    return _note_response(_note_payload(note, 1, total_pages, first_page_content), note)
+
+
+@alogin_required
+async def search_notes_api(request):
+    """
+    【重构】基于倒排索引的全文检索，替代原来的 icontains 全表扫描。
+    参数: q=关键词, limit=每页条数 (默认 20，最大 100), cursor=上一页返回的 next_cursor
+    """
+    query = request.GET.get('q', '').strip()
+    if not query: return JsonResponse({'results': [], 'next_cursor': None})
+
+    try:
+        limit = int(request.GET.get('limit', search.DEFAULT_LIMIT))
+        cursor = int(request.GET.get('cursor') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'limit 和 cursor 必须是整数'}, status=400)
+
+    return profiling.json_response(await search.asearch_notes(request.user, query, limit=limit, cursor=cursor))
+
+
+@alogin_required
+async def get_all_notes_api(request):
+    """
+    返回用户可见的全部笔记。支持三种模式：
+    - 无参数：一次性返回完整列表（与 knowledge_list 共用同一套版本化缓存）；
+    - limit=N&cursor=...：按 (created_at, id) 键集分页，第一页附带 sync_token；
+    - since=<sync_token>：增量同步，只返回此后新建/改名的笔记以及已删除笔记的 ID。
+    """
+    since = request.GET.get('since')
+    limit = request.GET.get('limit')
+    try:
+        if since:
+            return profiling.json_response(await sync.adelta(request.user, since))
+        if limit is not None:
+            return profiling.json_response(await sync.alist_page(request.user, int(limit), request.GET.get('cursor')))
+    except ValueError:
+        # InvalidToken 也是 ValueError 的子类
+        return JsonResponse({'error': '无效的分页参数或同步令牌'}, status=400)
+
+    # 与 knowledge_list 共用同一套版本化缓存
+    all_notes = await caching.aget_sidebar_notes(request.user)
+    return profiling.json_response(all_notes, safe=False)
+
+
+# ---------------------------------
+#  笔记历史版本 (见 revisions.py)
+# ---------------------------------
+
+def _note_with_role(request, note_id):
+    note = get_object_or_404(Note.objects.select_related('project', 'author'), pk=note_id)
+    return note, permissions.note_role(request.user, note)
 
 
 @login_required
-def search_notes_api(request):
-    query = request.GET.get('q', '')
-    if not query: return JsonResponse([], safe=False)
+@require_http_methods(["GET"])
+def note_revisions_api(request, note_id):
+    """【新增】笔记的历史版本列表，按版本号倒序。参数: limit (默认 50，最大 200), cursor=上一页返回的 next_cursor"""
+    note, role = _note_with_role(request, note_id)
+    if role is None:
+        return HttpResponseForbidden("您没有权限访问此笔记。")
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 50)), 200))
+        before = int(request.GET.get('cursor') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'limit 和 cursor 必须是整数'}, status=400)
+    return JsonResponse(revisions.list_revisions(note.pk, limit=limit, before=before))
 
-    user = request.user
-    user_projects = Project.objects.filter(members=user)
 
-    # 复用已修正的查询逻辑
-    condition_in_project = Q(project__in=user_projects)
-    condition_no_project_own_by_user = Q(project__isnull=True, author=user)
-    search_condition = Q(title__icontains=query) | Q(content__icontains=query)
+@login_required
+@require_http_methods(["GET"])
+def note_revision_diff_api(request, note_id):
+    """【新增】比较两个版本的正文。参数: from=版本号, to=版本号（默认最新版本）"""
+    note, role = _note_with_role(request, note_id)
+    if role is None:
+        return HttpResponseForbidden("您没有权限访问此笔记。")
+    try:
+        from_number = int(request.GET['from'])
+        to_number = int(request.GET.get('to') or revisions.latest_number(note.pk) or 0)
+        changes = revisions.diff(note.pk, from_number, to_number)
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'from 和 to 必须是整数版本号'}, status=400)
+    except revisions.RevisionNotFound as e:
+        raise Http404(str(e))
+    return JsonResponse({'from': from_number, 'to': to_number, 'changes': changes})
 
-    results = Note.objects.filter(
-        search_condition & (condition_in_project | condition_no_project_own_by_user)
-    ).order_by('-created_at').values('id', 'title').distinct()
 
-    return JsonResponse(list(results), safe=False)
+@login_required
+@require_http_methods(["POST"])
+def note_revision_restore_api(request, note_id, number):
+    """【新增】把笔记恢复到某个历史版本，恢复后的内容会成为一个新的版本。"""
+    note, role = _note_with_role(request, note_id)
+    if not permissions.can_write(role):
+        return HttpResponseForbidden("您没有权限修改此笔记。")
+    try:
+        revisions.restore(note, number, author=request.user)
+    except revisions.RevisionNotFound as e:
+        raise Http404(str(e))
+    except VersionConflict:
+        return _conflict_response(get_object_or_404(Note.objects.with_content(), pk=note.pk))
+    _, total_pages, first_page_content = paging.get_page(note, 1)
+    return _note_response(_note_payload(note, 1, total_pages, first_page_content), note)
+
+
+@require_http_methods(["GET", "HEAD"])
+def public_note_view(request, public_id):
+    """
+    【新增】公开笔记页面，无需登录。
+    整页按 public_id 缓存在 Redis 中，带强 ETag 和 public, s-maxage，可以被 CDN 缓存；详见 publishing.py。
+    """
+    page = publishing.get_page(public_id)
+    if page is None:
+        raise Http404("笔记不存在或未公开。")
+    if page['etag'] in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(page['body'], content_type='text/html; charset=utf-8')
+    response['ETag'] = page['etag']
+    response['Last-Modified'] = page['last_modified']
+    response['Cache-Control'] = publishing.cache_control()
+    return response
 
 
 @login_required
-def get_all_notes_api(request):
-    user = request.user
-    sidebar_notes_key = f"sidebar_notes_user_{user.id}"
-    all_notes = cache.get(sidebar_notes_key)
-
-    if all_notes is None:
-        # 复用已修正的查询逻辑
-        user_projects = Project.objects.filter(members=user)
-        condition_in_project = Q(project__in=user_projects)
-        condition_no_project_own_by_user = Q(project__isnull=True, author=user)
-
-        all_notes = list(
-            Note.objects.filter(
-                condition_in_project | condition_no_project_own_by_user
-            )
-            .order_by('-created_at')
-            .values('id', 'title')
-            .distinct()
-        )
-        cache.set(sidebar_notes_key, all_notes, timeout=900)
+@require_http_methods(["GET", "HEAD"])
+def asset_download(request, asset_id):
+    """
+    【新增】项目资产下载：只有项目成员可以访问。
+    文件按块流式发送并支持 Range；生产环境可交给前端代理发送（见 downloads.py）。
+    ?download=1 时以附件形式下载，否则在浏览器中直接打开。
+    """
+    asset = get_object_or_404(Asset.objects.only('id', 'name', 'file', 'project_id'), pk=asset_id)
+    if permissions.get_role(request.user, asset.project_id) is None:
+        return HttpResponseForbidden("您没有权限访问此资产。")
+    return downloads.serve_asset(request, asset, as_attachment=request.GET.get('download') == '1')
+
 
-    return JsonResponse(all_notes, safe=False)
\ No newline at end of file
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def asset_thumbnail(request, asset_id, size, fmt):
+    """
+    【新增】图片资产的缩略图，地址稳定，可以直接用在 <img src> 中。
+    缩略图由后台进程池生成；还没生成好时临时重定向到原图，不让页面等待。
+    """
+    asset = get_object_or_404(Asset.objects.only('id', 'name', 'file', 'project_id', 'asset_type'), pk=asset_id)
+    if permissions.get_role(request.user, asset.project_id) is None:
+        return HttpResponseForbidden("您没有权限访问此资产。")
+    options = thumbnails.get_options()
+    if size not in options['SIZES'] or fmt not in options['FORMATS'] or not thumbnails.is_image(asset):
+        raise Http404("没有这个尺寸的缩略图。")
+
+    name = thumbnails.get_thumbnail(asset, size, fmt)
+    if name is None:
+        response = redirect('asset_download', asset_id=asset.pk)
+        response['Cache-Control'] = 'no-store'
+        return response
+    stem = os.path.splitext(asset.name or 'image')[0]
+    return downloads.serve_file(request, name, f'{stem}_{size}.{fmt}')
+
+
+# ---------------------------------
+#  分片上传 (见 uploads.py)
+# ---------------------------------
+
+def _upload_error(e):
+    return JsonResponse({'error': str(e)}, status=400)
+
+
+@login_required
+@require_http_methods(["POST"])
+def upload_create_api(request):
+    """【新增】创建分片上传会话。参数 (JSON): project_id, filename, size, chunk_size (可选), asset_type (可选)"""
+    try:
+        data = json.loads(request.body or b'{}')
+        project_id = int(data.get('project_id'))
+    except (TypeError, ValueError):
+        return JsonResponse({'error': '无效的请求数据或 project_id'}, status=400)
+
+    project = get_object_or_404(Project.objects.only('id'), pk=project_id)
+    if not permissions.can_write(permissions.get_role(request.user, project.pk)):
+        return HttpResponseForbidden("您没有权限向此项目上传文件。")
+    try:
+        session = uploads.create_session(request.user, project, data.get('filename'), data.get('size'),
+                                         chunk_size=data.get('chunk_size'),
+                                         asset_type=data.get('asset_type') or 'file')
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    return JsonResponse(uploads.describe(session), status=201)
+
+
+@login_required
+@require_http_methods(["GET", "DELETE"])
+def upload_detail_api(request, upload_id):
+    """【新增】GET 查询已收到的分片（用于续传）；DELETE 取消上传。"""
+    session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+    if request.method == 'DELETE':
+        uploads.abort(session)
+        return JsonResponse({'status': 'success'})
+    return JsonResponse(uploads.describe(session))
+
+
+@login_required
+@require_http_methods(["PUT"])
+def upload_chunk_api(request, upload_id, offset):
+    """【新增】上传 offset 处的一个分片：请求体为原始字节，X-Chunk-SHA256 头为该分片的 SHA-256。"""
+    session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        # 直接从请求流中分块读取，不经过 request.body，分片不会整体读入内存
+        index = uploads.write_chunk(session, offset, request, content_length,
+                                    request.headers.get('X-Chunk-SHA256'))
+    except uploads.TooManyChunks:
+        return ratelimit.too_many_requests(1, "同时上传的分片过多，请稍后重试。")
+    except (uploads.UploadError, ValueError) as e:
+        return _upload_error(e)
+    return JsonResponse({'status': 'success', 'offset': offset, 'index': index})
+
+
+@login_required
+@require_http_methods(["POST"])
+def upload_complete_api(request, upload_id):
+    """【新增】合并分片并生成资产。可选参数 (JSON): sha256，整个文件的校验和。"""
+    session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+    try:
+        data = json.loads(request.body) if request.content_type == 'application/json' and request.body else {}
+        asset = uploads.complete(session, request.user, expected_sha256=data.get('sha256'))
+    except uploads.UploadForbidden as e:
+        return HttpResponseForbidden(str(e))
+    except (uploads.UploadError, ValueError) as e:
+        return _upload_error(e)
+    return JsonResponse({
+        'status': 'success',
+        'asset_id': asset.pk,
+        'name': asset.name,
+        'download_url': reverse('asset_download', args=[asset.pk]),
+    })
+
+
+@require_http_methods(["GET"])
+def metrics(request):
+    """
+    【新增】Prometheus 格式的请求指标（见 profiling.py）。
+    管理员登录后可以直接访问；Prometheus 抓取时使用 KNOWLEDGE_PROFILING['METRICS_TOKEN'] 作为 Bearer 令牌。
+    """
+    if not profiling.metrics_allowed(request):
+        return HttpResponseForbidden("您没有权限访问此页面。")
+    return HttpResponse(profiling.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
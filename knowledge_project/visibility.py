@@ -0,0 +1,98 @@
+# knowledge_project/visibility.py
+"""
+笔记可见性表 (NoteVisibility) 的维护。
+
+用户可见的笔记 = 用户参与的项目中的笔记 + 没有项目且作者是用户本人的笔记。
+原来每次查询都要构造 project__in=Project.objects.filter(members=user)，JOIN 成员关系表后还需要 DISTINCT，
+MySQL 上是一个子查询加一次临时表排序。现在把结果预先展开成 (用户, 笔记) 行：
+
+- 笔记新建、移动到其他项目或更换作者时，重建这篇笔记的行；
+- 成员加入项目时补上该成员对项目中所有笔记的行，退出时删除；
+- 笔记、用户、项目删除时，行随外键级联删除。
+
+bulk_create 不触发信号，批量写入笔记后需要调用 index_notes()；数据不一致时运行 rebuild_note_visibility 命令。
+"""
+from collections import defaultdict
+
+from django.db import transaction
+
+from .models import Note, NoteVisibility, ProjectMembership
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _audiences(notes):
+    """返回 {笔记 ID: [可见用户 ID, ...]}，项目成员只查询一次。"""
+    project_ids = {note.project_id for note in notes if note.project_id}
+    members = defaultdict(list)
+    if project_ids:
+        for user_id, project_id in (ProjectMembership.objects.filter(project_id__in=project_ids)
+                                    .values_list('user_id', 'project_id')):
+            members[project_id].append(user_id)
+    return {note.pk: members[note.project_id] if note.project_id else [note.author_id] for note in notes}
+
+
+def _rows(notes):
+    audiences = _audiences(notes)
+    return [NoteVisibility(user_id=user_id, note_id=note.pk, created_at=note.created_at)
+            for note in notes for user_id in audiences[note.pk]]
+
+
+def index_notes(notes, batch_size=DEFAULT_BATCH_SIZE):
+    """重建一批笔记的可见性行。"""
+    if not notes:
+        return
+    rows = _rows(notes)
+    with transaction.atomic():
+        NoteVisibility.objects.filter(note_id__in=[note.pk for note in notes]).delete()
+        NoteVisibility.objects.bulk_create(rows, batch_size=batch_size)
+
+
+def index_note(note):
+    index_notes([note])
+
+
+def add_member(user_id, project_id, batch_size=DEFAULT_BATCH_SIZE):
+    """成员加入项目：补上该成员对项目中全部笔记的行。已存在的行（例如重复调用）被忽略。"""
+    notes = Note.objects.filter(project_id=project_id).values_list('pk', 'created_at')
+    rows = [NoteVisibility(user_id=user_id, note_id=note_id, created_at=created_at)
+            for note_id, created_at in notes.iterator(chunk_size=batch_size)]
+    NoteVisibility.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+
+
+def remove_member(user_id, project_id):
+    """成员退出项目：删除该成员在这个项目中的全部行。其本人未分配项目的笔记不受影响。"""
+    NoteVisibility.objects.filter(user_id=user_id, note__project_id=project_id).delete()
+
+
+def rebuild(batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    在一个事务中清空并按笔记主键顺序分批重建整张表，返回写入的行数。
+    重建期间其他连接读到的仍是旧数据。
+    """
+    say = progress or (lambda message: None)
+    total = 0
+    with transaction.atomic():
+        NoteVisibility.objects.all().delete()
+        batch = []
+        notes = Note.objects.order_by('pk').only('pk', 'project_id', 'author_id', 'created_at')
+        for note in notes.iterator(chunk_size=batch_size):
+            batch.append(note)
+            if len(batch) >= batch_size:
+                total += _insert(batch, batch_size)
+                batch = []
+                say(f"已写入 {total} 行")
+        if batch:
+            total += _insert(batch, batch_size)
+    return total
+
+
+def _insert(notes, batch_size):
+    rows = _rows(notes)
+    NoteVisibility.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def visible_note_ids(user):
+    """用户可见笔记 ID 的子查询，用于 note_id__in=... 形式的半连接过滤。"""
+    return NoteVisibility.objects.filter(user=user).values('note_id')
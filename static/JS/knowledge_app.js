@@ -28,11 +28,15 @@ createApp({
     const selectedNoteId = ref(null);
     const selectedNote = ref(null);
     const fullNoteContentForEditing = ref('');
+    let baseVersion = null; // 编辑所基于的版本号（响应的 ETag），保存时作为 If-Match 发送
+    let baseFields = null;  // 该版本的标题和公开状态，发生冲突时用来判断对方是否也改了它们
     const isLoading = ref(false);
     const isEditing = ref(false);
     const isSidebarCollapsed = ref(localStorage.getItem('isSidebarCollapsed') === 'true');
     const searchQuery = ref('');
     let editorInstance = null;
+    let realtime = null; // 当前笔记的实时协作会话 (note_realtime.js)
+    const collaborators = ref([]);
     const copyStatus = ref('copy');
     const toast = ref({ visible: false, message: '', type: 'success' });
     let toastTimer = null;
@@ -63,7 +67,50 @@ createApp({
     const showConfirm = (message) => new Promise((resolve) => {
       confirmDialog.value = { message, visible: true, onConfirm: () => { resolve(true); confirmDialog.value.visible = false; }, onCancel: () => { resolve(false); confirmDialog.value.visible = false; } };
     });
+    const stopRealtime = () => {
+      if (realtime) { realtime.close(); realtime = null; }
+      collaborators.value = [];
+    };
+    // --- 实时协作：编辑器内容的变化发送给服务器，其他人的修改应用到编辑器 ---
+    const startRealtime = (ed) => {
+      if (typeof NoteRealtime === 'undefined' || !selectedNote.value) return;
+      stopRealtime();
+      let applyingRemote = false;
+      const setContent = (content) => {
+        applyingRemote = true;
+        try { ed.setContent(content); } finally { applyingRemote = false; }
+      };
+      const session = new NoteRealtime(selectedNote.value.id, {
+        onInit: ({ content, canEdit, presence }) => {
+          setContent(content);
+          ed.mode.set(canEdit ? 'design' : 'readonly');
+          collaborators.value = presence;
+          // 编辑器会规范化 HTML，规范化产生的差异作为第一个操作发送
+          if (canEdit) session.update(ed.getContent());
+        },
+        onRemote: (content) => {
+          const bookmark = ed.selection.getBookmark(2, true);
+          setContent(content);
+          try { ed.selection.moveToBookmark(bookmark); } catch (e) { /* 光标所在的内容已被删除 */ }
+        },
+        onPresence: (message) => {
+          const others = collaborators.value.filter(c => c.conn !== message.conn);
+          if (message.event === 'leave') { collaborators.value = others; return; }
+          if (message.event === 'join') showToast(`${message.username} 加入了编辑`, 'info');
+          collaborators.value = [...others, message];
+        },
+        onReset: (reason) => {
+          showToast(reason === 'conflict' ? '笔记已在其他地方保存，已载入最新内容' : '协作会话已重置，正在重新连接', 'info');
+        },
+        onError: (message) => showToast(message, 'error'),
+      });
+      ed.on('input change undo redo', () => {
+        if (!applyingRemote && realtime === session) session.update(ed.getContent());
+      });
+      realtime = session;
+    };
     const destroyEditor = () => {
+      stopRealtime();
       if (editorInstance) {
         try { editorInstance.remove(); } catch (e) { console.error("销毁编辑器时出错:", e); }
         finally { editorInstance = null; }
@@ -121,6 +168,7 @@ createApp({
             editorInstance = ed;
             if (isEditing.value) {
               ed.setContent(fullNoteContentForEditing.value);
+              startRealtime(ed);
             }
           });
         }
@@ -142,6 +190,7 @@ createApp({
         if (!previewResponse.ok) throw new Error('笔记加载失败');
         const noteData = await previewResponse.json();
         selectedNote.value = noteData;
+        baseFields = { title: noteData.title, is_public: noteData.is_public };
         currentPage.value = noteData.pagination.current_page;
         totalPages.value = noteData.pagination.total_pages;
         if (fullNoteContentForEditing.value === '' || selectedNoteId.value !== noteId) {
@@ -150,6 +199,7 @@ createApp({
           if (!fullContentResponse.ok) throw new Error('无法加载笔记完整内容');
           const fullNoteData = await fullContentResponse.json();
           fullNoteContentForEditing.value = fullNoteData.content;
+          baseVersion = fullNoteData.version;
         }
         selectedNoteId.value = noteId;
       } catch (error) {
@@ -159,30 +209,64 @@ createApp({
         isLoading.value = false;
       }
     };
-    const updateNote = async (isFullUpdate = true) => {
+    // 409：笔记已被其他人修改，响应中的 server 是服务器上的最新版本
+    const resolveConflict = async (server, body) => {
+      const base = baseFields || {};
+      if (!('content' in body) && server.title === base.title && server.is_public === base.is_public) {
+        // 只改了标题/公开状态，而对方只改了正文（例如协作会话写回），两者不冲突，基于新版本重新提交
+        baseVersion = server.version;
+        return true;
+      }
+      const useServer = await showConfirm(
+        `笔记已被其他人修改（版本 ${server.version}，${new Date(server.updated_at).toLocaleString()}）。\n` +
+        '确定：放弃您的修改，载入对方的版本；取消：保留您的修改，再次保存将覆盖对方的版本。');
+      baseVersion = server.version;
+      baseFields = { title: server.title, is_public: server.is_public };
+      if (useServer) {
+        selectedNote.value = { ...selectedNote.value, title: server.title, is_public: server.is_public };
+        fullNoteContentForEditing.value = server.content;
+        const titleInput = document.querySelector('.edit-header input[type=text]');
+        if (titleInput) titleInput.value = server.title;
+        if (editorInstance) editorInstance.setContent(server.content);
+        showToast('已载入最新版本', 'info');
+      }
+      return false;
+    };
+    const updateNote = async (isFullUpdate = true, retried = false) => {
       if (!selectedNote.value) return;
       const currentTitleInput = document.querySelector('.edit-header input[type=text]');
       const currentTitle = currentTitleInput ? currentTitleInput.value : selectedNote.value.title;
       const body = { title: currentTitle, is_public: selectedNote.value.is_public };
-      if (isEditing.value) {
-        body.content = editorInstance ? editorInstance.getContent() : fullNoteContentForEditing.value;
+      const content = editorInstance ? editorInstance.getContent() : fullNoteContentForEditing.value;
+      // 协作编辑时正文由服务器定期写回，这里只保存标题和公开状态，避免覆盖其他人还没有写回的修改
+      if (isEditing.value && !(realtime && realtime.connected)) {
+        body.content = content;
       }
+      const version = baseVersion ?? selectedNote.value.version;
       try {
         const response = await fetch(`/api/notes/${selectedNote.value.id}/`, {
           method: 'PUT',
-          headers: { 'Content-Type': 'application/json', 'X-CSRFToken': csrfToken },
+          headers: { 'Content-Type': 'application/json', 'X-CSRFToken': csrfToken, 'If-Match': `"${version}"` },
           body: JSON.stringify(body)
         });
+        if (response.status === 409) {
+          const { server } = await response.json();
+          if (await resolveConflict(server, body) && !retried) return updateNote(isFullUpdate, true);
+          return;
+        }
         if (!response.ok) {
           const errorData = await response.json().catch(() => ({ detail: '未知错误' }));
-          throw new Error(errorData.detail || '保存失败');
+          throw new Error(errorData.error || errorData.detail || '保存失败');
         }
         const updatedNoteData = await response.json();
+        baseVersion = updatedNoteData.version;
+        baseFields = { title: updatedNoteData.title, is_public: updatedNoteData.is_public };
         if (isEditing.value) {
           selectedNote.value = { ...updatedNoteData };
-          fullNoteContentForEditing.value = body.content;
+          fullNoteContentForEditing.value = content;
         } else {
           selectedNote.value.is_public = updatedNoteData.is_public;
+          selectedNote.value.version = updatedNoteData.version;
         }
         const noteInSidebar = sidebarNotes.value.find(n => n.id === updatedNoteData.id);
         if (noteInSidebar) noteInSidebar.title = updatedNoteData.title;
@@ -202,6 +286,7 @@ createApp({
           const res = await fetch(`/api/notes/${selectedNote.value.id}/?full_content=true`);
           const data = await res.json();
           fullNoteContentForEditing.value = data.content;
+          baseVersion = data.version;
         } catch (error) { showToast('加载编辑内容失败: ' + error.message, 'error'); return; }
         finally { isLoading.value = false; }
       }
@@ -235,13 +320,50 @@ createApp({
       }
       selectNote(selectedNoteId.value, targetPage);
     };
+    // --- 侧边栏增量同步 ---
+    // allNotes 保存完整的笔记列表，清空搜索时不再整体重新拉取，只向服务器请求上次同步以来的变化
+    let allNotes = [...sidebarNotes.value];
+    let syncToken = initialData.sync_token || null;
+    const byCreatedDesc = (a, b) => (a.created_at < b.created_at ? 1 : a.created_at > b.created_at ? -1 : b.id - a.id);
+    const fullSync = async () => {
+      const notes = [];
+      let cursor = null;
+      let token = null;
+      do {
+        const url = '/api/notes/all/?limit=500' + (cursor ? `&cursor=${encodeURIComponent(cursor)}` : '');
+        const response = await fetch(url);
+        if (!response.ok) throw new Error('笔记列表加载失败');
+        const page = await response.json();
+        notes.push(...page.results);
+        token = token || page.sync_token;  // 以第一页的令牌为准，之后的变化会在下次增量中补上
+        cursor = page.next_cursor;
+      } while (cursor);
+      allNotes = notes;
+      syncToken = token;
+    };
+    const syncAllNotes = async () => {
+      if (!syncToken) return fullSync();
+      const response = await fetch(`/api/notes/all/?since=${encodeURIComponent(syncToken)}`);
+      if (!response.ok) throw new Error('笔记列表同步失败');
+      const delta = await response.json();
+      if (delta.reset) return fullSync();
+      const removed = new Set([...delta.deleted, ...delta.changed.map(n => n.id)]);
+      allNotes = allNotes.filter(n => !removed.has(n.id)).concat(delta.changed).sort(byCreatedDesc);
+      syncToken = delta.sync_token;
+    };
+
     const searchNotes = async () => {
       const query = searchQuery.value.trim();
-      const url = query ? `/api/notes/search/?q=${encodeURIComponent(query)}` : '/api/notes/all/';
       try {
-        const response = await fetch(url);
+        if (!query) {
+          await syncAllNotes();
+          sidebarNotes.value = allNotes;
+          return;
+        }
+        const response = await fetch(`/api/notes/search/?q=${encodeURIComponent(query)}`);
         if (!response.ok) throw new Error('搜索失败');
-        sidebarNotes.value = await response.json();
+        const data = await response.json();
+        sidebarNotes.value = data.results;
       } catch (error) {
         showToast(error.message, 'error');
       }
@@ -266,6 +388,7 @@ createApp({
       openNewNoteEditor: () => { showToast('此功能正在开发中...', 'info'); },
       searchNotes,
       editorElRef,
+      collaborators,
 
       handleSearchClickWhenCollapsed,
       copyPublicUrl: () => {
@@ -284,7 +284,8 @@ createApp({
       try {
         const response = await fetch(`/api/notes/${selectedNote.value.id}/`, {
           method: 'PUT',
-          headers: { 'Content-Type': 'application/json', 'X-CSRFToken': csrfToken },
+          // 正文修改必须带上所基于的版本号，否则服务器返回 428
+          headers: { 'Content-Type': 'application/json', 'X-CSRFToken': csrfToken, 'If-Match': `"${selectedNote.value.version}"` },
           body: JSON.stringify({
             title: currentTitle,
             content: contentData,
@@ -295,7 +296,7 @@ createApp({
         if (!response.ok) {
           // 尝试解析错误信息
           const errorData = await response.json().catch(() => ({ detail: '未知错误' }));
-          throw new Error(errorData.detail || '保存失败');
+          throw new Error(errorData.error || errorData.detail || '保存失败');
         }
 
         // 保存成功
@@ -0,0 +1,226 @@
+/**
+ * static/JS/note_realtime.js
+ * 笔记实时协作的浏览器端：连接 ws/notes/<id>/，把编辑器中的修改转换为操作发送给服务器，
+ * 并把其他人的操作应用到本地（服务器端见 knowledge_project/realtime.py 和 ot.py）。
+ *
+ * 操作格式与服务器相同：正整数保留、字符串插入、负整数删除，位置按 Unicode 码点计数（Array.from）。
+ * 客户端同一时间只有一个操作在等待服务器确认 (ack)，之后的修改合并到缓冲区中，
+ * 收到其他人的操作时先对等待中和缓冲中的操作做变换。
+ */
+(function (global) {
+  'use strict';
+
+  const chars = (s) => Array.from(s);
+  const charLength = (s) => chars(s).length;
+  const isRetain = (c) => typeof c === 'number' && c > 0;
+  const isDelete = (c) => typeof c === 'number' && c < 0;
+  const isInsert = (c) => typeof c === 'string';
+
+  // 与 ot.py 的 _Builder 相同：合并相邻的同类组件，插入放在删除之前
+  class Builder {
+    constructor() { this.ops = []; }
+    retain(n) {
+      if (!n) return this;
+      const last = this.ops.length - 1;
+      if (last >= 0 && isRetain(this.ops[last])) this.ops[last] += n; else this.ops.push(n);
+      return this;
+    }
+    insert(s) {
+      if (!s) return this;
+      const ops = this.ops, last = ops.length - 1;
+      if (last >= 0 && isInsert(ops[last])) ops[last] += s;
+      else if (last >= 0 && isDelete(ops[last])) {
+        if (last >= 1 && isInsert(ops[last - 1])) ops[last - 1] += s; else ops.splice(last, 0, s);
+      } else ops.push(s);
+      return this;
+    }
+    delete(n) {
+      if (!n) return this;
+      const last = this.ops.length - 1;
+      if (last >= 0 && isDelete(this.ops[last])) this.ops[last] -= n; else this.ops.push(-n);
+      return this;
+    }
+  }
+
+  const OT = {
+    apply(doc, op) {
+      const src = chars(doc), out = [];
+      let pos = 0;
+      for (const c of op) {
+        if (isRetain(c)) { out.push(src.slice(pos, pos + c).join('')); pos += c; }
+        else if (isInsert(c)) out.push(c);
+        else pos -= c;
+      }
+      if (pos !== src.length) throw new Error('操作与文档长度不一致');
+      return out.join('');
+    },
+
+    // 计算把 oldText 变成 newText 的操作：编辑通常集中在一处，去掉相同的首尾即可
+    diff(oldText, newText) {
+      const a = chars(oldText), b = chars(newText);
+      let prefix = 0;
+      while (prefix < a.length && prefix < b.length && a[prefix] === b[prefix]) prefix++;
+      let suffix = 0;
+      while (suffix < a.length - prefix && suffix < b.length - prefix
+             && a[a.length - 1 - suffix] === b[b.length - 1 - suffix]) suffix++;
+      return new Builder().retain(prefix)
+        .insert(b.slice(prefix, b.length - suffix).join(''))
+        .delete(a.length - prefix - suffix)
+        .retain(suffix).ops;
+    },
+
+    isNoop: (op) => op.every(isRetain),
+
+    // 先应用 a 再应用 b 的效果合并为一个操作
+    compose(a, b) {
+      const out = new Builder();
+      let i = 0, j = 0, op1 = a[i++], op2 = b[j++];
+      while (op1 !== undefined || op2 !== undefined) {
+        if (isDelete(op1)) { out.delete(-op1); op1 = a[i++]; continue; }
+        if (isInsert(op2)) { out.insert(op2); op2 = b[j++]; continue; }
+        if (op1 === undefined || op2 === undefined) throw new Error('操作长度不匹配');
+        if (isRetain(op1) && isRetain(op2)) {
+          const n = Math.min(op1, op2); out.retain(n);
+          op1 = op1 - n || a[i++]; op2 = op2 - n || b[j++];
+        } else if (isInsert(op1) && isDelete(op2)) {
+          const s = chars(op1), n = Math.min(s.length, -op2);
+          op1 = s.slice(n).join('') || a[i++]; op2 = op2 + n || b[j++];
+        } else if (isInsert(op1) && isRetain(op2)) {
+          const s = chars(op1), n = Math.min(s.length, op2);
+          out.insert(s.slice(0, n).join(''));
+          op1 = s.slice(n).join('') || a[i++]; op2 = op2 - n || b[j++];
+        } else {  // op1 保留，op2 删除
+          const n = Math.min(op1, -op2); out.delete(n);
+          op1 = op1 - n || a[i++]; op2 = op2 + n || b[j++];
+        }
+      }
+      return out.ops;
+    },
+
+    // 与 ot.transform 相同：同一位置同时插入时 a 的内容在前
+    transform(a, b) {
+      const ap = new Builder(), bp = new Builder();
+      let i = 0, j = 0, op1 = a[i++], op2 = b[j++];
+      while (op1 !== undefined || op2 !== undefined) {
+        if (isInsert(op1)) { ap.insert(op1); bp.retain(charLength(op1)); op1 = a[i++]; continue; }
+        if (isInsert(op2)) { ap.retain(charLength(op2)); bp.insert(op2); op2 = b[j++]; continue; }
+        if (op1 === undefined || op2 === undefined) throw new Error('操作长度不匹配');
+        let n;
+        if (isRetain(op1) && isRetain(op2)) { n = Math.min(op1, op2); ap.retain(n); bp.retain(n); }
+        else if (isDelete(op1) && isDelete(op2)) {
+          n = Math.min(-op1, -op2);
+          op1 = op1 + n || a[i++]; op2 = op2 + n || b[j++];
+          continue;
+        } else if (isDelete(op1)) { n = Math.min(-op1, op2); ap.delete(n); }
+        else { n = Math.min(op1, -op2); bp.delete(n); }
+        op1 = (op1 > 0 ? op1 - n : op1 + n) || a[i++];
+        op2 = (op2 > 0 ? op2 - n : op2 + n) || b[j++];
+      }
+      return [ap.ops, bp.ops];
+    },
+  };
+
+  /**
+   * 一篇笔记的协作会话。
+   * options.onInit({content, title, canEdit, presence})：连接（或重新连接）成功，content 是服务器上的最新内容；
+   * options.onRemote(content)：其他人的操作已经应用，content 是应用后的文档；
+   * options.onPresence(message)、options.onReset(reason)、options.onError(message) 可选。
+   */
+  class NoteRealtime {
+    constructor(noteId, options) {
+      this.noteId = noteId;
+      this.options = options || {};
+      this.doc = '';          // 包含本地未确认修改的文档
+      this.rev = 0;           // 最后一个已知的服务器版本号
+      this.outstanding = null;  // 已发送、等待 ack 的操作
+      this.buffer = null;       // 等待期间积累的本地修改
+      this.closed = false;
+      this.ws = null;
+      this.pingTimer = null;
+      this.connect();
+    }
+
+    connect() {
+      const scheme = location.protocol === 'https:' ? 'wss' : 'ws';
+      this.ws = new WebSocket(`${scheme}://${location.host}/ws/notes/${this.noteId}/`);
+      this.ws.onmessage = (event) => this.handle(JSON.parse(event.data));
+      this.ws.onclose = (event) => {
+        clearInterval(this.pingTimer);
+        // 4409：服务器要求重新加载；其他原因（网络中断等）稍后重连
+        if (!this.closed && event.code !== 4403 && event.code !== 4404) {
+          setTimeout(() => { if (!this.closed) this.connect(); }, event.code === 4409 ? 0 : 2000);
+        }
+      };
+      this.pingTimer = setInterval(() => this.send({ type: 'ping' }), 20000);
+    }
+
+    close() {
+      this.closed = true;
+      clearInterval(this.pingTimer);
+      if (this.ws) this.ws.close();
+    }
+
+    get connected() { return this.ws && this.ws.readyState === WebSocket.OPEN; }
+
+    send(message) {
+      if (this.connected) this.ws.send(JSON.stringify(message));
+    }
+
+    // 本地编辑器的内容变成了 content
+    update(content) {
+      if (content === this.doc) return;
+      const op = OT.diff(this.doc, content);
+      this.doc = content;
+      if (this.outstanding === null) {
+        this.outstanding = op;
+        this.send({ type: 'op', rev: this.rev, op });
+      } else {
+        this.buffer = this.buffer === null ? op : OT.compose(this.buffer, op);
+      }
+    }
+
+    setCursor(cursor) { this.send({ type: 'presence', cursor }); }
+
+    handle(message) {
+      const cb = this.options;
+      switch (message.type) {
+        case 'init':
+          this.rev = message.rev;
+          this.doc = message.content;
+          this.outstanding = this.buffer = null;
+          if (cb.onInit) cb.onInit({ content: message.content, title: message.title,
+                                     canEdit: message.can_edit, presence: message.presence });
+          break;
+        case 'ack':
+          this.rev = message.rev;
+          this.outstanding = this.buffer;
+          this.buffer = null;
+          if (this.outstanding !== null) this.send({ type: 'op', rev: this.rev, op: this.outstanding });
+          break;
+        case 'op': {
+          this.rev = message.rev;
+          let op = message.op;
+          if (this.outstanding !== null) [this.outstanding, op] = OT.transform(this.outstanding, op);
+          if (this.buffer !== null) [this.buffer, op] = OT.transform(this.buffer, op);
+          this.doc = OT.apply(this.doc, op);
+          if (cb.onRemote) cb.onRemote(this.doc, message.user);
+          break;
+        }
+        case 'presence':
+          if (cb.onPresence) cb.onPresence(message);
+          break;
+        case 'reset':
+          if (cb.onReset) cb.onReset(message.reason);
+          break;
+        case 'error':
+          if (cb.onError) cb.onError(message.message);
+          break;
+        default:
+          break;
+      }
+    }
+  }
+
+  NoteRealtime.OT = OT;
+  global.NoteRealtime = NoteRealtime;
+})(window);